@@ -14,6 +14,7 @@ from neo4j_connector import get_graph_connection, GenshinKnowledgeGraph
 from modules.connection_manager import setup_sidebar
 from modules.connection_manager import display_database_statistics
 from modules.qa_panel import display_qa_panel
+from modules.conversation import ConversationContext
 from modules.character_panel import display_character_panel
 from modules.weapon_panel import display_weapon_panel
 from modules.artifact_panel import display_artifact_panel
@@ -43,9 +44,9 @@ def init_session_state():
     # 添加当前选中的标签页
     if 'current_tab' not in st.session_state:
         st.session_state.current_tab = 0  # 默认第一个标签页
-    # 初始化问答历史
+    # 初始化问答历史（多轮对话上下文，追问时复用上一轮的实体和结果）
     if 'qa_history' not in st.session_state:
-        st.session_state.qa_history = []
+        st.session_state.qa_history = ConversationContext()
 
 def main():
     """主函数"""
@@ -0,0 +1,123 @@
+"""
+回答记忆模块 - 不同问法得到相同结果行时，直接复用上一次 LLM 润色出的回答
+
+- 键：(阶段, 意图, 结果行的规范化哈希, 渲染器版本, 该阶段提示词版本, 模型)；
+  “每个国家有多少角色”的各种问法都落到同一个 COUNTRY_CHARACTER_COUNT 结果上，只需润色一次
+- 值带图谱版本：图谱重新导入后旧回答视为未命中并删除
+- 本地 SQLite 持久化（进程重启后仍有效），超过容量按最近使用时间淘汰（LRU）
+- 只缓存 LLM 润色的回答；确定性渲染本来就不花钱。键里没有问题原文，所以只用于规则路由的意图：
+  LLM 生成查询、复合问题与文本检索的回答依赖问题本身，相同结果行也不能复用
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from modules.answer_renderers import RENDERER_VERSION
+
+DEFAULT_ANSWER_MEMO_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        "data", "answer_memo.sqlite")
+DEFAULT_MAX_ENTRIES = 5000
+# 淘汰时多删一些，避免每次写入都触发淘汰
+EVICT_SLACK = 0.1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memo (
+    key           TEXT PRIMARY KEY,
+    graph_version TEXT,
+    answer        TEXT NOT NULL,
+    created_at    REAL NOT NULL,
+    last_used     REAL NOT NULL,
+    hits          INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memo_last_used ON memo (last_used);
+"""
+
+
+def result_hash(rows) -> str:
+    """结果行的规范化哈希：键排序、紧凑分隔符；行的顺序保留（排序后的列表顺序本身就是事实的一部分）"""
+    canonical = json.dumps(rows, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def memo_key(stage: str, intent: Optional[str], rows, prompt_version: str = "", model: str = "") -> str:
+    parts = [stage, intent or "", result_hash(rows), RENDERER_VERSION, prompt_version, model]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class AnswerMemo:
+    """
+    用法：
+        memo = AnswerMemo("data/answer_memo.sqlite")
+        key = memo_key("answer", intent, rows, prompt_version, model)
+        answer = memo.get(key, graph_version)      # 未命中返回 None
+        memo.put(key, graph_version, answer)
+    """
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "writes": 0, "evicted": 0}
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _bump(self, name, n=1):
+        with self._write_lock:
+            self.stats[name] += n
+
+    def get(self, key: str, graph_version: Optional[str]) -> Optional[str]:
+        """命中返回回答并刷新最近使用时间；图谱版本不一致的旧回答删除并视为未命中"""
+        conn = self._conn()
+        row = conn.execute("SELECT answer, graph_version FROM memo WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._bump("misses")
+            return None
+        answer, version = row
+        with self._write_lock, conn:
+            if version != graph_version:
+                conn.execute("DELETE FROM memo WHERE key = ?", (key,))
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE memo SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+            self.stats["hits"] += 1
+        return answer
+
+    def put(self, key: str, graph_version: Optional[str], answer: str):
+        if not answer:
+            return
+        conn = self._conn()
+        now = time.time()
+        with self._write_lock, conn:
+            conn.execute("INSERT OR REPLACE INTO memo (key, graph_version, answer, created_at, last_used, hits) "
+                         "VALUES (?, ?, ?, ?, ?, 0)", (key, graph_version, answer, now, now))
+            self.stats["writes"] += 1
+            count = conn.execute("SELECT count(*) FROM memo").fetchone()[0]
+            if count > self.max_entries:
+                # LRU：按最近使用时间删掉最旧的一批
+                drop = count - int(self.max_entries * (1 - EVICT_SLACK))
+                conn.execute("DELETE FROM memo WHERE key IN (SELECT key FROM memo ORDER BY last_used LIMIT ?)", (drop,))
+                self.stats["evicted"] += drop
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM memo").fetchone()[0]
+
+    def report(self) -> dict:
+        with self._write_lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["entries"] = len(self)
+        return stats
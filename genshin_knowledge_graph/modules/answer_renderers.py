@@ -0,0 +1,286 @@
+"""
+确定性回答渲染模块 - 按结果形状/意图把小结果集直接格式化为中文回答（不调用 LLM）
+
+渲染器按顺序尝试，返回 None 表示“不认识这种形状”，交给下一个渲染器；
+全部不认识（或结果过大）时由调用方交给 LLM 润色。
+"""
+from collections import defaultdict
+from typing import Optional
+
+# 渲染逻辑变更时递增，用于区分不同版本渲染出的回答
+RENDERER_VERSION = "3"
+
+# 列表/表格最多展示的条目数，超出部分用“等N项”收尾
+MAX_LIST_ITEMS = 60
+# 通用表格最多的列数，列太多的结果交给 LLM 归纳
+MAX_TABLE_COLUMNS = 6
+
+FIELD_LABELS = {
+    "name": "名称", "title": "称号", "rarity": "稀有度", "element": "元素",
+    "weapon_type": "武器类型", "country": "国家", "affiliation": "所属", "gender": "性别",
+    "birthday": "生日", "cn_CV": "中文配音", "cv": "中文配音", "constellation": "命之座",
+    "description": "描述", "weapons": "推荐武器", "artifacts": "推荐圣遗物",
+    "type": "类型", "source": "来源", "effect": "特效",
+    "min_attack": "初始攻击力", "max_attack": "满级攻击力",
+    "min_subproperty": "初始副属性", "max_subproperty": "满级副属性",
+    "two_piece_effect": "两件套效果", "four_piece_effect": "四件套效果",
+    "region": "地区", "refresh_time": "刷新时间", "tags": "标签", "drops": "掉落",
+    "dropped_by": "掉落怪物", "characters": "角色", "monsters": "怪物", "materials": "材料",
+    "used_by": "需要的角色/物品", "material": "材料", "character": "角色", "weapon": "武器",
+    "artifact": "圣遗物", "monster": "怪物", "character_count": "角色数量",
+    "from_character": "角色", "to_character": "对象", "relation": "关系", "hint": "说明",
+    "score": "相似度", "shared": "共同特征",
+}
+
+# 单实体 + 名称列表类结果的意图措辞
+INTENT_LIST_TEMPLATES = {
+    "weapon_characters": "适合武器「{subject}」的角色：{items}",
+    "artifact_characters": "适合圣遗物「{subject}」的角色：{items}",
+    "character_weapons": "{subject} 的推荐武器：{items}",
+    "character_artifacts": "{subject} 的推荐圣遗物：{items}",
+    "character_restrains": "{subject} 克制的怪物：{items}",
+    "monster_counters": "克制「{subject}」的角色：{items}",
+    "monster_drops": "「{subject}」的掉落：{items}",
+    "material_users": "需要「{subject}」的角色/物品：{items}",
+    "country_characters": "来自{subject}的角色：{items}",
+    "element_characters": "{subject}元素角色：{items}",
+    "same_cv_of_character": "中文配音为 {subject} 的角色：{items}",
+}
+
+
+def _label(key: str) -> str:
+    return FIELD_LABELS.get(key, key)
+
+
+def _is_empty(v) -> bool:
+    return v is None or v == "" or v == [] or v == {}
+
+
+def _fmt_value(v) -> str:
+    if isinstance(v, bool):
+        return "是" if v else "否"
+    if isinstance(v, (list, tuple)):
+        return _join_items([x for x in v if not _is_empty(x)])
+    if isinstance(v, dict):
+        return "；".join(f"{_label(k)}: {_fmt_value(x)}" for k, x in v.items() if not _is_empty(x))
+    return str(v)
+
+
+def _join_items(items: list) -> str:
+    items = [str(x) for x in items]
+    if len(items) > MAX_LIST_ITEMS:
+        return "、".join(items[:MAX_LIST_ITEMS]) + f" 等{len(items)}项"
+    return "、".join(items)
+
+
+def _is_scalar(v) -> bool:
+    return v is None or isinstance(v, (str, int, float, bool))
+
+
+def _is_scalar_list(v) -> bool:
+    return isinstance(v, list) and all(_is_scalar(x) for x in v)
+
+
+# ---------------------------
+# 各形状的渲染器：(rows, intent) -> str | None
+# ---------------------------
+
+def render_by_cn_cv(rows, intent=None):
+    '''针对“相同中文配音”的两类结果：
+    A) rows: [{cn_CV: 'xxx', characters: ['A','B',...]}]
+    B) rows: [{character1:'A', character2:'B', cn_CV:'xxx'}] 或键名含 cv/cn_CV
+    '''
+    if not isinstance(rows, list) or not rows:
+        return None
+    if intent == "same_cv_of_character":
+        return None
+
+    # A) 已经聚合好了
+    if isinstance(rows[0], dict) and (("cn_CV" in rows[0]) or ("cv" in rows[0])) and ("characters" in rows[0]):
+        lines = ["这些角色的中文配音演员相同，我按配音演员分组整理如下："]
+        for r in rows:
+            cv = r.get("cn_CV") or r.get("cv")
+            chars = r.get("characters") or []
+            if not cv or not isinstance(chars, list) or len(chars) < 2:
+                continue
+            uniq = sorted({c for c in chars if isinstance(c, str) and c.strip()})
+            if len(uniq) >= 2:
+                lines.append(f"- **{cv}**：{'、'.join(uniq)}")
+        return "\n".join(lines).strip() if len(lines) > 1 else None
+
+    # B) 两两配对：聚合一下
+    cv_key = None
+    for k in rows[0].keys():
+        if k in ("cn_CV", "cv"):
+            cv_key = k
+            break
+    if not cv_key:
+        return None
+
+    by_cv = defaultdict(set)
+    for r in rows:
+        cv = r.get(cv_key)
+        if not cv:
+            continue
+        for kk, vv in r.items():
+            if kk.startswith("character") and isinstance(vv, str) and vv.strip():
+                by_cv[cv].add(vv.strip())
+
+    if not by_cv:
+        return None
+    lines = ["这些角色的中文配音演员相同，我按配音演员分组整理如下："]
+    for cv, chars in sorted(by_cv.items(), key=lambda x: str(x[0])):
+        if len(chars) < 2:
+            continue
+        lines.append(f"- **{cv}**：{'、'.join(sorted(chars))}")
+    return "\n".join(lines).strip() if len(lines) > 1 else None
+
+
+def render_attribute_value(rows, intent=None):
+    """单属性问答：[{name, attribute, value}]"""
+    if len(rows) != 1 or set(rows[0].keys()) != {"name", "attribute", "value"}:
+        return None
+    r = rows[0]
+    if _is_empty(r.get("value")):
+        return f"知识图谱中没有记录 {r.get('name')} 的{r.get('attribute')}。"
+    return f"{r.get('name')} 的{r.get('attribute')}是：{_fmt_value(r.get('value'))}。"
+
+
+def render_material_sources(rows, intent=None):
+    """材料 + 来源表：每行至少有 material 和 source/dropped_by"""
+    keys = set(rows[0].keys())
+    if "material" not in keys or not ({"source", "dropped_by"} & keys):
+        return None
+    cols = [k for k in ("material", "type", "source", "dropped_by") if k in keys]
+    lines = ["| " + " | ".join(_label(c) for c in cols) + " |",
+             "| " + " | ".join("---" for _ in cols) + " |"]
+    for r in rows:
+        cells = [_fmt_value(r.get(c)) if not _is_empty(r.get(c)) else "-" for c in cols]
+        lines.append("| " + " | ".join(c.replace("|", "/").replace("\n", " ") for c in cells) + " |")
+    return "\n".join(lines)
+
+
+def render_text_passages(rows, intent=None):
+    """文本检索结果：按来源/标题引用原文段落"""
+    if intent != "text_search" or not all("text" in r for r in rows):
+        return None
+    lines = ["在角色文本中找到以下相关内容："]
+    for r in rows:
+        head = "·".join(str(r.get(k)) for k in ("character", "source", "title") if not _is_empty(r.get(k)))
+        lines.append(f"- **{head}**：{r.get('text')}")
+    return "\n".join(lines)
+
+
+def render_name_list(rows, intent=None):
+    """单实体 + 一个名称列表：[{weapon: 'X', characters: [...]}]"""
+    if len(rows) != 1:
+        return None
+    r = rows[0]
+    list_keys = [k for k, v in r.items() if _is_scalar_list(v)]
+    scalar_keys = [k for k, v in r.items() if _is_scalar(v)]
+    if len(list_keys) != 1 or len(scalar_keys) != 1:
+        return None
+    subject = r.get(scalar_keys[0])
+    items = [x for x in r.get(list_keys[0]) or [] if not _is_empty(x)]
+    items_text = _join_items(items) if items else "暂无记录"
+    template = INTENT_LIST_TEMPLATES.get(intent)
+    if template:
+        return template.format(subject=subject, items=items_text)
+    return f"**{subject}** 的{_label(list_keys[0])}：{items_text}"
+
+
+def render_attribute_card(rows, intent=None):
+    """单实体属性卡片：一行、多个字段"""
+    if len(rows) != 1 or len(rows[0]) < 2:
+        return None
+    r = rows[0]
+    title = r.get("name") or r.get("character") or r.get("weapon") or r.get("artifact") or r.get("monster")
+    lines = [f"**{title}** 的信息：" if title else "查询结果："]
+    for k, v in r.items():
+        if _is_empty(v) or v == title:
+            continue
+        lines.append(f"- {_label(k)}：{_fmt_value(v)}")
+    return "\n".join(lines) if len(lines) > 1 else None
+
+
+def render_grouped_counts(rows, intent=None):
+    """分组计数：每行一个分组键 + 一个数值"""
+    if any(len(r) != 2 for r in rows):
+        return None
+    keys = list(rows[0].keys())
+    num_key = next((k for k in keys if isinstance(rows[0].get(k), (int, float)) and not isinstance(rows[0].get(k), bool)), None)
+    if not num_key:
+        return None
+    group_key = next(k for k in keys if k != num_key)
+    lines = [f"按{_label(group_key)}统计的{_label(num_key)}如下："]
+    for r in rows:
+        if set(r.keys()) != set(keys) or not isinstance(r.get(num_key), (int, float)):
+            return None
+        lines.append(f"- {_fmt_value(r.get(group_key))}：{r.get(num_key)}")
+    return "\n".join(lines)
+
+
+def render_single_column(rows, intent=None):
+    """单列标量结果：直接列出"""
+    keys = set(rows[0].keys())
+    if len(keys) != 1 or any(set(r.keys()) != keys or not _is_scalar(next(iter(r.values()))) for r in rows):
+        return None
+    key = next(iter(keys))
+    items = []
+    for r in rows:
+        v = r.get(key)
+        if not _is_empty(v) and v not in items:
+            items.append(v)
+    if not items:
+        return None
+    return f"查询到的{_label(key)}：{_join_items(items)}"
+
+
+def render_table(rows, intent=None):
+    """同构的标量行：Markdown 表格"""
+    keys = list(rows[0].keys())
+    if len(keys) > MAX_TABLE_COLUMNS:
+        return None
+    for r in rows:
+        if list(r.keys()) != keys or not all(_is_scalar(v) or _is_scalar_list(v) for v in r.values()):
+            return None
+    lines = ["| " + " | ".join(_label(k) for k in keys) + " |",
+             "| " + " | ".join("---" for _ in keys) + " |"]
+    for r in rows:
+        cells = [_fmt_value(r.get(k)) if not _is_empty(r.get(k)) else "-" for k in keys]
+        lines.append("| " + " | ".join(c.replace("|", "/").replace("\n", " ") for c in cells) + " |")
+    return "\n".join(lines)
+
+
+RENDERERS = [
+    render_text_passages,
+    render_by_cn_cv,
+    render_attribute_value,
+    render_material_sources,
+    render_name_list,
+    render_attribute_card,
+    render_grouped_counts,
+    render_single_column,
+    render_table,
+]
+
+
+def render_rows(rows, intent: Optional[str] = None, max_rows: int = 30) -> Optional[str]:
+    """
+    按形状/意图确定性渲染查询结果
+    Args:
+        rows: 清洗后的查询结果（list[dict]）
+        intent: 路由得到的意图名（可为空）
+        max_rows: 超过该行数不做确定性渲染，交给 LLM 归纳
+    Returns:
+        渲染好的回答；None 表示需要 LLM
+    """
+    if not isinstance(rows, list) or not rows or len(rows) > max_rows:
+        return None
+    if not all(isinstance(r, dict) and r for r in rows):
+        return None
+    for renderer in RENDERERS:
+        out = renderer(rows, intent)
+        if out:
+            return out
+    return None
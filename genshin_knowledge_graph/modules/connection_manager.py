@@ -1,8 +1,18 @@
 """
 连接管理模块 - 处理数据库连接相关功能
 """
+import uuid
+
 import streamlit as st
 from openai import OpenAI
+from modules.llm_limiter import get_llm_limiter, LLMOverloaded
+
+
+def _llm_session_id():
+    """当前 Streamlit 会话在 LLM 公平队列里的标识"""
+    if 'llm_session_id' not in st.session_state:
+        st.session_state.llm_session_id = uuid.uuid4().hex[:12]
+    return st.session_state.llm_session_id
 
 def setup_sidebar(kg) -> bool:
     """
@@ -388,12 +398,13 @@ def test_llm_connection():
                 base_url=llm_config["api_base"]
             )
             
-            # 尝试简单的测试请求
-            response = client.chat.completions.create(
-                model=llm_config["model_id"],
-                messages=[{"role": "user", "content": "Hello, say 'test successful' if you can hear me."}],
-                max_tokens=10
-            )
+            # 尝试简单的测试请求（经过全进程的 LLM 准入，排队过长时直接提示稍后再试）
+            with get_llm_limiter().slot(_llm_session_id()):
+                response = client.chat.completions.create(
+                    model=llm_config["model_id"],
+                    messages=[{"role": "user", "content": "Hello, say 'test successful' if you can hear me."}],
+                    max_tokens=10
+                )
             
             if response and response.choices:
                 st.session_state.llm_status = "已连接"
@@ -403,6 +414,8 @@ def test_llm_connection():
                 st.session_state.llm_status = "连接失败"
                 st.error("❌ LLM连接测试失败: 无响应")
                 
+    except LLMOverloaded as e:
+        st.warning(f"⚠️ {str(e)}")
     except Exception as e:
         st.session_state.llm_status = "连接失败"
         st.error(f"❌ LLM连接测试失败: {str(e)}")
@@ -0,0 +1,200 @@
+"""
+多轮对话上下文模块 - 追问时复用上一轮的实体与结果集
+
+- 保存最近 N 轮问答：原问题、补全后的问题、意图、参数、实体、Cypher、结果行
+- 指代/省略补全（只改写省略的追问，能独立回答的问题原样保留）：
+    “那她的生日呢”       -> 代词替换成上一轮实体：“胡桃的生日”
+    “对应的来源是什么”   -> 无实体，与上一问拼接后可路由：“神里绫华什么突破材料对应的来源是什么”
+    “那钟离呢”           -> 只换了实体的省略问法，沿用上一轮问法：“钟离的详细信息”
+- 命中缓存：补全后的问题与某一轮查询计划相同，或只是问上一轮结果里已有的角色属性，直接用缓存行回答
+"""
+import re
+import threading
+from collections import deque
+from typing import Callable, List, Optional
+
+# 默认保留的轮数
+DEFAULT_MAX_TURNS = 5
+
+# 指代上一轮实体的多字代词：出现在任意位置都算（长的在前，避免“她们”只替换掉“她”）
+_PRONOUNS = ["这个角色", "那个角色", "该角色", "它们", "他们", "她们", "这位", "那位"]
+# 单字代词只在“独立成词”时算：句首、后接“的”、或在介词/连词之后（“和她”“给他”）；
+# 常见合成词（其他/其中/吉他……）里的字不算，“应该”“其实”之类自然也不会被替换
+_SINGLE_PRONOUN_RE = re.compile(
+    r"(?:^|(?<=[和跟与给对让被比把同]))(?:他|她|它)(?!们)|(?<=[^其吉])(?:他|她|它)(?=的)|^其(?![他它中实余次后])")
+# 追问常见的口语首尾（“那……呢？” / “还有……”）
+_LEADING_FILLERS = re.compile(r"^(那么|那|还有|另外|再问一下|顺便问下)[，,\s]*")
+_TRAILING_FILLERS = re.compile(r"[呢吗呀啊？?。!！\s]+$")
+# 省略问法的标志：口语首尾（“那……呢”）或承接上一问的开头（“对应的……”“的……”）
+_ELLIPSIS_START = re.compile(r"^(对应|相应|的)")
+
+
+def _strip_fillers(question: str) -> str:
+    q = _TRAILING_FILLERS.sub("", (question or "").strip())
+    return _LEADING_FILLERS.sub("", q).strip()
+
+
+def _is_elliptical(question: str, core: str) -> bool:
+    """问题带追问口吻：有口语首尾（那/还有……呢），或以“对应的/的”开头"""
+    q = (question or "").strip()
+    return bool(_LEADING_FILLERS.match(q) or re.search(r"呢[？?。!！\s]*$", q) or _ELLIPSIS_START.match(core))
+
+
+def _find_pronoun(text: str) -> Optional[tuple]:
+    """第一个独立的代词 (start, end)；没有返回 None"""
+    best = None
+    for p in _PRONOUNS:
+        idx = text.find(p)
+        if idx >= 0 and (best is None or idx < best[0]):
+            best = (idx, idx + len(p))
+    m = _SINGLE_PRONOUN_RE.search(text)
+    if m and (best is None or m.start() < best[0]):
+        best = (m.start(), m.end())
+    return best
+
+
+def _replace_pronoun(text: str, entity: str) -> Optional[str]:
+    """把第一个独立的代词换成实体；没有代词返回 None"""
+    found = _find_pronoun(text)
+    if found is None:
+        return None
+    return text[:found[0]] + entity + text[found[1]:]
+
+
+class ConversationContext:
+    """
+    最近 N 轮问答的上下文（每个会话一个实例）
+
+    用法：
+        ctx = ConversationContext(max_turns=5)
+        engine.ask("胡桃的详细信息", conversation=ctx)
+        engine.ask("那她的生日呢", conversation=ctx)   # 由上一轮结果直接回答，不访问数据库
+    """
+
+    def __init__(self, max_turns: int = DEFAULT_MAX_TURNS):
+        self.max_turns = max(1, int(max_turns or 1))
+        self.turns = deque(maxlen=self.max_turns)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.turns)
+
+    def clear(self):
+        with self._lock:
+            self.turns.clear()
+
+    def last_turn(self) -> Optional[dict]:
+        with self._lock:
+            return self.turns[-1] if self.turns else None
+
+    def add_turn(self, question: str, resolved_question: str, plan: Optional[dict], entity: Optional[str],
+                 cypher: Optional[str], rows, answer: Optional[str] = None, from_cache: bool = False) -> dict:
+        """记录一轮问答；只有 list 结果会被缓存（错误信息不缓存）"""
+        plan = plan or {}
+        turn = {
+            "question": question,
+            "resolved_question": resolved_question,
+            "intent": plan.get("intent"),
+            "params": dict(plan.get("params") or {}),
+            "entity": entity,
+            "cypher": cypher,
+            "rows": rows if isinstance(rows, list) else None,
+            "answer": answer,
+            "from_cache": from_cache,
+        }
+        with self._lock:
+            self.turns.append(turn)
+        return turn
+
+    def last_entity(self) -> Optional[str]:
+        """最近一轮出现过的实体（问题中的原始写法）"""
+        with self._lock:
+            for turn in reversed(self.turns):
+                if turn.get("entity"):
+                    return turn["entity"]
+        return None
+
+    def resolve(self, question: str, linker=None, can_route: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        用上下文补全追问；只改写真正省略的追问，其余问题原样返回：
+        - 本身就能规则路由的问题（含不需要实体的统计/分组问题）不动
+        - 带实体的问题只有“实体 + 口语首尾”（“那钟离呢”）才沿用上一轮问法
+        - 独立的代词（“她的生日”“和她什么关系”）换成上一轮实体
+        - 没有实体也没有代词的问题，只有带追问口吻且补全后能规则路由时才补全；
+          否则（文本检索、LLM 问题）原样交给后续环节
+        Args:
+            linker: 实体链接器，用于判断问题里是否已有实体
+            can_route: 可选回调 question -> bool，判断问题能否被规则路由；不传时只做代词替换与“实体 + 口语首尾”
+        Returns:
+            补全后的问题；不需要补全或没有上下文时原样返回
+        """
+        question = (question or "").strip()
+        last = self.last_turn()
+        prev_entity = self.last_entity()
+        if not question or last is None or not prev_entity:
+            return question
+        if can_route is not None and can_route(question):
+            return question
+        prev_raw = last.get("resolved_question") or ""
+        routable = can_route or (lambda q: True)
+        core = _strip_fillers(question)
+        if not core:
+            return question
+
+        spans = linker.link(question) if linker else []
+        if spans:
+            # 只换了实体的省略问法：“那钟离呢” -> 沿用上一轮问法
+            entity = question[spans[0]["start"]:spans[0]["end"]]
+            if len(spans) == 1 and core == entity and prev_entity in prev_raw and prev_entity != entity:
+                candidate = prev_raw.replace(prev_entity, entity)
+                if routable(candidate):
+                    return candidate
+            return question
+
+        # 1) 代词指代：换成上一轮的实体
+        with_entity = _replace_pronoun(core, prev_entity)
+        if with_entity is not None:
+            return with_entity
+        if can_route is None or not _is_elliptical(question, core):
+            return question
+        # 2) 省略主语：“那生日呢” -> 补上上一轮的实体
+        with_entity = prev_entity + ("" if core.startswith("的") else "的") + core
+        if can_route(with_entity):
+            return with_entity
+        # 3) 对上一问的细化：“对应的来源是什么”（只认承接上一问的开头；上一问本身能路由，随便拼什么都能路由）
+        if _ELLIPSIS_START.match(core):
+            refined = prev_raw.rstrip("？?。!！ ") + core
+            if can_route(refined):
+                return refined
+        return question
+
+    def find_rows(self, plan: Optional[dict]) -> Optional[dict]:
+        """
+        在缓存里找能直接回答该查询计划的结果
+        Returns:
+            {"rows", "turn", "exact"}；exact=True 表示同一查询计划的原样结果，
+            否则为从上一轮角色信息行里取出的属性（与 CHARACTER_ATTRIBUTE 的列一致）；找不到返回 None
+        """
+        if not plan or not plan.get("cypher") or plan.get("source") == "llm":
+            return None
+        intent, params = plan.get("intent"), plan.get("params") or {}
+        with self._lock:
+            turns = list(reversed(self.turns))
+        for turn in turns:
+            if turn["rows"] is None:
+                continue
+            if turn["intent"] == intent and turn["params"] == params and turn["rows"]:
+                return {"rows": turn["rows"], "turn": turn, "exact": True}
+        if intent == "character_attribute" and params.get("prop"):
+            name, prop = params.get("name"), params["prop"]
+            for turn in turns:
+                for row in turn["rows"] or []:
+                    if isinstance(row, dict) and row.get("name") == name and prop in row:
+                        rows = [{"name": name, "attribute": params.get("attribute"), "value": row[prop]}]
+                        return {"rows": rows, "turn": turn, "exact": False}
+        return None
+
+    def to_list(self) -> List[dict]:
+        """对话记录（不含结果行），用于界面展示"""
+        with self._lock:
+            return [{k: v for k, v in t.items() if k != "rows"} for t in self.turns]
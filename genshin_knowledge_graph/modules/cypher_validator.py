@@ -0,0 +1,233 @@
+"""
+Cypher 静态校验模块 - 执行前对照图谱 Schema 快照检查 LLM 生成的查询
+
+只做轻量的正则级解析（不是完整的 Cypher 语法分析）：
+- MATCH 等模式里的节点标签、关系类型、节点/关系内联属性
+- 变量的属性访问（变量在模式中声明了标签时才检查）
+- $参数 是否都已提供
+- 变长路径必须有上界且不超过 MAX_VAR_LENGTH_HOPS；不允许写操作
+- 缺少 LIMIT 默认不算错误：执行时由 query_guard.ensure_limit 补上（改写比让 LLM 重新生成便宜）；
+  不经过成本护栏执行的调用方可以传 require_limit=True
+校验失败时调用方可以把错误反馈给 LLM 重新生成一次，而不用浪费一次数据库往返。
+"""
+import re
+from typing import Dict, List, Optional, Set
+
+# 变长路径允许的最大跳数
+MAX_VAR_LENGTH_HOPS = 4
+
+# 与 qa_engine 中“强制Schema约束”一致的手工 Schema；无法从数据库读取 Schema 时使用
+MANUAL_NODE_PROPERTIES = {
+    "SlotGroup": ["id", "name", "description", "slot_template_ids", "label", "group_type", "mutual_exclusive",
+                  "min_select", "max_select", "team_template_id"],
+    "SlotTemplate": ["id", "evidence", "need", "label", "slot", "slot_group_id", "must", "team_template_id"],
+    "TeamTemplate": ["id", "archetype_name", "focus", "label", "core_evidence", "core_character",
+                     "example_team_members", "example_team_evidence", "core_role"],
+    "artifact": ["id", "min/max_rarity", "4piece_effect", "name", "source", "2piece_effect", "img_src",
+                 "suits_roles", "recommended_roles"],
+    "character": ["id", "name", "img_src", "profession", "birthday", "country", "cn_CV", "gender", "weapon_type",
+                  "description", "title", "primordial_force", "constellation", "affiliation", "species", "nickname",
+                  "body_type", "special_dish", "TAG", "rarity", "element"],
+    "country": ["id", "name", "description", "army", "en_name"],
+    "element": ["id", "name"],
+    "material": ["id", "name", "source", "img_src", "type", "usage"],
+    "monster": ["id", "name", "img_src", "TAG", "element", "type", "drop", "region", "strategy", "refresh_time"],
+    "reaction": ["id", "name", "reaction_element"],
+    "role_tag": ["id", "name", "description", "aliases"],
+    "weapon": ["id", "name", "source", "img_src", "rarity", "type", "max_subproperty", "min_subproperty",
+               "min_attack", "effect", "max_attack"],
+}
+MANUAL_REL_TYPES = [
+    "CANDIDATE", "CORE", "EXAMPLE_MEMBER", "HAS_SLOT", "HAS_SLOT_GROUP", "REQUIRES_ROLE_TAG",
+    "belongs_role_tag", "drops_material", "from_country", "has_element", "needs_material",
+    "restrains", "suits", "suits_weapon", "trigger",
+]
+
+SCHEMA_LABELS_QUERY = "CALL db.labels() YIELD label RETURN collect(label) AS labels"
+SCHEMA_REL_TYPES_QUERY = "CALL db.relationshipTypes() YIELD relationshipType RETURN collect(relationshipType) AS types"
+SCHEMA_NODE_PROPS_QUERY = """
+CALL db.schema.nodeTypeProperties() YIELD nodeLabels, propertyName
+RETURN nodeLabels, propertyName
+""".strip()
+SCHEMA_REL_PROPS_QUERY = """
+CALL db.schema.relTypeProperties() YIELD relType, propertyName
+RETURN relType, propertyName
+""".strip()
+
+_IDENT = r"(?:`[^`]+`|[A-Za-z_一-鿿][\w一-鿿]*)"
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_NODE_RE = re.compile(r"\(\s*(" + _IDENT + r")?\s*((?::\s*" + _IDENT + r"\s*(?:[|&]\s*:?\s*" + _IDENT + r"\s*)*)+)?\s*(\{[^{}]*\})?\s*\)")
+_REL_RE = re.compile(r"\[\s*(" + _IDENT + r")?\s*(:\s*" + _IDENT + r"(?:\s*\|\s*:?\s*" + _IDENT + r")*)?\s*(\*\s*\d*\s*(?:\.\.\s*\d*)?)?\s*(\{[^{}]*\})?\s*\]")
+_PROP_ACCESS_RE = re.compile(r"(?<![\w.$])(" + _IDENT + r")\s*\.\s*(" + _IDENT + r")")
+_MAP_KEY_RE = re.compile(r"(" + _IDENT + r")\s*:")
+_PARAM_RE = re.compile(r"\$(\w+)")
+_WRITE_RE = re.compile(r"\b(CREATE|MERGE|DELETE|DETACH|SET|REMOVE|DROP|LOAD\s+CSV)\b", re.I)
+_RETURN_RE = re.compile(r"\bRETURN\b", re.I)
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+|\$\w+)", re.I)
+_AGGREGATE_ONLY_RE = re.compile(
+    r"^\s*(?:DISTINCT\s+)?(?:(?:count|sum|avg|min|max)\s*\([^()]*\)(?:\s+AS\s+" + _IDENT + r")?\s*,?\s*)+$", re.I)
+
+
+def _unquote(name: str) -> str:
+    return name[1:-1] if name and name.startswith("`") and name.endswith("`") else name
+
+
+class SchemaSnapshot:
+    """
+    图谱 Schema 快照：标签、关系类型及各自的属性
+    strict=False（手工 Schema）时不检查关系类型和属性名，因为角色之间的关系类型是数据里的谓词，无法穷举
+    """
+
+    def __init__(self, node_properties: Dict[str, List[str]], rel_types: List[str],
+                 rel_properties: Optional[Dict[str, List[str]]] = None, strict: bool = True):
+        self.node_properties = {label: set(props or []) for label, props in (node_properties or {}).items()}
+        self.labels: Set[str] = set(self.node_properties)
+        self.rel_types: Set[str] = set(rel_types or [])
+        self.rel_properties = {t: set(props or []) for t, props in (rel_properties or {}).items()}
+        self.strict = strict
+
+    @classmethod
+    def manual(cls):
+        return cls(MANUAL_NODE_PROPERTIES, MANUAL_REL_TYPES, strict=False)
+
+    @classmethod
+    def from_graph(cls, driver):
+        """用 db.labels / db.relationshipTypes / db.schema.* 读取 Schema（只读元数据，不扫描全图）"""
+        node_props = {}
+        rel_props = {}
+        with driver.session() as session:
+            labels = session.run(SCHEMA_LABELS_QUERY).single()["labels"] or []
+            rel_types = session.run(SCHEMA_REL_TYPES_QUERY).single()["types"] or []
+            for label in labels:
+                node_props.setdefault(label, [])
+            for record in session.run(SCHEMA_NODE_PROPS_QUERY):
+                for label in record["nodeLabels"] or []:
+                    if record["propertyName"]:
+                        node_props.setdefault(label, []).append(record["propertyName"])
+            for record in session.run(SCHEMA_REL_PROPS_QUERY):
+                rel_type = _unquote((record["relType"] or "").lstrip(":"))
+                if rel_type and record["propertyName"]:
+                    rel_props.setdefault(rel_type, []).append(record["propertyName"])
+        # 手工 Schema 里的标签/属性也视为合法（空库或部分导入时不至于全部判错）
+        for label, props in MANUAL_NODE_PROPERTIES.items():
+            node_props.setdefault(label, []).extend(props)
+        return cls(node_props, list(rel_types) + MANUAL_REL_TYPES, rel_props, strict=True)
+
+
+def _strip_literals(cypher: str) -> str:
+    """去掉注释与字符串字面量，避免把字符串里的内容当作标签/属性"""
+    return _STRING_RE.sub("''", _COMMENT_RE.sub(" ", cypher or ""))
+
+
+def _labels_of(spec: str) -> List[str]:
+    return [_unquote(x) for x in re.findall(_IDENT, spec or "")]
+
+
+def _map_keys(map_text: str) -> List[str]:
+    return [_unquote(k) for k in _MAP_KEY_RE.findall((map_text or "").strip("{}"))]
+
+
+def _check_var_length(spec: str) -> Optional[str]:
+    """变长路径：*、*2..、*.. 都没有上界；上界超过 MAX_VAR_LENGTH_HOPS 也拒绝"""
+    body = spec.replace(" ", "")[1:]
+    if body == "" or body.endswith(".."):
+        return f"变长路径 [{spec}] 没有跳数上界，请写成 *1..{MAX_VAR_LENGTH_HOPS} 这样的有界形式"
+    upper = body.split("..")[-1]
+    if upper.isdigit() and int(upper) > MAX_VAR_LENGTH_HOPS:
+        return f"变长路径 [{spec}] 跳数上界过大（最多 {MAX_VAR_LENGTH_HOPS} 跳）"
+    return None
+
+
+def _check_limit(text: str) -> Optional[str]:
+    """返回行的查询必须带 LIMIT；最后一个 RETURN 只有聚合函数（只会返回一行）时可以不带"""
+    returns = list(_RETURN_RE.finditer(text))
+    if not returns:
+        return None
+    tail = text[returns[-1].end():]
+    if _LIMIT_RE.search(tail):
+        return None
+    items = re.split(r"\b(?:ORDER\s+BY|SKIP|UNION)\b", tail, flags=re.I)[0]
+    if _AGGREGATE_ONLY_RE.match(items):
+        return None
+    return "查询缺少 LIMIT，请在最后的 RETURN 后加上 LIMIT 20"
+
+
+def validate_cypher(cypher: str, schema: Optional[SchemaSnapshot] = None, params: Optional[dict] = None,
+                    require_limit: bool = False) -> List[str]:
+    """
+    对照 Schema 快照静态校验 Cypher
+    Args:
+        cypher: 待校验的查询
+        schema: Schema 快照，默认使用手工 Schema
+        params: 将随查询一起传入的参数
+        require_limit: 返回行的查询缺少 LIMIT 时是否报错；默认交给执行时的 ensure_limit 补上
+    Returns:
+        错误描述列表；空列表表示通过
+    """
+    schema = schema or SchemaSnapshot.manual()
+    text = _strip_literals(cypher)
+    errors = []
+
+    def add(msg):
+        if msg not in errors:
+            errors.append(msg)
+
+    if _WRITE_RE.search(text):
+        add("问答只允许只读查询，不能包含 CREATE/MERGE/SET/DELETE 等写操作")
+
+    var_labels: Dict[str, Set[str]] = {}
+    var_rel_types: Dict[str, Set[str]] = {}
+
+    for m in _NODE_RE.finditer(text):
+        var, label_spec, props = _unquote(m.group(1) or ""), m.group(2), m.group(3)
+        labels = _labels_of(label_spec)
+        for label in labels:
+            if label not in schema.labels:
+                add(f"图谱中不存在节点标签 :{label}")
+        if var and labels:
+            var_labels.setdefault(var, set()).update(labels)
+        if props and schema.strict:
+            for key in _map_keys(props):
+                if labels and not any(key in schema.node_properties.get(label, ()) for label in labels):
+                    add(f"节点 :{'/'.join(labels)} 没有属性 {key}")
+
+    for m in _REL_RE.finditer(text):
+        var, type_spec, var_length, props = _unquote(m.group(1) or ""), m.group(2), m.group(3), m.group(4)
+        types = _labels_of(type_spec)
+        if schema.strict:
+            for t in types:
+                if t not in schema.rel_types:
+                    add(f"图谱中不存在关系类型 :{t}")
+        if var and types:
+            var_rel_types.setdefault(var, set()).update(types)
+        if var_length:
+            problem = _check_var_length(var_length)
+            if problem:
+                add(problem)
+        if props and schema.strict and types:
+            for key in _map_keys(props):
+                if not any(key in schema.rel_properties.get(t, ()) for t in types):
+                    add(f"关系 :{'/'.join(types)} 没有属性 {key}")
+
+    if schema.strict:
+        for m in _PROP_ACCESS_RE.finditer(text):
+            var, prop = _unquote(m.group(1)), _unquote(m.group(2))
+            if var in var_labels:
+                labels = var_labels[var]
+                if not any(prop in schema.node_properties.get(label, ()) for label in labels):
+                    add(f"节点 {var}:{'/'.join(sorted(labels))} 没有属性 {prop}")
+            elif var in var_rel_types:
+                types = var_rel_types[var]
+                if not any(prop in schema.rel_properties.get(t, ()) for t in types):
+                    add(f"关系 {var}:{'/'.join(sorted(types))} 没有属性 {prop}")
+
+    provided = set((params or {}).keys())
+    for name in _PARAM_RE.findall(text):
+        if name not in provided:
+            add(f"查询引用了未提供的参数 ${name}，请把值直接写进查询")
+
+    limit_problem = _check_limit(text) if require_limit else None
+    if limit_problem:
+        add(limit_problem)
+    return errors
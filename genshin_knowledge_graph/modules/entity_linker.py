@@ -0,0 +1,248 @@
+"""
+实体链接模块 - 基于 Aho-Corasick 自动机的词典式实体识别
+
+从图谱中一次性加载所有实体名、角色昵称(nickname)与 role_tag 别名(aliases)，
+构建多模式匹配自动机；对问题做一次线性扫描，返回带类型的实体片段（最长匹配优先）。
+"""
+import json
+import os
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+# 参与链接的节点标签（character_voice 数量大且名字是台词标题，不参与）
+LINKABLE_LABELS = [
+    "character", "weapon", "artifact", "material", "monster",
+    "country", "element", "reaction", "role_tag",
+]
+
+# 同一别名对应多个实体时的类型优先级（数值越小越优先）
+LABEL_PRIORITY = {
+    "character": 0,
+    "weapon": 1,
+    "artifact": 2,
+    "monster": 3,
+    "material": 4,
+    "role_tag": 5,
+    "country": 6,
+    "element": 7,
+    "reaction": 8,
+}
+
+# 别名最短长度：单字别名（如“奶”“拐”）误命中太多，不进入词典；单字规范名同理（“龙”“影”“盐”会命中
+# “龙脊雪山”“影响”“盐焗”并吃掉最长匹配），只有下面白名单里的单字实体保留
+MIN_ALIAS_LEN = 2
+SINGLE_CHAR_NAMES = {
+    "character": {"魈", "琴"},
+}
+
+ENTITY_NAMES_QUERY = """
+MATCH (n)
+WHERE n.name IS NOT NULL AND any(l IN labels(n) WHERE l IN $labels)
+RETURN [l IN labels(n) WHERE l IN $labels][0] AS label,
+       n.name AS name, n.nickname AS nickname, n.aliases AS aliases
+""".strip()
+
+
+class AhoCorasick:
+    """最小实现的 Aho-Corasick 自动机：add() 若干模式后 build()，再用 iter_matches() 扫描文本"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[tuple]] = [[]]
+        self._built = False
+
+    def add(self, pattern: str, payload):
+        """加入一个模式串及其负载；同一模式可挂多个负载"""
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), payload))
+        self._built = False
+
+    def build(self):
+        """BFS 计算失败指针，并把失败链上的输出合并到当前状态"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                if self._fail[nxt] == nxt:
+                    self._fail[nxt] = 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._built = True
+
+    def iter_matches(self, text: str):
+        """线性扫描文本，产出 (start, end, payload)，end 为开区间"""
+        if not self._built:
+            self.build()
+        state = 0
+        for i, ch in enumerate(text or ""):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, payload in self._out[state]:
+                yield i + 1 - length, i + 1, payload
+
+
+def _normalize_alias(alias: str) -> List[str]:
+    """别名清洗：去掉括号注释、书名号/引号，返回可用的别名变体"""
+    if not isinstance(alias, str):
+        return []
+    raw = alias.strip()
+    variants = {raw}
+    stripped = re.sub(r"[（(][^）)]*[）)]", "", raw)
+    stripped = re.sub(r"[「」『』“”\"']", "", stripped).strip()
+    if stripped:
+        variants.add(stripped)
+    return [v for v in variants if len(v) >= MIN_ALIAS_LEN]
+
+
+def _as_list(value) -> list:
+    """nickname/aliases 在图里可能是列表，也可能是用顿号/逗号拼接的字符串"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [v for v in value if isinstance(v, str)]
+    if isinstance(value, str):
+        return [v for v in re.split(r"[、,，;；/]", value) if v.strip()]
+    return []
+
+
+class EntityLinker:
+    """
+    词典式实体链接器
+
+    用法：
+        linker = EntityLinker.from_graph(driver)
+        linker.link("护摩之杖适合哪些角色？")
+        # -> [{"start": 0, "end": 4, "text": "护摩之杖", "label": "weapon", "name": "护摩之杖"}]
+    """
+
+    def __init__(self):
+        self._automaton = AhoCorasick()
+        self._entries: Dict[str, Dict[tuple, int]] = {}
+        self.size = 0
+
+    def add_entity(self, label: str, name: str, aliases: Iterable[str] = ()):
+        """登记一个实体（规范名 + 别名）"""
+        if not label or not isinstance(name, str) or not name.strip():
+            return
+        name = name.strip()
+        surfaces = set(_normalize_alias(name))
+        if len(name) < MIN_ALIAS_LEN and name in SINGLE_CHAR_NAMES.get(label, ()):
+            surfaces.add(name)
+        # 元素名只有一个字：补一个“X元素”的写法，避免单字误命中
+        if label == "element":
+            surfaces.discard(name)
+            surfaces.add(f"{name}元素")
+        for alias in aliases or ():
+            surfaces.update(_normalize_alias(alias))
+
+        for surface in surfaces:
+            bucket = self._entries.get(surface)
+            if bucket is None:
+                bucket = self._entries[surface] = {}
+                self._automaton.add(surface, surface)
+            # 规范名本身优先于别名
+            is_alias = 0 if surface == name else 1
+            key = (label, name)
+            bucket[key] = min(bucket.get(key, is_alias), is_alias)
+        self.size += 1
+
+    def add_records(self, records: Iterable[dict]):
+        """批量登记 {label, name, nickname, aliases} 形式的记录"""
+        for r in records or []:
+            if not isinstance(r, dict):
+                continue
+            aliases = _as_list(r.get("nickname")) + _as_list(r.get("aliases"))
+            self.add_entity(r.get("label"), r.get("name"), aliases)
+        self._automaton.build()
+        return self
+
+    @classmethod
+    def from_graph(cls, driver, labels: Optional[List[str]] = None):
+        """从 Neo4j 一次性加载实体名/昵称/别名并构建自动机"""
+        linker = cls()
+        with driver.session() as session:
+            result = session.run(ENTITY_NAMES_QUERY, {"labels": labels or LINKABLE_LABELS})
+            linker.add_records(dict(record) for record in result)
+        return linker
+
+    @classmethod
+    def from_json_dir(cls, entities_dir: str, labels: Optional[List[str]] = None):
+        """从 data_preprocess/dataKG/entities 下的 <label>.json 构建（离线脚本/无数据库时使用）"""
+        records = []
+        for label in labels or LINKABLE_LABELS:
+            path = os.path.join(entities_dir, f"{label}.json")
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for item in json.load(f):
+                    if isinstance(item, dict):
+                        records.append({**item, "label": label})
+        return cls().add_records(records)
+
+    def _resolve(self, surface: str, labels=None):
+        """同一别名对应多个实体时：先按规范名/别名，再按类型优先级挑一个"""
+        bucket = self._entries.get(surface) or {}
+        options = [
+            (is_alias, LABEL_PRIORITY.get(label, 99), label, name)
+            for (label, name), is_alias in bucket.items()
+            if not labels or label in labels
+        ]
+        if not options:
+            return None
+        options.sort()
+        _, _, label, name = options[0]
+        return label, name
+
+    def link(self, question: str, labels=None) -> List[dict]:
+        """
+        返回问题中的实体片段（按出现位置排序）
+        重叠时取最长匹配；等长时取更靠前、类型优先级更高的
+        """
+        text = question or ""
+        candidates = []
+        for start, end, surface in self._automaton.iter_matches(text):
+            resolved = self._resolve(surface, labels)
+            if not resolved:
+                continue
+            label, name = resolved
+            candidates.append({"start": start, "end": end, "text": surface, "label": label, "name": name})
+
+        candidates.sort(key=lambda s: (-(s["end"] - s["start"]), s["start"], LABEL_PRIORITY.get(s["label"], 99)))
+        taken = [False] * (len(text) + 1)
+        spans = []
+        for s in candidates:
+            if any(taken[i] for i in range(s["start"], s["end"])):
+                continue
+            for i in range(s["start"], s["end"]):
+                taken[i] = True
+            spans.append(s)
+        spans.sort(key=lambda s: s["start"])
+        return spans
+
+    def first(self, question: str, label: str) -> Optional[str]:
+        """取问题中第一个指定类型实体的规范名，没有则返回 None"""
+        for span in self.link(question):
+            if span["label"] == label:
+                return span["name"]
+        return None
@@ -0,0 +1,215 @@
+"""
+常见问题预计算模块 - 示例问题/高频问题的答案按图谱版本预先算好，点击即答
+
+- 图谱版本：各标签节点数 + 各类型关系数的哈希（计数走 Neo4j 计数存储，几毫秒），再拼上渲染器版本；
+  重新导入图谱后计数变化，版本随之变化
+- 问题列表：面板示例问题 + 追踪日志（QA_TRACE_PATH）里出现次数最多的问题
+- 答案存成本地 JSON（只保留当前版本；不同模型/提示词版本各用一个文件），启动时后台线程补算缺失的问题；
+  查询时发现版本已变就改走实时问答，同时在后台按新版本重算
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+from modules.answer_renderers import RENDERER_VERSION
+from modules.team_table import graph_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAQ_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "data", "faq_cache.json")
+
+# 问答面板的示例问题（面板按钮也从这里取）
+DEFAULT_FAQ_QUESTIONS = [
+    "胡桃的详细信息是什么？",
+    "神里绫华什么突破材料？对应的来源是什么？",
+    "有哪些国家？每个国家有多少角色？",
+    "护摩之杖适合哪些角色？",
+    "什么角色的中文配音演员相同？",
+]
+
+# 追踪日志里取出现次数最多的前几个问题
+TOP_LOGGED_QUESTIONS = 20
+# 两次检查图谱版本的最小间隔（秒）；间隔内直接信任上一次的版本
+VERSION_CHECK_INTERVAL_S = 60.0
+
+_TRAILING_PUNCT_RE = re.compile(r"[\s？?。！!]+$")
+
+
+def normalize_question(question: str) -> str:
+    """去掉首尾空白与结尾标点，作为缓存键"""
+    return _TRAILING_PUNCT_RE.sub("", (question or "").strip())
+
+
+def graph_version(driver) -> str:
+    """图谱版本：数据指纹（见 team_table.graph_fingerprint）+ 渲染器版本（缓存的是渲染好的回答，渲染逻辑变了也要失效）"""
+    return f"{graph_fingerprint(driver)}-r{RENDERER_VERSION}"
+
+
+def fingerprint_of(version: Optional[str]) -> Optional[str]:
+    """从图谱版本里取回数据指纹（只依赖数据、不依赖渲染器的缓存用它比较）"""
+    return version.rsplit("-r", 1)[0] if version else None
+
+
+def faq_path_for(path: str, tag: str) -> str:
+    """不同模型/提示词版本的预计算答案分文件保存：data/faq_cache.json -> data/faq_cache.<tag>.json"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{tag}{ext or '.json'}"
+
+
+def top_logged_questions(trace_path: Optional[str], n: int = TOP_LOGGED_QUESTIONS) -> List[str]:
+    """从追踪日志（OTLP/JSON，每行一条 trace）统计根 span qa.ask 的问题，按出现次数取前 n 个"""
+    if not trace_path or not os.path.exists(trace_path):
+        return []
+    counter = Counter()
+    with open(trace_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                for rs in record.get("resourceSpans", []):
+                    for ss in rs.get("scopeSpans", []):
+                        for span in ss.get("spans", []):
+                            if span.get("name") != "qa.ask" or span.get("parentSpanId"):
+                                continue
+                            for attr in span.get("attributes", []):
+                                if attr.get("key") == "question":
+                                    q = normalize_question(attr.get("value", {}).get("stringValue"))
+                                    if q:
+                                        counter[q] += 1
+            except (ValueError, AttributeError):
+                continue
+    return [q for q, _ in counter.most_common(n)]
+
+
+class FAQCache:
+    """
+    预计算答案表
+
+    用法：
+        faq = FAQCache(path, questions, version_fn=lambda: graph_version(driver))
+        faq.refresh_async(answer_fn)      # answer_fn(question) -> (cypher, results 或错误信息, answer)
+        hit = faq.get("护摩之杖适合哪些角色？")   # {"cypher", "results", "answer", "version", "computed_at"} 或 None
+    """
+
+    def __init__(self, path: Optional[str], questions: List[str], version_fn: Callable[[], str],
+                 check_interval_s: float = VERSION_CHECK_INTERVAL_S):
+        self.path = path
+        self.questions = []
+        for q in questions:
+            q = normalize_question(q)
+            if q and q not in self.questions:
+                self.questions.append(q)
+        self.version_fn = version_fn
+        self.check_interval_s = check_interval_s
+        self.version = None
+        self._checked_at = 0.0
+        self._answers: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._answer_fn = None
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._answers = {q: a for q, a in (data.get("answers") or {}).items() if isinstance(a, dict)}
+        except (OSError, ValueError) as e:
+            logger.warning("读取预计算答案失败，将重新计算：%s", e)
+            self._answers = {}
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"version": self.version, "answers": dict(self._answers)}
+        try:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok=True)
+            # 每次写独立的临时文件再原子替换：并发保存不会互相覆盖写到一半的文件
+            fd, tmp = tempfile.mkstemp(prefix=".faq_cache.", suffix=".tmp", dir=folder)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, default=str)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as e:
+            logger.warning("保存预计算答案失败：%s", e)
+
+    def get(self, question: str) -> Optional[dict]:
+        """当前版本的预计算答案；版本检查到期时在后台重新检查（变了就重算），本次先按已知版本判断"""
+        key = normalize_question(question)
+        if key not in self.questions or self.version is None:
+            return None
+        if time.monotonic() - self._checked_at > self.check_interval_s:
+            self.refresh_async()
+        with self._lock:
+            hit = self._answers.get(key)
+        return hit if hit and hit.get("version") == self.version else None
+
+    def refresh_async(self, answer_fn=None):
+        """后台线程：检查图谱版本，补算当前版本缺失的问题；已有任务在跑时不重复启动"""
+        if answer_fn is not None:
+            self._answer_fn = answer_fn
+        if self._answer_fn is None:
+            return None
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return self._worker
+            self._checked_at = time.monotonic()
+            self._worker = threading.Thread(target=self.refresh, name="faq-precompute", daemon=True)
+            self._worker.start()
+            return self._worker
+
+    def refresh(self) -> Dict[str, int]:
+        """同步执行：返回 {"computed", "reused", "failed"}"""
+        stats = {"computed": 0, "reused": 0, "failed": 0}
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            logger.warning("获取图谱版本失败，跳过预计算：%s", e)
+            return stats
+        self._checked_at = time.monotonic()
+        with self._lock:
+            changed = version != self.version
+            if changed:
+                # 版本变化：旧答案全部作废（文件里只保留当前版本）
+                self._answers = {q: a for q, a in self._answers.items() if a.get("version") == version}
+                self.version = version
+            missing = [q for q in self.questions if q not in self._answers]
+            stats["reused"] = len(self.questions) - len(missing)
+
+        for q in missing:
+            try:
+                cypher, results, answer = self._answer_fn(q)
+            except Exception as e:
+                logger.warning("预计算问题失败（%s）：%s", q, e)
+                stats["failed"] += 1
+                continue
+            if isinstance(results, str) or not answer:
+                # 出错或没有答案的问题不缓存，点击时仍走实时问答
+                stats["failed"] += 1
+                continue
+            with self._lock:
+                self._answers[q] = {"cypher": cypher, "results": results, "answer": answer, "version": version,
+                                    "computed_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+            stats["computed"] += 1
+        if stats["computed"] or changed:
+            self._save()
+        return stats
+
+    def status(self) -> dict:
+        with self._lock:
+            ready = sum(1 for q in self.questions if (self._answers.get(q) or {}).get("version") == self.version)
+        running = self._worker is not None and self._worker.is_alive()
+        return {"version": self.version, "questions": len(self.questions), "ready": ready, "refreshing": running}
@@ -0,0 +1,421 @@
+"""
+意图路由模块 - 声明式意图目录 + 参数化 Cypher 模板
+
+常见问题（突破材料及来源、武器/圣遗物适配、怪物掉落、克制关系、角色属性、同配音分组……）
+由“实体链接结果 + 关键词”直接匹配到参数化 Cypher，无需调用 LLM。
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# ---------------------------
+# 参数化 Cypher 模板（实体名来自实体链接器，已是规范名，因此用精确匹配）
+# ---------------------------
+
+CHARACTER_INFO = """
+MATCH (c:character {name: $name})
+OPTIONAL MATCH (c)-[sw:suits_weapon]->(w:weapon)
+WITH c, w ORDER BY sw.priority
+WITH c, collect(DISTINCT w.name) AS weapons
+OPTIONAL MATCH (c)-[:suits]->(a:artifact)
+WITH c, weapons, collect(DISTINCT a.name) AS artifacts
+RETURN c.name AS name, c.title AS title, c.rarity AS rarity, c.element AS element,
+       c.weapon_type AS weapon_type, c.country AS country, c.affiliation AS affiliation,
+       c.gender AS gender, c.birthday AS birthday, c.cn_CV AS cn_CV,
+       weapons, artifacts, c.description AS description
+LIMIT 1
+""".strip()
+
+CHARACTER_ATTRIBUTE = """
+MATCH (c:character {name: $name})
+RETURN c.name AS name, $attribute AS attribute, c[$prop] AS value
+LIMIT 1
+""".strip()
+
+CHARACTER_MATERIALS = """
+MATCH (c:character {name: $name})-[:needs_material]->(m:material)
+RETURN m.name AS material, m.type AS type
+ORDER BY type, material
+LIMIT 50
+""".strip()
+
+CHARACTER_MATERIAL_SOURCES = """
+MATCH (c:character {name: $name})-[:needs_material]->(m:material)
+OPTIONAL MATCH (mon:monster)-[:drops_material]->(m)
+WITH m, collect(DISTINCT mon.name)[0..5] AS dropped_by
+RETURN m.name AS material, m.type AS type, m.source AS source, dropped_by
+ORDER BY type, material
+LIMIT 50
+""".strip()
+
+CHARACTER_WEAPONS = """
+MATCH (c:character {name: $name})-[r:suits_weapon]->(w:weapon)
+WITH c, w ORDER BY r.priority
+RETURN c.name AS character, collect(DISTINCT w.name) AS weapons
+LIMIT 1
+""".strip()
+
+CHARACTER_ARTIFACTS = """
+MATCH (c:character {name: $name})-[:suits]->(a:artifact)
+RETURN c.name AS character, collect(DISTINCT a.name) AS artifacts
+LIMIT 1
+""".strip()
+
+CHARACTER_RESTRAINS = """
+MATCH (c:character {name: $name})-[:restrains]->(mon:monster)
+RETURN c.name AS character, collect(DISTINCT mon.name)[0..30] AS monsters
+LIMIT 1
+""".strip()
+
+CHARACTER_RELATION = """
+MATCH (a:character {name: $name})-[r]-(b:character {name: $other})
+RETURN startNode(r).name AS from_character, type(r) AS relation,
+       endNode(r).name AS to_character, r.reasoning_hint AS hint
+LIMIT 20
+""".strip()
+
+SAME_CV_OF_CHARACTER = """
+MATCH (c:character {name: $name})
+WHERE c.cn_CV IS NOT NULL AND c.cn_CV <> ''
+MATCH (other:character)
+WHERE other.cn_CV = c.cn_CV
+RETURN c.cn_CV AS cn_CV, collect(DISTINCT other.name) AS characters
+LIMIT 1
+""".strip()
+
+SAME_CV_GROUPS = """
+MATCH (c:character)
+WHERE c.cn_CV IS NOT NULL AND c.cn_CV <> ''
+WITH c.cn_CV AS cn_CV, collect(DISTINCT c.name) AS characters
+WHERE size(characters) > 1
+RETURN cn_CV, characters
+ORDER BY size(characters) DESC, cn_CV
+LIMIT 20
+""".strip()
+
+COUNTRY_CHARACTER_COUNT = """
+MATCH (c:character)
+WHERE c.country IS NOT NULL
+WITH c.country AS country, count(DISTINCT c) AS character_count
+RETURN country, character_count
+ORDER BY character_count DESC
+LIMIT 50
+""".strip()
+
+COUNTRY_CHARACTERS = """
+MATCH (c:character)-[:from_country]->(co:country {name: $name})
+RETURN co.name AS country, collect(DISTINCT c.name) AS characters
+LIMIT 1
+""".strip()
+
+ELEMENT_CHARACTERS = """
+MATCH (c:character)-[:has_element]->(e:element {name: $name})
+RETURN e.name AS element, collect(DISTINCT c.name) AS characters
+LIMIT 1
+""".strip()
+
+WEAPON_CHARACTERS = """
+MATCH (c:character)-[r:suits_weapon]->(w:weapon {name: $name})
+WITH w, c ORDER BY r.priority
+RETURN w.name AS weapon, collect(DISTINCT c.name) AS characters
+LIMIT 1
+""".strip()
+
+WEAPON_INFO = """
+MATCH (w:weapon {name: $name})
+RETURN w.name AS name, w.type AS type, w.rarity AS rarity, w.source AS source,
+       w.min_attack AS min_attack, w.max_attack AS max_attack,
+       w.min_subproperty AS min_subproperty, w.max_subproperty AS max_subproperty,
+       w.effect AS effect
+LIMIT 1
+""".strip()
+
+ARTIFACT_CHARACTERS = """
+MATCH (c:character)-[:suits]->(a:artifact {name: $name})
+RETURN a.name AS artifact, collect(DISTINCT c.name) AS characters
+LIMIT 1
+""".strip()
+
+ARTIFACT_INFO = """
+MATCH (a:artifact {name: $name})
+RETURN a.name AS name, a.`min/max_rarity` AS rarity, a.source AS source,
+       a.`2piece_effect` AS two_piece_effect, a.`4piece_effect` AS four_piece_effect
+LIMIT 1
+""".strip()
+
+MONSTER_DROPS = """
+MATCH (mon:monster {name: $name})
+OPTIONAL MATCH (mon)-[:drops_material]->(d)
+RETURN mon.name AS monster, collect(DISTINCT d.name) AS drops
+LIMIT 1
+""".strip()
+
+MONSTER_INFO = """
+MATCH (mon:monster {name: $name})
+OPTIONAL MATCH (mon)-[:drops_material]->(d)
+RETURN mon.name AS name, mon.type AS type, mon.element AS element, mon.region AS region,
+       mon.refresh_time AS refresh_time, mon.TAG AS tags, collect(DISTINCT d.name) AS drops
+LIMIT 1
+""".strip()
+
+MONSTER_COUNTERS = """
+MATCH (c:character)-[:restrains]->(mon:monster {name: $name})
+RETURN mon.name AS monster, collect(DISTINCT c.name) AS characters
+LIMIT 1
+""".strip()
+
+MATERIAL_SOURCES = """
+MATCH (m:material {name: $name})
+OPTIONAL MATCH (mon:monster)-[:drops_material]->(m)
+RETURN m.name AS material, m.type AS type, m.source AS source,
+       collect(DISTINCT mon.name)[0..20] AS dropped_by
+LIMIT 1
+""".strip()
+
+MATERIAL_USERS = """
+MATCH (x)-[:needs_material]->(m:material {name: $name})
+RETURN m.name AS material, collect(DISTINCT x.name)[0..50] AS used_by
+LIMIT 1
+""".strip()
+
+
+# 角色属性问法 -> character 节点属性
+CHARACTER_ATTRIBUTE_MAP = {
+    "生日": "birthday",
+    "配音": "cn_CV",
+    "声优": "cn_CV",
+    "CV": "cn_CV",
+    "武器类型": "weapon_type",
+    "元素": "element",
+    "国家": "country",
+    "哪国": "country",
+    "稀有度": "rarity",
+    "星级": "rarity",
+    "命之座": "constellation",
+    "称号": "title",
+    "种族": "species",
+    "所属": "affiliation",
+    "性别": "gender",
+    "特殊料理": "special_dish",
+    "职业": "profession",
+    "体型": "body_type",
+}
+
+_INFO_WORDS = ["详细信息", "基本信息", "信息", "介绍", "资料", "简介", "是谁"]
+_SUIT_WORDS = ["适合", "适用", "推荐", "搭配", "谁用", "哪些角色", "哪个角色", "什么角色"]
+_SOURCE_WORDS = ["来源", "哪里", "哪刷", "怎么刷", "在哪", "获取", "获得", "掉落", "刷"]
+
+# ---------------------------
+# 声明式意图目录（按顺序匹配，先具体后宽泛）
+#   entities: 需要的实体类型（可重复，表示需要多个同类实体）
+#   require:  关键词组列表，每组至少命中一个
+#   exclude:  出现任一即不匹配
+# ---------------------------
+INTENT_CATALOGUE: List[Dict] = [
+    {"name": "character_relation", "entities": ["character", "character"],
+     "require": [["关系", "什么人", "怎么称呼", "如何称呼"]], "cypher": CHARACTER_RELATION},
+    {"name": "same_cv_of_character", "entities": ["character"],
+     "require": [["配音", "CV", "声优"], ["相同", "一样", "同一", "同个"]], "cypher": SAME_CV_OF_CHARACTER},
+    {"name": "same_cv_groups", "entities": [],
+     "require": [["配音", "CV", "声优"], ["相同", "一样", "同一", "同个"]], "cypher": SAME_CV_GROUPS},
+    {"name": "country_character_count", "entities": [],
+     "require": [["国家"], ["角色"], ["多少", "数量", "几个", "统计", "分别"]], "cypher": COUNTRY_CHARACTER_COUNT},
+    {"name": "character_material_sources", "entities": ["character"],
+     "require": [["材料", "素材"], _SOURCE_WORDS], "cypher": CHARACTER_MATERIAL_SOURCES},
+    {"name": "character_materials", "entities": ["character"],
+     "require": [["材料", "素材", "突破", "培养"]], "cypher": CHARACTER_MATERIALS},
+    {"name": "character_weapons", "entities": ["character"],
+     "require": [["武器"]], "exclude": ["武器类型"], "cypher": CHARACTER_WEAPONS},
+    {"name": "character_artifacts", "entities": ["character"],
+     "require": [["圣遗物", "套装"]], "cypher": CHARACTER_ARTIFACTS},
+    {"name": "character_restrains", "entities": ["character"],
+     "require": [["克制", "对付", "打什么怪"]], "cypher": CHARACTER_RESTRAINS},
+    {"name": "character_attribute", "entities": ["character"],
+     "require": [list(CHARACTER_ATTRIBUTE_MAP.keys())], "exclude": ["详细", "介绍"],
+     "cypher": CHARACTER_ATTRIBUTE},
+    {"name": "character_info", "entities": ["character"],
+     "require": [_INFO_WORDS], "cypher": CHARACTER_INFO},
+    {"name": "weapon_characters", "entities": ["weapon"],
+     "require": [_SUIT_WORDS], "cypher": WEAPON_CHARACTERS},
+    {"name": "weapon_info", "entities": ["weapon"],
+     "require": [_INFO_WORDS + ["是什么", "效果", "属性", "攻击力", "特效"]], "cypher": WEAPON_INFO},
+    {"name": "artifact_characters", "entities": ["artifact"],
+     "require": [_SUIT_WORDS], "cypher": ARTIFACT_CHARACTERS},
+    {"name": "artifact_info", "entities": ["artifact"],
+     "require": [_INFO_WORDS + ["是什么", "效果", "套装", "两件套", "四件套"]], "cypher": ARTIFACT_INFO},
+    {"name": "monster_counters", "entities": ["monster"],
+     "require": [["克制", "对付", "打", "应对", "攻略"]], "exclude": ["打败后", "掉落"],
+     "cypher": MONSTER_COUNTERS},
+    {"name": "monster_info", "entities": ["monster"],
+     "require": [_INFO_WORDS + ["是什么", "生态位"]], "cypher": MONSTER_INFO},
+    {"name": "monster_drops", "entities": ["monster"],
+     "require": [["掉落", "掉什么", "爆什么", "产出"]], "cypher": MONSTER_DROPS},
+    {"name": "material_users", "entities": ["material"],
+     "require": [["哪些角色", "谁需要", "需要", "用到", "用途"]], "exclude": ["来源", "哪里"],
+     "cypher": MATERIAL_USERS},
+    {"name": "material_sources", "entities": ["material"],
+     "require": [_SOURCE_WORDS + ["怪物", "哪些怪"]], "cypher": MATERIAL_SOURCES},
+    {"name": "country_characters", "entities": ["country"],
+     "require": [["角色", "人物", "有谁"]], "cypher": COUNTRY_CHARACTERS},
+    {"name": "element_characters", "entities": ["element"],
+     "require": [["角色", "人物", "有谁"]], "cypher": ELEMENT_CHARACTERS},
+]
+
+
+def _entities_satisfied(required: List[str], spans: List[dict]) -> bool:
+    need = Counter(required or [])
+    have = Counter(s["label"] for s in spans)
+    return all(have[label] >= n for label, n in need.items())
+
+
+def _build_params(intent: dict, spans: List[dict], question: str) -> dict:
+    """第一个所需实体 -> $name，同类第二个实体 -> $other；属性类意图额外补 $prop/$attribute"""
+    params = {}
+    required = intent.get("entities") or []
+    if required:
+        label = required[0]
+        names = []
+        for s in spans:
+            if s["label"] == label and s["name"] not in names:
+                names.append(s["name"])
+        if names:
+            params["name"] = names[0]
+        if required.count(label) > 1 and len(names) > 1:
+            params["other"] = names[1]
+    if intent["name"] == "character_attribute":
+        for word, prop in CHARACTER_ATTRIBUTE_MAP.items():
+            if word in question:
+                params["attribute"] = word
+                params["prop"] = prop
+                break
+    return params
+
+
+def match_intent(question: str, linker=None) -> Optional[dict]:
+    """
+    在意图目录里按顺序匹配问题
+    Returns:
+        {"intent", "cypher", "params", "entities"}；未命中返回 None
+    """
+    question = (question or "").strip()
+    if not question:
+        return None
+    spans = linker.link(question) if linker else []
+
+    for intent in INTENT_CATALOGUE:
+        if any(k in question for k in intent.get("exclude") or []):
+            continue
+        if not all(any(k in question for k in group) for group in intent.get("require") or []):
+            continue
+        if not _entities_satisfied(intent.get("entities"), spans):
+            continue
+        return {
+            "intent": intent["name"],
+            "cypher": intent["cypher"],
+            "params": _build_params(intent, spans, question),
+            "entities": spans,
+        }
+    return None
+
+
+# ---------------------------
+# 推测意图：严格匹配失败时的“实体 + 部分关键词”候选
+#   只用于推测执行：候选查询与 LLM 生成并行，结果通过合理性检查才采用
+# ---------------------------
+SPECULATIVE_KEYWORDS = {
+    "character_materials": ["养成", "升级", "天赋书", "升天赋", "突破需要"],
+    "character_weapons": ["专武", "带什么武", "用什么武", "拿什么武"],
+    "character_artifacts": ["遗物", "带什么套", "四件", "两件"],
+    "character_info": ["了解", "谁啊", "怎么样的人"],
+    "weapon_characters": ["谁用", "给谁"],
+    "artifact_characters": ["谁用", "给谁"],
+    "monster_counters": ["怎么打", "弱点"],
+    "monster_drops": ["爆", "产什么"],
+    "material_users": ["干什么用", "有什么用"],
+    "material_sources": ["怎么获得", "哪儿"],
+}
+
+
+def speculative_intent(question: str, linker=None) -> Optional[dict]:
+    """
+    宽松匹配：实体齐全、命中至少一组关键词（或推测关键词）、不含排除词
+    Returns:
+        与 match_intent 同形的结果，另带 "score"（命中的关键词组比例）；没有候选返回 None
+    """
+    question = (question or "").strip()
+    spans = linker.link(question) if (linker and question) else []
+    if not spans:
+        return None
+
+    best, best_score = None, 0.0
+    for intent in INTENT_CATALOGUE:
+        if not intent.get("entities") or not _entities_satisfied(intent["entities"], spans):
+            continue
+        if any(k in question for k in intent.get("exclude") or []):
+            continue
+        groups = intent.get("require") or []
+        hit = sum(1 for group in groups if any(k in question for k in group))
+        if any(k in question for k in SPECULATIVE_KEYWORDS.get(intent["name"], [])):
+            hit = max(hit, 1)
+        score = hit / max(len(groups), 1)
+        if score > best_score:
+            best, best_score = intent, score
+    if best is None:
+        return None
+    return {
+        "intent": best["name"],
+        "cypher": best["cypher"],
+        "params": _build_params(best, spans, question),
+        "entities": spans,
+        "score": round(best_score, 3),
+    }
+
+
+# ---------------------------
+# 复合问题拆分：“A？B？”/“A，另外B” -> 多个相互独立的子问题
+# ---------------------------
+_SPLIT_PATTERN = r"[？?；;。！!]+|，?(?:另外|以及|此外|还有|并且|同时)，?"
+_MAX_SUB_QUESTIONS = 4
+
+
+def split_compound_question(question: str, linker=None, can_route=None) -> Optional[List[str]]:
+    """
+    把复合问题拆成若干可独立检索的子问题
+    - 没有实体的片段（如“她用什么武器”）继承上一片段的实体
+    - 继承实体后仍无法规则路由、但与上一片段拼接后可路由的（如“对应的来源是什么”），视为对上一问的细化，替换上一子问题
+    - 只换了实体的省略问法（如“另外天空之翼呢”），沿用上一子问题的问法
+    Args:
+        can_route: 可选回调 question -> bool，判断子问题能否被规则路由
+    Returns:
+        至少两个子问题时返回列表，否则返回 None（按单个问题处理）
+    """
+    parts = [p.strip(" ，,") for p in re.split(_SPLIT_PATTERN, question or "")]
+    parts = [p for p in parts if len(p) >= 2]
+    if len(parts) < 2:
+        return None
+
+    subs: List[str] = []
+    prev_raw = None
+    prev_entity = None
+    for part in parts:
+        spans = linker.link(part) if linker else []
+        entity = part[spans[0]["start"]:spans[0]["end"]] if spans else None
+        if spans or prev_entity is None:
+            sub = part
+            if (entity and can_route and not can_route(sub) and prev_raw and prev_entity
+                    and prev_entity in prev_raw and can_route(prev_raw.replace(prev_entity, entity))):
+                sub = prev_raw.replace(prev_entity, entity)
+        else:
+            sub = prev_entity + part
+            if can_route and not can_route(sub) and prev_raw and can_route(prev_raw + part) and subs:
+                sub = prev_raw + part
+                subs.pop()
+        if entity:
+            prev_entity = entity
+        if sub not in subs:
+            subs.append(sub)
+        prev_raw = sub
+
+    if len(subs) < 2:
+        return None
+    return subs[:_MAX_SUB_QUESTIONS]
@@ -0,0 +1,275 @@
+"""
+LLM 调用限速模块 - 令牌桶、按调用链传递的限速，以及全进程共享的 LLM 准入（并发上限 + 按会话公平排队 + 过载快速拒绝）
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：以 rate 个/秒的速度补充令牌，桶容量为 capacity
+    acquire() 取不到令牌时阻塞等待（可设超时）
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if not rate or rate <= 0:
+            raise ValueError("rate 必须为正数")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """不等待：有令牌就取走并返回 True，否则返回 False"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """阻塞直到取到令牌；超过 timeout 秒仍未取到则返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+# 调用方自带的限速（如 ask_many 的 rate_limit）：放在 contextvar 里随调用链传递，
+# 只约束本次调用发出的请求，不改动共享的引擎；提交到线程池的函数需用 Tracer.bind 带上上下文
+_call_rate_limit = contextvars.ContextVar("llm_call_rate_limit", default=None)
+
+
+@contextmanager
+def llm_rate_limit(bucket):
+    """在该上下文里发出的 LLM 请求先从 bucket 取令牌；bucket 为 None 时不限速"""
+    token = _call_rate_limit.set(bucket)
+    try:
+        yield
+    finally:
+        _call_rate_limit.reset(token)
+
+
+def current_llm_rate_limit():
+    return _call_rate_limit.get()
+
+
+# ---------------------------
+# 全进程 LLM 准入：全局令牌桶 + 并发上限 + 按会话轮转的公平队列
+# ---------------------------
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_WAIT_S = 20.0
+# 带撤回标记排队时检查标记的间隔（秒）
+CANCEL_POLL_S = 0.05
+# 等待耗时统计窗口
+WAIT_WINDOW = 1024
+
+_current_session = contextvars.ContextVar("llm_session", default=None)
+
+
+class LLMOverloaded(RuntimeError):
+    """LLM 排队过长（快速拒绝）或等待超时；调用方应退回规则/确定性渲染"""
+
+
+class LLMCancelled(LLMOverloaded):
+    """排队中的请求已被调用方放弃（如超出阶段预算），撤回而不再发出"""
+
+
+@contextmanager
+def llm_session(session_id):
+    """在该上下文里发出的 LLM 请求都记在 session_id 名下（公平队列按会话轮转）"""
+    token = _current_session.set(session_id)
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+
+def current_llm_session(default=None):
+    return _current_session.get() or default
+
+
+class _Ticket:
+    __slots__ = ("session", "granted", "enqueued_at")
+
+    def __init__(self, session):
+        self.session = session
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class FairLLMLimiter:
+    """
+    所有 chat.completions.create 调用的准入控制（线程安全，进程内共享一个实例）
+
+    - 在途请求数不超过 max_concurrency；配置了 rate 时再受全局令牌桶限制
+    - 排队按会话轮转：每个会话各自 FIFO，空出名额时依次从下一个会话取，一个用户的突发不会饿死其他用户
+    - 排队总数达到 max_queue 时直接拒绝（不进入队列），等待超过 max_wait_s 也拒绝，都抛 LLMOverloaded
+    - acquire/slot 可带 cancelled（threading.Event）：排队期间被置位则撤回，抛 LLMCancelled，不占名额
+
+    用法：
+        with limiter.slot("session-1"):
+            client.chat.completions.create(...)
+    """
+
+    def __init__(self, rate: float = None, capacity: float = None, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_queue: int = DEFAULT_MAX_QUEUE, max_wait_s: float = DEFAULT_MAX_WAIT_S):
+        self.bucket = TokenBucket(rate, capacity) if rate else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait_s = max_wait_s
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._rotation = deque()
+        self._waiting = 0
+        self._in_flight = 0
+        self._stats = {"granted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "cancelled": 0,
+                       "max_queue_depth": 0}
+        self._waits_ms = deque(maxlen=WAIT_WINDOW)
+
+    def _dispatch(self):
+        """在锁内调用：按会话轮转把空出的名额发给排队者；令牌桶没令牌时返回需要等待的秒数"""
+        while self._rotation and self._in_flight < self.max_concurrency:
+            if self.bucket is not None and not self.bucket.try_acquire():
+                return 1.0 / self.bucket.rate
+            session = self._rotation.popleft()
+            queue = self._queues[session]
+            ticket = queue.popleft()
+            if queue:
+                self._rotation.append(session)
+            else:
+                del self._queues[session]
+            ticket.granted = True
+            self._waiting -= 1
+            self._in_flight += 1
+            self._stats["granted"] += 1
+            self._waits_ms.append((time.monotonic() - ticket.enqueued_at) * 1000.0)
+            self._cond.notify_all()
+        return None
+
+    def acquire(self, session=None, cancelled=None):
+        session = session or "default"
+        with self._cond:
+            if cancelled is not None and cancelled.is_set():
+                self._stats["cancelled"] += 1
+                raise LLMCancelled("LLM 请求已被放弃")
+            # 快速路径：无人排队且有名额
+            if not self._rotation and self._in_flight < self.max_concurrency and (
+                    self.bucket is None or self.bucket.try_acquire()):
+                self._in_flight += 1
+                self._stats["granted"] += 1
+                self._waits_ms.append(0.0)
+                return
+            if self._waiting >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise LLMOverloaded(f"LLM 请求排队已满（{self._waiting}），请稍后再试")
+
+            ticket = _Ticket(session)
+            if session not in self._queues:
+                self._queues[session] = deque()
+                self._rotation.append(session)
+            self._queues[session].append(ticket)
+            self._waiting += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._waiting)
+
+            deadline = ticket.enqueued_at + self.max_wait_s if self.max_wait_s else None
+            while not ticket.granted:
+                retry_after = self._dispatch()
+                if ticket.granted:
+                    break
+                if cancelled is not None and cancelled.is_set():
+                    self._remove(ticket)
+                    self._stats["cancelled"] += 1
+                    raise LLMCancelled("LLM 请求排队时已被放弃")
+                timeout = retry_after
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._remove(ticket)
+                        self._stats["rejected_timeout"] += 1
+                        raise LLMOverloaded(f"LLM 请求排队超过 {self.max_wait_s:.0f}s，请稍后再试")
+                    timeout = remaining if timeout is None else min(timeout, remaining)
+                if cancelled is not None:
+                    timeout = CANCEL_POLL_S if timeout is None else min(timeout, CANCEL_POLL_S)
+                self._cond.wait(timeout)
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.session)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[ticket.session]
+            self._rotation.remove(ticket.session)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, session=None, cancelled=None):
+        self.acquire(session, cancelled)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """队列深度、在途数、各会话排队数、放行/拒绝次数与排队等待 p50/p95（毫秒）"""
+        with self._cond:
+            waits = sorted(self._waits_ms)
+            out = dict(self._stats, queue_depth=self._waiting, in_flight=self._in_flight,
+                       sessions_waiting={s: len(q) for s, q in self._queues.items()},
+                       max_concurrency=self.max_concurrency, max_queue=self.max_queue,
+                       rate=self.bucket.rate if self.bucket is not None else None)
+        out["wait_p50_ms"] = round(waits[len(waits) // 2], 1) if waits else None
+        out["wait_p95_ms"] = round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else None
+        return out
+
+
+_global_limiter = None
+_global_limiter_lock = threading.Lock()
+
+
+def get_llm_limiter(environ=None) -> FairLLMLimiter:
+    """
+    进程内共享的准入限制器（Streamlit 各会话、HTTP 服务各请求共用）
+    环境变量：LLM_GLOBAL_RATE（次/秒，默认不限）、LLM_MAX_CONCURRENCY、LLM_MAX_QUEUE、LLM_MAX_WAIT_S
+    """
+    global _global_limiter
+    if _global_limiter is None:
+        with _global_limiter_lock:
+            if _global_limiter is None:
+                env = os.environ if environ is None else environ
+                rate = env.get("LLM_GLOBAL_RATE")
+                _global_limiter = FairLLMLimiter(
+                    rate=float(rate) if rate else None,
+                    max_concurrency=int(env.get("LLM_MAX_CONCURRENCY") or DEFAULT_MAX_CONCURRENCY),
+                    max_queue=int(env.get("LLM_MAX_QUEUE") or DEFAULT_MAX_QUEUE),
+                    max_wait_s=float(env.get("LLM_MAX_WAIT_S") or DEFAULT_MAX_WAIT_S))
+    return _global_limiter
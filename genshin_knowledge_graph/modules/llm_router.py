@@ -0,0 +1,176 @@
+"""
+LLM 分阶段路由模块 - 每个阶段（cypher / answer / team）独立选模型，并带延迟 SLO 与对冲请求
+
+- 主请求发给该阶段配置的模型；超过 hedge_ms 仍未返回且配置了快速模型时，再向快速模型发一个备份请求，
+  两者谁先成功用谁
+- 超过 budget_ms 都没有结果则抛 LLMDeadlineExceeded，由调用方退回确定性渲染（不再等待）
+- 只有配置了 SLO 或对冲模型时才按预算等待；两者都没配置时直接在调用方线程里发请求，慢也照常返回
+- 被放弃的请求（超预算 / 对冲另一方已返回）会置位 current_call_abandoned()：还在排队等准入的直接撤回；
+  同步的 chat.completions 请求一旦发出无法中断，落后的一方在后台线程里跑完后结果被丢弃
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional
+
+STAGES = ("cypher", "answer", "team")
+
+# 各阶段默认 SLO（毫秒）：hedge_ms 后发备份请求，budget_ms 后放弃 LLM；只在配置了对冲模型时作为默认值
+DEFAULT_STAGE_SLO_MS = {
+    "cypher": {"hedge_ms": 3000, "budget_ms": 15000},
+    "answer": {"hedge_ms": 2500, "budget_ms": 10000},
+    "team": {"hedge_ms": 2500, "budget_ms": 10000},
+}
+
+# 每个阶段保留最近多少次调用的耗时用于分位数统计
+LATENCY_WINDOW = 512
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """主请求与备份请求都没有在阶段预算内返回"""
+
+
+# 路由器线程池里正在执行的请求对应的“已放弃”标记（线程局部：create 经 Tracer.bind 换了 contextvars 上下文也能取到）
+_attempt = threading.local()
+
+
+def current_call_abandoned() -> Optional[threading.Event]:
+    """当前请求被路由器放弃时置位的 Event；不在路由器线程池里执行时为 None"""
+    return getattr(_attempt, "abandoned", None)
+
+
+def _run_attempt(create, model, abandoned):
+    _attempt.abandoned = abandoned
+    try:
+        return create(model)
+    finally:
+        _attempt.abandoned = None
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class StageRouter:
+    """
+    用法：
+        router = StageRouter("gpt-4o", stage_models={"cypher": "gpt-4o-mini"}, hedge_model="gpt-4o-mini")
+        resp = router.call("answer", lambda model: client.chat.completions.create(model=model, ...))
+    """
+
+    def __init__(self, default_model: str, stage_models: Optional[Dict[str, str]] = None,
+                 hedge_model: Optional[str] = None, slo_ms: Optional[Dict[str, dict]] = None,
+                 max_workers: int = 8):
+        self.default_model = default_model
+        self.stage_models = dict(stage_models or {})
+        self.hedge_model = hedge_model or None
+        # 没有对冲模型时不套默认预算：只执行显式配置的 SLO
+        self.slo_ms = {stage: dict(v) for stage, v in DEFAULT_STAGE_SLO_MS.items()} if self.hedge_model else {}
+        for stage, v in (slo_ms or {}).items():
+            self.slo_ms.setdefault(stage, {}).update(v or {})
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def model_for(self, stage: str) -> str:
+        return self.stage_models.get(stage) or self.default_model
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="qa-llm")
+        return self._pool
+
+    def call(self, stage: str, create: Callable[[str], object]):
+        """
+        按阶段路由一次请求
+        Args:
+            create: create(model) -> response，真正发请求的函数
+        Returns:
+            先成功返回的 response；两者都失败时抛出主请求的异常，超出预算抛 LLMDeadlineExceeded
+        """
+        model = self.model_for(stage)
+        slo = self.slo_ms.get(stage) or {}
+        hedge_ms, budget_ms = slo.get("hedge_ms"), slo.get("budget_ms")
+        hedge_model = self.hedge_model if self.hedge_model and self.hedge_model != model else None
+        t0 = time.perf_counter()
+
+        if not budget_ms and not (hedge_model and hedge_ms):
+            response = create(model)
+            self._record(stage, t0, hedged=False, winner="primary")
+            return response
+
+        futures, abandoned = {}, {}
+
+        def submit(label, model_):
+            event = threading.Event()
+            future = self._get_pool().submit(_run_attempt, create, model_, event)
+            futures[future], abandoned[future] = label, event
+            return future
+
+        def abandon(pending_):
+            for f in pending_:
+                f.cancel()
+                abandoned[f].set()
+
+        primary = submit("primary", model)
+        deadline = t0 + budget_ms / 1000.0 if budget_ms else None
+        if hedge_model and hedge_ms:
+            first_wait = hedge_ms / 1000.0 if deadline is None else min(hedge_ms / 1000.0, deadline - t0)
+            wait([primary], timeout=first_wait)
+            if not primary.done() or primary.exception() is not None:
+                submit("hedge", hedge_model)
+
+        pending = set(futures)
+        first_error = None
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                if f.exception() is None:
+                    abandon(pending)
+                    self._record(stage, t0, hedged=len(futures) > 1, winner=futures[f])
+                    return f.result()
+                if futures[f] == "primary" or first_error is None:
+                    first_error = f.exception()
+
+        if first_error is not None and not pending:
+            self._record(stage, t0, hedged=len(futures) > 1, winner=None)
+            raise first_error
+        abandon(pending)
+        self._record(stage, t0, hedged=len(futures) > 1, winner=None, timed_out=True)
+        raise LLMDeadlineExceeded(f"LLM 阶段 {stage} 超出延迟预算 {budget_ms}ms")
+
+    def _record(self, stage, t0, hedged, winner, timed_out=False):
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            st = self._stats.setdefault(stage, {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "errors": 0,
+                                                "latency_ms": deque(maxlen=LATENCY_WINDOW)})
+            st["calls"] += 1
+            st["hedged"] += int(hedged)
+            st["hedge_wins"] += int(winner == "hedge")
+            st["timeouts"] += int(timed_out)
+            st["errors"] += int(winner is None and not timed_out)
+            st["latency_ms"].append(elapsed_ms)
+
+    def report(self) -> Dict[str, dict]:
+        """各阶段：模型、SLO、调用数、对冲次数/胜出次数、超预算次数、耗时 p50/p95"""
+        with self._lock:
+            snapshot = {stage: dict(st, latency_ms=list(st["latency_ms"])) for stage, st in self._stats.items()}
+        out = {}
+        for stage in sorted(set(STAGES) | set(snapshot)):
+            st = snapshot.get(stage) or {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "errors": 0,
+                                         "latency_ms": []}
+            latency = st.pop("latency_ms")
+            st.update(model=self.model_for(stage), hedge_model=self.hedge_model, slo_ms=self.slo_ms.get(stage),
+                      p50_ms=_percentile(latency, 0.5), p95_ms=_percentile(latency, 0.95))
+            out[stage] = st
+        return out
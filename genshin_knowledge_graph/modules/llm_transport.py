@@ -0,0 +1,201 @@
+"""
+LLM 录制/回放模块 - 让问答性能评测可重复、可离线运行
+
+RecordReplayClient 包装任意 OpenAI 兼容客户端，对外同样暴露 client.chat.completions.create(**kwargs)：
+- record：调用真实 LLM，并把“请求哈希 -> 响应”追加写入本地 JSONL 存档
+- replay：只从存档返回响应（可模拟延迟），未命中直接报错，不访问网络
+- auto  ：命中则回放，未命中再调用真实 LLM 并录制
+
+请求哈希只由请求体（model/messages/temperature/max_tokens…）决定，
+与 scripts/mock_llm_server.py 使用同一套哈希，录制的存档也可以交给本地模拟服务回放。
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+TRANSPORT_MODES = ("live", "record", "replay", "auto")
+
+
+class LLMReplayMiss(LookupError):
+    """回放模式下存档中没有对应请求"""
+
+
+def request_key(payload: dict) -> str:
+    """请求体的规范化哈希（键排序、紧凑分隔符），同一请求在不同进程/机器上得到同一个 key"""
+    canonical = json.dumps(payload or {}, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCassette:
+    """JSONL 存档：每行 {key, request, response, elapsed_ms}；同一 key 以最后一次录制为准"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if isinstance(rec, dict) and rec.get("key"):
+                        self._records[rec["key"]] = rec
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, key: str) -> Optional[dict]:
+        return self._records.get(key)
+
+    def put(self, key: str, request: dict, response: dict, elapsed_ms: float):
+        rec = {"key": key, "request": request, "response": response, "elapsed_ms": round(elapsed_ms, 2)}
+        with self._lock:
+            self._records[key] = rec
+            if self.path:
+                folder = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(folder, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+        return rec
+
+
+def _to_dict(response) -> dict:
+    """把 SDK 响应对象转成可序列化的 dict"""
+    if isinstance(response, dict):
+        return response
+    for attr in ("model_dump", "to_dict", "dict"):
+        fn = getattr(response, attr, None)
+        if callable(fn):
+            try:
+                return fn()
+            except Exception:
+                continue
+    return json.loads(json.dumps(response, default=lambda o: getattr(o, "__dict__", str(o))))
+
+
+def _to_namespace(data):
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: _to_namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [_to_namespace(v) for v in data]
+    return data
+
+
+def _to_response(data: dict):
+    """存档里的 dict -> 与 SDK 返回值同形的对象（优先用 SDK 的 ChatCompletion 模型）"""
+    try:
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(data)
+    except Exception:
+        return _to_namespace(data)
+
+
+class _Completions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(kwargs)
+
+
+class RecordReplayClient:
+    """
+    录制/回放 LLM 客户端
+
+    用法：
+        client = RecordReplayClient(OpenAI(...), "tests/llm_cassette.jsonl", mode="record")
+        client = RecordReplayClient(None, "tests/llm_cassette.jsonl", mode="replay", latency_ms=800)
+    Args:
+        inner: 真实的 OpenAI 兼容客户端（replay 模式可为 None）
+        store_path: JSONL 存档路径
+        mode: record / replay / auto
+        latency_ms: 回放时模拟的延迟（毫秒）；传 "recorded" 则使用录制时测得的耗时
+        jitter_ms: 回放延迟的随机抖动幅度（±毫秒，固定种子，可重复）
+    """
+
+    def __init__(self, inner, store_path: str, mode: str = "replay", latency_ms=0.0, jitter_ms: float = 0.0, seed: int = 0):
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"不支持的录制/回放模式: {mode}")
+        if inner is None and mode != "replay":
+            raise ValueError(f"{mode} 模式需要真实的 LLM 客户端")
+        self.inner = inner
+        self.mode = mode
+        self.cassette = LLMCassette(store_path)
+        self.latency_ms = latency_ms
+        self.jitter_ms = float(jitter_ms or 0.0)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+        self.chat = SimpleNamespace(completions=_Completions(self))
+
+    def _bump(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _replay_delay(self, rec) -> float:
+        if self.latency_ms == "recorded":
+            base = float(rec.get("elapsed_ms") or 0.0)
+        else:
+            base = float(self.latency_ms or 0.0)
+        if self.jitter_ms:
+            with self._lock:
+                base += self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, base) / 1000.0
+
+    def _create(self, kwargs):
+        key = request_key(kwargs)
+        if self.mode in ("replay", "auto"):
+            rec = self.cassette.get(key)
+            if rec is not None:
+                self._bump("hits")
+                delay = self._replay_delay(rec)
+                if delay:
+                    time.sleep(delay)
+                return _to_response(rec["response"])
+            if self.mode == "replay":
+                self._bump("misses")
+                raise LLMReplayMiss(f"回放存档中没有该请求: {key[:12]}（请先用 record 模式录制）")
+
+        t0 = time.perf_counter()
+        response = self.inner.chat.completions.create(**kwargs)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        self.cassette.put(key, kwargs, _to_dict(response), elapsed_ms)
+        self._bump("recorded")
+        return response
+
+
+def create_llm_client(api_key: str, api_base: Optional[str] = None, transport: Optional[str] = None,
+                      store_path: Optional[str] = None, latency_ms=0.0, jitter_ms: float = 0.0):
+    """
+    按配置创建 LLM 客户端
+    Args:
+        transport: None/"live" 直连；"record"/"replay"/"auto" 时包一层 RecordReplayClient
+        store_path: 录制/回放存档路径
+    Returns:
+        OpenAI 兼容客户端；没有 API 密钥且不是回放模式时返回 None
+    """
+    transport = transport or "live"
+    if transport not in TRANSPORT_MODES:
+        raise ValueError(f"不支持的 LLM 传输模式: {transport}（可选: {', '.join(TRANSPORT_MODES)}）")
+
+    inner = None
+    if api_key:
+        from openai import OpenAI
+        inner = OpenAI(api_key=api_key, base_url=api_base) if api_base else OpenAI(api_key=api_key)
+    if transport == "live":
+        return inner
+    if not store_path:
+        raise ValueError(f"{transport} 模式需要指定存档路径")
+    if inner is None and transport != "replay":
+        return None
+    return RecordReplayClient(inner, store_path, mode=transport, latency_ms=latency_ms, jitter_ms=jitter_ms)
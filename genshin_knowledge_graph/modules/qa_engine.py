@@ -0,0 +1,2097 @@
+"""
+问答引擎模块 - 与界面无关的知识图谱问答核心（规则路由 / LLM 生成 Cypher / 检索 / 回答）
+
+不依赖 Streamlit：配置通过 QAConfig 显式传入，Neo4j driver 与 LLM 客户端均可注入。
+Streamlit 面板（modules/qa_panel.py）与 HTTP 服务（qa_server.py）都只是它的薄封装。
+"""
+import contextvars
+import copy
+import hashlib
+import logging
+import os
+import re
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from modules.entity_linker import EntityLinker
+from modules.intent_router import INTENT_CATALOGUE, match_intent, speculative_intent, split_compound_question
+from modules.answer_renderers import render_rows
+from modules.llm_limiter import (TokenBucket, LLMOverloaded, LLMCancelled, get_llm_limiter, current_llm_session,
+                                 llm_rate_limit, current_llm_rate_limit)
+from modules.llm_router import StageRouter, LLMDeadlineExceeded, STAGES, current_call_abandoned
+from modules.llm_transport import create_llm_client
+from modules.cypher_validator import SchemaSnapshot, validate_cypher
+from modules.query_guard import QueryBudget, guarded_run, row_key
+from modules.token_budget import fit_rows
+from modules.tracing import Tracer
+from modules.faq_cache import (FAQCache, DEFAULT_FAQ_PATH, DEFAULT_FAQ_QUESTIONS, VERSION_CHECK_INTERVAL_S,
+                               faq_path_for, graph_version, fingerprint_of, top_logged_questions)
+from modules.answer_memo import AnswerMemo, DEFAULT_ANSWER_MEMO_PATH, DEFAULT_MAX_ENTRIES, memo_key
+from modules.team_table import TeamTable, DEFAULT_TEAM_TABLE_PATH
+from modules.similarity import SimilarityIndex
+from modules.text_retriever import TextRetriever, DEFAULT_TEXT_INDEX_PATH, detect_sources, SOURCE_LABELS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+DEFAULT_MODEL_ID = "gpt-3.5-turbo"
+
+
+class QAConfig:
+    """问答引擎配置（显式传入，不从 Streamlit 会话/secrets 读取）"""
+
+    def __init__(self, api_key="", api_base=DEFAULT_API_BASE, model_id=DEFAULT_MODEL_ID,
+                 temperature=0.3, max_tokens=1000, render_row_threshold=30,
+                 max_parallel_subqueries=4, dynamic_schema_prompt=True,
+                 llm_transport=None, llm_store=None, llm_latency_ms=0.0,
+                 query_timeout_s=10.0, max_result_rows=120, max_estimated_rows=200000, fetch_size=None,
+                 answer_token_budget=1200, team_table_path=DEFAULT_TEAM_TABLE_PATH,
+                 text_index_path=DEFAULT_TEXT_INDEX_PATH, text_top_k=4, speculative_execution=True,
+                 stage_models=None, hedge_model_id=None, stage_slo_ms=None, trace_path=None,
+                 faq_path=DEFAULT_FAQ_PATH, faq_questions=None,
+                 answer_memo_path=DEFAULT_ANSWER_MEMO_PATH, answer_memo_max_entries=DEFAULT_MAX_ENTRIES):
+        self.api_key = api_key or ""
+        self.api_base = api_base or DEFAULT_API_BASE
+        self.model_id = model_id or DEFAULT_MODEL_ID
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        # 结果行数不超过该阈值时，优先用确定性渲染器出答案，不调用 LLM
+        self.render_row_threshold = render_row_threshold
+        # 复合问题拆分后，子查询并发执行的线程数上限
+        self.max_parallel_subqueries = max_parallel_subqueries
+        # 是否在初始化时查询图谱结构构建动态提示词（否则使用手工Schema约束的默认提示词）
+        self.dynamic_schema_prompt = dynamic_schema_prompt
+        # LLM 录制/回放（modules/llm_transport.py）：None/live 直连，record/replay/auto 读写 llm_store 存档
+        self.llm_transport = llm_transport
+        self.llm_store = llm_store
+        # 回放时模拟的延迟（毫秒，或 "recorded" 使用录制时的耗时）
+        self.llm_latency_ms = llm_latency_ms
+        # 查询成本护栏（modules/query_guard.py）：服务端事务超时、客户端行数上限、EXPLAIN 预估行数上限
+        self.query_timeout_s = query_timeout_s
+        self.max_result_rows = max_result_rows
+        self.max_estimated_rows = max_estimated_rows
+        # 每批从 Neo4j 拉取的记录数（None 表示与 max_result_rows 一致）
+        self.fetch_size = fetch_size
+        # 回答阶段交给 LLM 的结果表格的 token 上限（modules/token_budget.py）
+        self.answer_token_budget = answer_token_budget
+        # 预计算配队表（scripts/materialize_team_table.py 生成）；文件不存在时配队/替代问题实时查询
+        self.team_table_path = team_table_path
+        # 故事/语音/攻略文本的 BM25 索引（scripts/build_text_index.py 生成）及每次检索返回的段落数
+        self.text_index_path = text_index_path
+        self.text_top_k = text_top_k
+        # 规则未命中但有“实体 + 部分关键词”候选时，候选模板查询与 LLM 生成并行执行
+        self.speculative_execution = speculative_execution
+        # 分阶段模型路由（modules/llm_router.py）：{cypher/answer/team: 模型}，未配置的阶段使用 model_id
+        self.stage_models = dict(stage_models or {})
+        # 对冲用的快速模型：主请求超过该阶段 hedge_ms 未返回时向它发备份请求（None 不对冲）
+        self.hedge_model_id = hedge_model_id
+        # 各阶段延迟 SLO 覆盖项 {stage: {"hedge_ms": .., "budget_ms": ..}}，超出 budget_ms 退回确定性渲染
+        self.stage_slo_ms = stage_slo_ms
+        # 链路追踪导出文件（OTLP/JSON，每条 trace 一行）；None 时只在内存里保留最近一条供界面展示
+        self.trace_path = trace_path
+        # 常见问题预计算答案（modules/faq_cache.py）：存储路径与问题列表（None 为示例问题 + 追踪日志高频问题）
+        self.faq_path = faq_path
+        self.faq_questions = faq_questions
+        # 回答记忆（modules/answer_memo.py）：相同意图 + 相同结果行复用 LLM 润色的回答；路径为 None 时关闭
+        self.answer_memo_path = answer_memo_path
+        self.answer_memo_max_entries = answer_memo_max_entries
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 {api_key, api_base, model_id, ...} 字典构建（与 st.session_state.llm_config 同构），忽略未知键"""
+        data = data or {}
+        keys = ("api_key", "api_base", "model_id", "temperature", "max_tokens",
+                "render_row_threshold", "max_parallel_subqueries", "dynamic_schema_prompt",
+                "llm_transport", "llm_store", "llm_latency_ms",
+                "query_timeout_s", "max_result_rows", "max_estimated_rows", "fetch_size",
+                "answer_token_budget", "team_table_path", "text_index_path", "text_top_k",
+                "speculative_execution", "stage_models", "hedge_model_id", "stage_slo_ms", "trace_path",
+                "faq_path", "faq_questions", "answer_memo_path", "answer_memo_max_entries")
+        return cls(**{k: data[k] for k in keys if k in data and data[k] is not None})
+
+    @classmethod
+    def from_env(cls, environ=None):
+        """
+        从环境变量 OPENAI_API_KEY / OPENAI_API_BASE / OPENAI_MODEL_ID（及 LLM_TRANSPORT / LLM_STORE / LLM_LATENCY_MS /
+        TEAM_TABLE_PATH / TEXT_INDEX_PATH / OPENAI_{CYPHER,ANSWER,TEAM}_MODEL_ID / OPENAI_HEDGE_MODEL_ID / QA_TRACE_PATH /
+        FAQ_PATH / ANSWER_MEMO_PATH）构建
+        """
+        env = os.environ if environ is None else environ
+        latency = env.get("LLM_LATENCY_MS") or 0.0
+        stage_models = {stage: env.get(f"OPENAI_{stage.upper()}_MODEL_ID") for stage in STAGES}
+        return cls(api_key=env.get("OPENAI_API_KEY", ""),
+                   api_base=env.get("OPENAI_API_BASE") or DEFAULT_API_BASE,
+                   model_id=env.get("OPENAI_MODEL_ID") or DEFAULT_MODEL_ID,
+                   llm_transport=env.get("LLM_TRANSPORT") or None,
+                   llm_store=env.get("LLM_STORE") or None,
+                   llm_latency_ms=latency if latency == "recorded" else float(latency),
+                   team_table_path=env.get("TEAM_TABLE_PATH") or DEFAULT_TEAM_TABLE_PATH,
+                   text_index_path=env.get("TEXT_INDEX_PATH") or DEFAULT_TEXT_INDEX_PATH,
+                   stage_models={k: v for k, v in stage_models.items() if v},
+                   hedge_model_id=env.get("OPENAI_HEDGE_MODEL_ID") or None,
+                   trace_path=env.get("QA_TRACE_PATH") or None,
+                   faq_path=env.get("FAQ_PATH") or DEFAULT_FAQ_PATH,
+                   answer_memo_path=env.get("ANSWER_MEMO_PATH") or DEFAULT_ANSWER_MEMO_PATH)
+
+
+def is_team_question(q: str) -> bool:
+    q = q or ""
+    # 覆盖“配队/组队/队友/阵容/搭配/配什么”等自然语言问法
+    return any(k in q for k in ["配队", "组队", "队伍", "队友", "阵容", "模板", "候选", "slot", "搭配", "配什么", "怎么配", "和谁", "推荐队友"])
+
+
+def extract_core_name(q: str) -> str:
+    q = (q or "").strip()
+    m = re.search(r"^(.*?)(适合|怎么|如何|配队|组队|队伍|队友)", q)
+    if m:
+        name = m.group(1).strip(" ？?，,。.")
+        return name or None
+    return q if len(q) <= 6 else None
+
+
+def is_substitute_question(q: str) -> bool:
+    """判断是否是“替代/平替/下位替代/上位替代”类型问题"""
+    q = (q or "").strip()
+    return any(k in q for k in ["下位替代", "上位替代", "平替", "替代", "代替", "替换", "替换成", "换成"])
+
+def extract_subject_name_for_substitute(q: str) -> str:
+    """
+    从“X的下位替代是谁 / X平替 / 用谁代替X”这类问法中抽取主体角色名 X
+    返回 None 表示未能抽取
+    """
+    q = (q or "").strip()
+
+    # 1) “X的下位替代/平替/替代...”
+    m = re.search(r"^(.*?)(的)?(下位替代|上位替代|平替|替代|代替|替换)", q)
+    if m:
+        name = (m.group(1) or "").strip(" ？?，,。.")
+        if name:
+            return name
+
+    # 2) “用谁代替X / 谁能替代X / 谁可以替换X”
+    m2 = re.search(r"(用谁|谁能|谁可以|哪个角色).*(代替|替代|替换).*(.*)$", q)
+    if m2:
+        tail = (m2.group(3) or "").strip(" ？?，,。.")
+        # tail 可能是“夜兰”或“夜兰？”或“夜兰这个位置”
+        # 只取前 6 个字符做个简单兜底（大多角色名 <= 6）
+        return tail[:6] if tail else None
+
+    return None
+
+def is_team_recommend_question(q: str) -> bool:
+    """判断是否是“推荐队友/和谁配队”类型问题"""
+    q = (q or "").strip()
+    # 典型：X适合和谁配队 / X和哪些角色组队 / 推荐X队友
+    if re.search(r"(适合|推荐).*(和|跟|与).*(谁|哪些|什么).*(配队|组队|队友|阵容)", q):
+        return True
+    if re.search(r"(配队|组队|队友|阵容).*(推荐|适合|搭配).*(谁|哪些|什么)", q):
+        return True
+    # 兜底：包含“适合”和“配队/队友”等关键字
+    if ("适合" in q) and any(k in q for k in ["配队", "组队", "队友", "阵容", "搭配"]):
+        return True
+    return False
+
+
+def extract_team_template_id(q: str) -> str:
+    """从问题里抽取 TeamTemplate 的 id，例如 TT:胡桃:双水蒸发"""
+    q = (q or "").strip()
+    m = re.search(r"(TT:[^\s，,。?？]+)", q)
+    return m.group(1) if m else None
+
+
+# ---------------------------
+# Cypher 生成安全层（防止 LLM 输出非 Cypher / 参数缺失）
+# ---------------------------
+_VALID_CYPHER_START = re.compile(r"^\s*(MATCH|OPTIONAL\s+MATCH|CALL|WITH|UNWIND|MERGE|CREATE|RETURN|SHOW|PROFILE|EXPLAIN)\b", re.I)
+
+def _sanitize_cypher_output(raw: str):
+    """
+    1) 去掉 ```cypher 代码块
+    2) 尝试从输出中截取第一段合法 Cypher（从关键字开始）
+    3) 修正常见前缀错误：'MAT ' -> 'MATCH '
+    """
+    if raw is None:
+        return None, "LLM返回为空"
+    s = str(raw).strip()
+    s = s.replace("```cypher", "").replace("```", "").strip()
+
+    # 常见错误：开头少了 CH
+    if re.match(r"^\s*MAT\b", s, flags=re.I):
+        s = re.sub(r"^\s*MAT\b", "MATCH", s, flags=re.I).strip()
+
+    # 从输出中截取第一段可执行 Cypher
+    m = re.search(r"\b(OPTIONAL\s+MATCH|MATCH|CALL|WITH|UNWIND|MERGE|CREATE|RETURN|SHOW|PROFILE|EXPLAIN)\b", s, flags=re.I)
+    if m and m.start() > 0:
+        s = s[m.start():].strip()
+
+    if not _VALID_CYPHER_START.search(s):
+        return None, f"LLM未返回可执行的Cypher：{raw}"
+
+    return s, None
+
+
+TEAM_TEMPLATE_LIST = """
+MATCH (tt)
+WHERE tt.label = 'TeamTemplate' AND tt.core_character = $core_name
+RETURN tt.id AS team_template_id, tt.archetype_name AS archetype, tt.focus AS focus,
+       tt.core_role AS core_role, tt.core_evidence AS core_evidence,
+       tt.example_team_members AS example_members, tt.example_team_evidence AS example_evidence
+ORDER BY focus DESC, archetype
+LIMIT 50
+""".strip()
+
+TEAM_TEMPLATE_EXPAND = """
+MATCH (tt)
+WHERE tt.label='TeamTemplate' AND tt.id = $team_template_id
+MATCH (tt)-[:HAS_SLOT_GROUP]->(sg)
+MATCH (sg)-[:HAS_SLOT]->(st)
+OPTIONAL MATCH (st)-[cand:CANDIDATE]->(ch)
+RETURN tt.id AS team_template_id, tt.archetype_name AS archetype,
+       sg.name AS slot_group, sg.min_select AS sg_min, sg.max_select AS sg_max, sg.mutual_exclusive AS sg_mutex,
+       st.slot AS slot, st.must AS must, st.need AS need,
+       ch.id AS candidate_id, ch.name AS candidate_name,
+       cand.fit AS fit, cand.evidence_confidence AS confidence, cand.reasoning_hint AS hint
+ORDER BY must DESC, confidence DESC
+LIMIT 300
+""".strip()
+
+# 批量展开：一次往返取回多个模板的全部 slot，候选在服务端按 slot 聚合好
+TEAM_TEMPLATE_EXPAND_BATCH = """
+UNWIND $team_template_ids AS tid
+MATCH (tt)
+WHERE tt.label='TeamTemplate' AND tt.id = tid
+MATCH (tt)-[:HAS_SLOT_GROUP]->(sg)
+MATCH (sg)-[:HAS_SLOT]->(st)
+OPTIONAL MATCH (st)-[cand:CANDIDATE]->(ch)
+WITH tt, sg, st, cand, ch
+ORDER BY cand.evidence_confidence DESC
+WITH tt, sg, st,
+     collect(CASE WHEN ch IS NULL THEN NULL ELSE {
+        candidate_id: ch.id,
+        candidate_name: ch.name,
+        fit: cand.fit,
+        confidence: cand.evidence_confidence,
+        hint: cand.reasoning_hint
+     } END) AS candidates
+RETURN tt.id AS team_template_id, tt.archetype_name AS archetype,
+       sg.name AS slot_group, sg.min_select AS sg_min, sg.max_select AS sg_max, sg.mutual_exclusive AS sg_mutex,
+       st.slot AS slot, st.must AS must, st.need AS need, candidates
+ORDER BY team_template_id, must DESC, slot
+LIMIT 300
+""".strip()
+
+# ---------------------------
+# “替代/平替/下位替代”问题：规则化查询
+# 解释策略：
+# - 优先使用 SlotTemplate 的 CANDIDATE 候选集来定义“替代”：同一个 slot 的其它候选，按 evidence_confidence/fit 等信息排序
+# - 若未命中（例如该角色在你的图谱里没有 slot 候选记录），再用 role_tag 做一个“功能相近”的兜底候选
+# ---------------------------
+
+SUBSTITUTE_BY_SLOT = """
+MATCH (st:SlotTemplate)-[cand:CANDIDATE]->(c:character)
+WHERE c.name CONTAINS $core_name
+WITH st, c, cand, coalesce(cand.evidence_confidence, 0) AS core_conf
+MATCH (st)-[cand2:CANDIDATE]->(alt:character)
+WHERE alt <> c
+WITH st, core_conf, alt, cand2
+ORDER BY core_conf DESC, coalesce(cand2.evidence_confidence, 0) DESC
+WITH st, core_conf,
+     collect({
+       name: alt.name,
+       fit: cand2.fit,
+       confidence: cand2.evidence_confidence,
+       hint: cand2.reasoning_hint
+     })[0..6] AS substitutes
+RETURN
+  st.team_template_id AS team_template_id,
+  st.slot AS slot,
+  core_conf AS core_confidence,
+  substitutes
+LIMIT 50
+""".strip()
+
+
+SUBSTITUTE_BY_ROLE_TAG = """
+MATCH (c:character)-[:belongs_role_tag]->(rt:role_tag)
+WHERE c.name CONTAINS $core_name
+MATCH (alt:character)-[:belongs_role_tag]->(rt)
+WHERE alt <> c
+WITH rt, collect(DISTINCT alt.name) AS names
+RETURN
+  rt.name AS shared_role_tag,
+  names[0..20] AS candidates
+LIMIT 30
+""".strip()
+
+# 槽位候选为空时，按角色相似度给出的替代候选数
+SUBSTITUTE_SIMILAR_K = 8
+
+# 配队推荐默认取前 k 个模板、每个槽位前 topn 个候选（预计算配队表按同样的参数生成）
+TEAM_RECOMMEND_K = 5
+TEAM_RECOMMEND_TOPN = 6
+
+TEAM_RECOMMEND = """
+MATCH (tt)
+WHERE tt.label='TeamTemplate' AND tt.core_character = $core_name
+WITH tt
+ORDER BY tt.focus DESC, tt.archetype_name
+LIMIT $k
+MATCH (tt)-[:HAS_SLOT_GROUP]->(sg)-[:HAS_SLOT]->(st)
+OPTIONAL MATCH (st)-[cand:CANDIDATE]->(ch)
+WITH tt, sg, st, cand, ch
+ORDER BY tt.id, sg.name, st.slot, st.must DESC, cand.evidence_confidence DESC
+WITH tt, sg, st,
+     collect(DISTINCT {
+        candidate_id: ch.id,
+        candidate_name: ch.name,
+        fit: cand.fit,
+        confidence: cand.evidence_confidence,
+        hint: cand.reasoning_hint
+     })[0..$topn] AS top_candidates
+RETURN
+  tt.id AS team_template_id,
+  tt.archetype_name AS archetype,
+  tt.focus AS focus,
+  sg.name AS slot_group,
+  sg.min_select AS sg_min,
+  sg.max_select AS sg_max,
+  sg.mutual_exclusive AS sg_mutex,
+  st.slot AS slot,
+  st.must AS must,
+  st.need AS need,
+  top_candidates AS candidates,
+  tt.example_team_members AS example_members,
+  tt.example_team_evidence AS example_evidence
+ORDER BY focus DESC, archetype, must DESC, slot
+LIMIT 400
+""".strip()
+
+
+# 回答记忆只复用规则路由意图的回答：同一意图 + 同一结果行问的是同一件事；
+# LLM 生成的查询（"llm"）、复合问题（None）与文本检索的回答依赖问题原文，相同结果行也不能互相复用
+MEMO_INTENTS = frozenset([i["name"] for i in INTENT_CATALOGUE]
+                         + ["substitute", "team_expand", "team_recommend", "team_list"])
+
+
+def route_by_rules(question: str, linker=None):
+    """
+    规则路由（不调用 LLM）：替代/配队硬规则 + 声明式意图目录
+    Returns:
+        {"intent", "cypher", "params", "error"}；返回 None 表示规则未命中，需要走 LLM
+    """
+    question = (question or "").strip()
+    linked_core = linker.first(question, "character") if linker else None
+
+    # 0) “替代/平替/下位替代”类问题：走规则映射（把语义落到现有图谱可查询的结构上）
+    if is_substitute_question(question):
+        core = linked_core or extract_subject_name_for_substitute(question) or extract_core_name(question)
+        if not core:
+            return {"intent": "substitute", "cypher": None, "params": None,
+                    "error": "没从问题中识别出要被替代的核心角色名（例如：夜兰/行秋）"}
+        # 先按 slot 候选查“可替代角色”（同 slot 的其它候选）
+        return {"intent": "substitute", "cypher": SUBSTITUTE_BY_SLOT, "params": {"core_name": core}, "error": None}
+
+    # 0) 配队类问题：走规则映射（避免 LLM 乱生成剧情关系）
+    if is_team_question(question):
+        tt_id = extract_team_template_id(question)
+        if tt_id:
+            return {"intent": "team_expand", "cypher": TEAM_TEMPLATE_EXPAND,
+                    "params": {"team_template_id": tt_id}, "error": None}
+
+        core = linked_core or extract_core_name(question)
+        if not core:
+            return {"intent": "team", "cypher": None, "params": None,
+                    "error": "没从问题中识别出核心角色名（例如：胡桃/诺艾尔/神里绫华）"}
+
+        # “X适合和谁配队/推荐队友” → 直接返回候选结构
+        if is_team_recommend_question(question):
+            return {"intent": "team_recommend", "cypher": TEAM_RECOMMEND,
+                    "params": {"core_name": core, "k": TEAM_RECOMMEND_K, "topn": TEAM_RECOMMEND_TOPN}, "error": None}
+
+        # 其它配队相关（例如“有哪些配队模板”）→ 先列出模板
+        return {"intent": "team_list", "cypher": TEAM_TEMPLATE_LIST, "params": {"core_name": core}, "error": None}
+
+    # 0.1) 常见问题：意图目录 + 参数化模板直连（突破材料/适配/掉落/克制/属性/同配音/国家统计…）
+    routed = match_intent(question, linker)
+    if routed:
+        return {"intent": routed["intent"], "cypher": routed["cypher"], "params": routed["params"], "error": None}
+
+    return None
+
+
+# ---------------------------
+# LLM 提示词布局：不变的大段内容（Schema、规则、示例）放 system 消息，逐字节稳定；
+# 每次请求变化的部分（问题、查询结果）放在最后的 user 消息里，命中服务端前缀缓存
+# ---------------------------
+CYPHER_QUESTION_TEMPLATE = "用户问题：{question}\n请生成 Cypher 查询语句："
+CYPHER_REPAIR_TEMPLATE = "上面的查询没有通过校验：\n{feedback}\n请修正后重新输出，只输出Cypher。"
+
+ANSWER_SYSTEM_PROMPT = """你是知识图谱问答助手，负责把结构化查询结果整理成易读的中文回答。严禁臆造。
+
+用户消息里会给出数据库查询得到的结果（列式表格：第一行为列名，之后每行一条记录，以 | 分隔；# 开头的行为说明），最后是用户问题。
+请输出面向用户的中文回答，要求：
+- 只可基于表格作答，不得编造表格未出现的实体、属性或结论
+- 优先归纳/分组/合并，避免逐行复述表格
+- 必要时说明‘结果中未体现’
+- 尽量使用项目符号，回答简洁清晰
+不要输出 JSON，不要输出 Cypher。"""
+
+TEAM_SYSTEM_PROMPT = """你是一个原神配队助手。只能做语言润色，不得引入或改写任何数值；并且输出中禁止出现任何数字。
+
+用户消息里会给出从知识图谱查询结果中提取的【配队事实摘要】（已去除所有数字字段；列式表格，第一行为列名，| 分隔），最后是用户问题。
+请把它润色成面向玩家的推荐说明，要求（必须满足）：
+1) 只基于摘要内容写作，不得编造未出现的角色、阵容或结论。
+2) 输出中禁止出现任何数字表达（包括阿拉伯数字与中文数字）。
+3) 结构清晰：按“阵容类型 -> 位置/需求 -> 候选角色”组织，可补充简短的理解提示。"""
+
+
+def prompt_version(prompt: str) -> str:
+    """提示词内容的短哈希：内容不变则版本不变，用于确认前缀在多次请求间逐字节一致"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+ANSWER_PROMPT_VERSION = prompt_version(ANSWER_SYSTEM_PROMPT)
+TEAM_PROMPT_VERSION = prompt_version(TEAM_SYSTEM_PROMPT)
+
+# 常见问题预计算按（文件路径, 模型/提示词版本）全进程只跑一份（Streamlit 每个会话一个引擎，不能每个会话各算一遍、
+# 各写一遍文件）；预计算跑在单独的无界面引擎上，不引用发起它的会话
+_faq_caches = {}
+_faq_caches_lock = threading.Lock()
+
+# plan_query 的 routed 参数缺省值：还没做过无 LLM 路由（None 表示做过但没命中）
+_NOT_ROUTED = object()
+
+# 推测执行里候选模板胜出后置位的 Event：随调用链（contextvar）传到 _chat，还没发出的 LLM 请求据此撤回
+_speculation_abandoned = contextvars.ContextVar("qa_speculation_abandoned", default=None)
+
+
+class _AnyEvent:
+    """多个放弃信号取“或”：任一 Event 置位即视为放弃（只实现准入控制用到的 is_set）"""
+
+    def __init__(self, *events):
+        self.events = [e for e in events if e is not None]
+
+    def is_set(self):
+        return any(e.is_set() for e in self.events)
+
+
+class KGQAEngine:
+    """知识图谱问答引擎（无界面依赖，可在脚本/HTTP 服务/Streamlit 中复用）"""
+
+    def __init__(self, kg_connector=None, config=None, driver=None, llm_client=None, entity_linker=None):
+        """
+        初始化问答引擎
+        Args:
+            kg_connector: Neo4j连接器对象（GenshinKnowledgeGraph），与 driver 二选一
+            config: QAConfig；为空时使用默认配置（无 API 密钥）
+            driver: 直接注入的 Neo4j driver
+            llm_client: 直接注入的 OpenAI 兼容客户端；为空时按 config.api_key 创建
+            entity_linker: 预先构建好的实体链接器（多个引擎实例可共享），为空则首次使用时从图谱构建
+        """
+        self.config = config or QAConfig()
+        self.kg = kg_connector
+        self.driver = driver if driver is not None else getattr(kg_connector, "driver", None)
+        self.client = llm_client
+        self.model_id = self.config.model_id
+        self.temperature = self.config.temperature
+        self.max_tokens = self.config.max_tokens
+        self.entity_linker = entity_linker
+        # 角色相似度索引（懒加载），替代问题在槽位候选为空时按相似度排序兜底
+        self.similarity_index = None
+        self.render_row_threshold = self.config.render_row_threshold
+        self.max_parallel_subqueries = self.config.max_parallel_subqueries
+        # 分阶段模型路由 + 对冲请求（首次调用 LLM 时按当时的 model_id 创建）
+        self.llm_router = None
+        # 全进程共享的 LLM 准入（并发上限 + 按会话公平排队 + 过载快速拒绝）；
+        # 一个引擎实例默认算一个会话（Streamlit 每个会话一个引擎），HTTP 服务用 llm_session 按请求指定
+        self.llm_admission = get_llm_limiter()
+        self.session_id = uuid.uuid4().hex[:12]
+        # 链路追踪：每次 ask 一条 trace，按阶段记录 span（modules/tracing.py）
+        self.tracer = Tracer(self.config.trace_path)
+        # 常见问题预计算答案（start_faq_precompute 启动后可用）
+        self.faq = None
+        # 图谱版本（计数指纹）缓存：回答记忆、预计算答案与预计算配队表都按它失效
+        self._graph_version = None
+        self._graph_version_at = 0.0
+        self._graph_version_lock = threading.Lock()
+        self._graph_version_refreshing = False
+        # 回答记忆：不同问法、相同结果行时复用 LLM 润色的回答
+        self.answer_memo = None
+        if self.config.answer_memo_path:
+            try:
+                self.answer_memo = AnswerMemo(self.config.answer_memo_path, self.config.answer_memo_max_entries)
+            except Exception as e:
+                self._report("warning", f"打开回答记忆失败：{str(e)}")
+        # 图谱 Schema 快照（懒加载），用于在执行前静态校验 LLM 生成的 Cypher
+        self.schema_snapshot = None
+        # Cypher 校验失败时，带着错误反馈让 LLM 重新生成的次数
+        self.max_cypher_repairs = 1
+        self.query_budget = QueryBudget(max_estimated_rows=self.config.max_estimated_rows,
+                                        timeout_s=self.config.query_timeout_s,
+                                        row_cap=self.config.max_result_rows,
+                                        fetch_size=self.config.fetch_size)
+        # 预计算配队表：配队推荐/替代问题按角色名一次查表
+        self.team_table = TeamTable.open(self.config.team_table_path)
+        self._team_table_stale_reported = False
+        # 文本检索索引（内存映射，打开很快）；不存在时文本类问题仍走 LLM 生成 Cypher
+        try:
+            self.text_retriever = TextRetriever.open(self.config.text_index_path)
+        except Exception as e:
+            self._report("warning", f"加载文本检索索引失败：{str(e)}")
+            self.text_retriever = None
+        # 推测执行：LLM 生成放到线程池里与候选查询并行；统计命中率与节省的时间
+        self._speculation_pool = None
+        self._speculation_lock = threading.Lock()
+        self.speculation_stats = {"attempts": 0, "hits": 0, "misses": 0, "llm_abandoned": 0, "saved_ms": 0.0}
+        # 每个线程最近一次回答的 token 压缩报告（ask_many 多线程并发时互不覆盖）
+        self._local = threading.local()
+
+        # 各阶段提示词前缀缓存统计（服务端在 usage.prompt_tokens_details.cached_tokens 里返回命中的 token 数）
+        self._prompt_cache_lock = threading.Lock()
+        self.prompt_cache_stats = {}
+
+        # 1. 先给一个默认的安全提示词，防止后续逻辑崩坏
+        self.system_prompt = self._get_fallback_prompt()
+
+        # 2. 初始化LLM客户端（已注入则直接使用）
+        if self.client is None:
+            self._init_llm_client()
+
+        # 3. 动态获取知识图谱结构并构建系统提示词
+        if self.client is not None and self.driver is not None and self.config.dynamic_schema_prompt:
+            dynamic_prompt = self._build_system_prompt()
+            # 只有成功获取到动态prompt才覆盖默认值
+            if dynamic_prompt:
+                self.system_prompt = dynamic_prompt
+        self.system_prompt_version = prompt_version(self.system_prompt)
+
+    def _report(self, level, message):
+        """初始化/运行过程中的提示信息；引擎只写日志，界面层可覆盖为页面提示"""
+        logger.log(getattr(logging, level.upper(), logging.INFO), message)
+
+    def _init_llm_client(self):
+        """按 config 创建 LLM 客户端（不做连接测试，连接问题在首次调用时以错误形式返回）"""
+        if not self.config.api_key and self.config.llm_transport != "replay":
+            self._report("warning", "未配置OpenAI API密钥，问答功能将受限")
+            return
+        try:
+            self.client = create_llm_client(self.config.api_key, self.config.api_base,
+                                            transport=self.config.llm_transport,
+                                            store_path=self.config.llm_store,
+                                            latency_ms=self.config.llm_latency_ms)
+        except Exception as e:
+            self._report("error", f"初始化LLM客户端失败: {str(e)}")
+            self.client = None
+
+    def _manual_schema_constraints(self):
+        """手工写死的Schema约束（优先级高于动态schema），用于防止LLM臆造标签/关系/节点。"""
+        return """【强制Schema约束（最高优先级）】
+你只能使用以下节点标签（label）与关系类型（relationship type）。禁止创造任何未列出的标签/关系名。
+
+一、关系模式（只允许这些关系类型）
+character --[关系类型]--> character
+SlotTemplate --[CANDIDATE]--> character
+TeamTemplate --[CORE]--> character
+TeamTemplate --[EXAMPLE_MEMBER]--> character
+SlotGroup --[HAS_SLOT]--> SlotTemplate
+TeamTemplate --[HAS_SLOT_GROUP]--> SlotGroup
+SlotTemplate --[REQUIRES_ROLE_TAG]--> role_tag
+character --[belongs_role_tag]--> role_tag
+monster --[drops_material]--> artifact
+monster --[drops_material]--> material
+monster --[drops_material]--> monster
+character --[from_country]--> country
+character --[has_element]--> element
+character --[needs_material]--> material
+material --[needs_material]--> material
+weapon --[needs_material]--> material
+character --[restrains]--> monster
+character --[suits]--> artifact
+character --[suits_weapon]--> weapon
+element --[trigger]--> reaction
+reaction --[trigger]--> reaction
+
+二、节点属性（只允许访问这些属性；不要假设别的属性存在）
+- SlotGroup: id, name, description, slot_template_ids, label, group_type, mutual_exclusive, min_select, max_select, team_template_id
+- SlotTemplate: id, evidence, need, label, slot, slot_group_id, must, team_template_id
+- TeamTemplate: id, archetype_name, focus, label, core_evidence, core_character, example_team_members, example_team_evidence, core_role
+- artifact: id, min/max_rarity, 4piece_effect, name, source, 2piece_effect, img_src, suits_roles, recommended_roles
+- character: id, name, img_src, profession, birthday, country, cn_CV, gender, weapon_type, description, title, primordial_force, constellation, affiliation, species, nickname, body_type, special_dish, TAG, rarity, element
+- country: id, name, description, army, en_name
+- element: id, name
+- material: id, name, source, img_src, type, usage
+- monster: id, name, img_src, TAG, element, type, drop, region, strategy, refresh_time
+- reaction: id, name, reaction_element
+- role_tag: id, name, description, aliases
+- weapon: id, name, source, img_src, rarity, type, max_subproperty, min_subproperty, min_attack, effect, max_attack
+
+三、关键说明（非常重要，避免生成错误Cypher）
+- cn_CV 是 character 节点的【属性】（character.cn_CV），不是节点，也不是关系类型。禁止生成 (:cv) 节点或 [:cn_CV] 关系。
+- 同配音/同国家/同元素 这类问题优先用属性分组：
+  WITH x, collect(DISTINCT name) AS list
+  WHERE size(list) > 1
+  RETURN x, list
+  LIMIT 20
+- RETURN 时优先返回可读的标量属性：例如 c.name, m.name, country.name；避免直接 RETURN 整个节点变量（例如 RETURN cv）。
+"""
+
+
+    def _get_fallback_prompt(self):
+        """返回默认的、不依赖数据库查询的提示词（基于手工Schema约束）"""
+        schema = self._manual_schema_constraints()
+        return f"""你是一个原神知识图谱的 Cypher 查询专家。请根据用户的问题，生成可执行的 Neo4j Cypher 查询语句。只输出可执行Cypher，不要解释。
+
+{schema}
+
+【生成要求】
+1) 只输出 Cypher 查询语句，不要解释，不要 Markdown 代码块。
+2) 只能使用上面列出的标签/关系/属性；不要创造任何不存在的关系或节点（尤其禁止 cv 节点、禁止 cn_CV 关系）。
+3) 尽量使用模糊查询：对 name 字段用 `CONTAINS`（例如 `WHERE c.name CONTAINS '胡桃'`）。
+4) 输出要“可读”：RETURN 时用 `AS` 给字段起清晰名字（例如 `c.name AS character`），避免 RETURN 整个节点变量。
+5) 默认加 `LIMIT 20`。
+
+【常见模式示例（仅作参考，可按问题调整）】
+- 角色信息：MATCH (c:character) WHERE c.name CONTAINS '钟离' RETURN c.name AS name, c.description AS description, c.rarity AS rarity LIMIT 20
+- 角色突破材料：MATCH (c:character)-[:needs_material]->(m:material) WHERE c.name CONTAINS '钟离' RETURN c.name AS character, collect(DISTINCT m.name) AS materials LIMIT 20
+- 怪物掉落：MATCH (mon:monster)-[:drops_material]->(m) WHERE mon.name CONTAINS '丘丘' RETURN mon.name AS monster, collect(DISTINCT m.name) AS drops LIMIT 20
+- 武器适合角色：MATCH (w:weapon)<-[:suits_weapon]-(c:character) WHERE w.name CONTAINS '护摩' RETURN w.name AS weapon, collect(DISTINCT c.name) AS characters LIMIT 20
+- 相同中文配音：MATCH (c:character) WHERE c.cn_CV IS NOT NULL AND c.cn_CV <> '' WITH c.cn_CV AS cn_CV, collect(DISTINCT c.name) AS characters WHERE size(characters) > 1 RETURN cn_CV, characters LIMIT 20
+
+用户问题在最后一条消息中给出。
+"""
+    def _build_system_prompt(self, print_info=False):
+            """动态构建系统提示词，从Neo4j查询知识图谱结构"""
+            try:
+                # 执行查询语句来获取知识图谱结构
+                with self.driver.session() as session:
+                    # 查询1: 获取节点类型及数量
+                    node_query = """
+                    MATCH (n)
+                    UNWIND labels(n) AS label
+                    RETURN label AS node_label, count(*) AS count
+                    ORDER BY count DESC, node_label
+                    """
+                    node_result = session.run(node_query)
+                    node_info = []
+                    for record in node_result:
+                        node_info.append(f"- {record['node_label']}: {record['count']}个")
+
+                    # 查询2: 获取关系类型及数量
+                    rel_query = """
+                    MATCH ()-[r]->()
+                    RETURN type(r) as relation_label, count(r) as count
+                    ORDER BY count DESC, relation_label
+                    """
+                    rel_result = session.run(rel_query)
+                    rel_info = []
+                    for record in rel_result:
+                        rel_info.append(f"- {record['relation_label']}: {record['count']}条")
+
+                    # 查询3: 获取关系模式
+                    pattern_query = """
+                    MATCH (a)-[r]->(b)
+                    RETURN DISTINCT 
+                      [label in labels(a) | label] as source_labels, 
+                      type(r) as relationship_type, 
+                      [label in labels(b) | label] as target_labels
+                    ORDER BY relationship_type
+                    """
+                    pattern_result = session.run(pattern_query)
+                    pattern_info = []
+                    for record in pattern_result:
+                        source = ', '.join(record['source_labels']) if record['source_labels'] else '未知'
+                        target = ', '.join(record['target_labels']) if record['target_labels'] else '未知'
+                        pattern_info.append(f"- {source} --[{record['relationship_type']}]--> {target}")
+
+                    # 查询4: 获取每类节点的属性
+                    node_props_query = """
+                    MATCH (n)
+                    UNWIND labels(n) AS label
+                    WITH label, n
+                    LIMIT 100
+                    UNWIND keys(n) AS prop
+                    RETURN label, collect(DISTINCT prop) as properties
+                    ORDER BY label
+                    """
+                    node_props_result = session.run(node_props_query)
+                    node_props_info = {}
+                    for record in node_props_result:
+                        label = record['label']
+                        # 排序：collect 的顺序不稳定，提示词要逐字节一致才能命中前缀缓存
+                        node_props_info[label] = sorted(record['properties'])
+
+                    # 查询5: 获取每类关系的属性
+                    rel_props_query = """
+                    MATCH ()-[r]->()
+                    WITH type(r) as rel_type, r
+                    LIMIT 100
+                    UNWIND keys(r) AS prop
+                    RETURN rel_type, collect(DISTINCT prop) as properties
+                    ORDER BY rel_type
+                    """
+                    rel_props_result = session.run(rel_props_query)
+                    rel_props_info = {}
+                    for record in rel_props_result:
+                        rel_type = record['rel_type']
+                        rel_props_info[rel_type] = sorted(record['properties'])
+
+                    # 构建文本块
+                    node_section = "\n".join(node_info) if node_info else "未获取到节点信息"
+                    rel_section = "\n".join(rel_info) if rel_info else "未获取到关系信息"
+                    pattern_section = "\n".join(sorted(pattern_info)) if pattern_info else "未获取到关系模式信息"
+
+                    # 构建节点属性部分
+                    node_props_section = ""
+                    for label, props in sorted(node_props_info.items()):
+                        props_str = ', '.join([p for p in props if p not in ['embedding']]) # 过滤掉embedding等长属性
+                        if props_str:
+                            node_props_section += f"- {label}: {props_str}\n"
+                        else:
+                            node_props_section += f"- {label}: 无特定属性\n"
+
+                    if not node_props_section:
+                        node_props_section = "未获取到节点属性信息"
+
+                    # 构建关系属性部分
+                    rel_props_section = ""
+                    for rel_type, props in sorted(rel_props_info.items()):
+                        props_str = ', '.join(props)
+                        if props_str:
+                            rel_props_section += f"- {rel_type}: {props_str}\n"
+                        else:
+                            rel_props_section += f"- {rel_type}: 无特定属性\n"
+
+                    if not rel_props_section:
+                        rel_props_section = "未获取到关系属性信息"
+
+                # === [关键修复]：这里必须拼接并返回最终的 Prompt 字符串 ===
+                manual_constraints = self._manual_schema_constraints()
+
+                final_prompt = f"""
+    你是一个原神知识图谱的Cypher查询专家。请根据用户的问题，生成相应的Neo4j查询语句。只输出可执行Cypher，不要解释。
+
+    ## 1. 知识图谱 Schema 信息
+    以下是当前数据库的实时结构，请严格基于此 Schema 生成查询：
+
+    ### (0) 强制Schema约束（最高优先级，覆盖动态schema）
+    {manual_constraints}
+
+    ### (1) 节点类型 (Labels)
+    {node_section}
+
+    ### (2) 关系类型 (Relationships)
+    {rel_section}
+
+    ### (3) 合法的关系链路 (Patterns)
+    {pattern_section}
+
+    ### (4) 节点属性详情
+    {node_props_section}
+
+    ### (5) 关系属性详情
+    {rel_props_section}
+
+    ## 2. 生成规则
+    0. **强制约束**：只能使用 (0) 手工Schema约束里列出的标签/关系/属性；禁止创造未列出的标签/关系；cn_CV 是 character 的属性，不是节点/关系；RETURN 优先返回标量属性，不要 RETURN 整个节点变量。
+
+    1. **只生成 Cypher 语句**：不要包含 Markdown 标记（如 ```cypher），不要包含解释。
+    2. **属性匹配**：尽量使用 `CONTAINS` 进行模糊匹配，例如 `WHERE n.name CONTAINS '胡桃'`，因为用户输入可能不精确。
+    3. **关系方向**：请注意 `pattern_section` 中的方向，虽然 Cypher 可以忽略方向，但建议根据 Schema 指定正确方向或使用无向查询 `()-[]-()`。
+    4. **多跳查询**：如果问题涉及复杂的逻辑（如“胡桃的突破材料在哪里刷”），请生成多跳查询。
+    5. **限制返回**：请始终加上 `LIMIT 20` 防止返回过多数据。
+    6. **无结果处理**：不需要在 Cypher 里处理，由后续程序处理。
+
+    ## 3. 用户输入
+    用户问题在最后一条消息中给出。
+    """
+                return final_prompt
+
+            except Exception as e:
+                self._report("error", f"获取知识图谱结构失败: {str(e)}")
+                # 返回默认的系统提示词
+                return self._get_fallback_prompt()
+
+    def _chat(self, stage, messages, temperature, max_tokens):
+        """问答各阶段（stage: cypher / answer / team）调用 LLM 的统一入口，按需限速"""
+        def create(model):
+            with self.tracer.span("qa.llm.request", stage=stage, model=model) as span:
+                # 对冲的备份请求同样要过限速器与全局准入（排队过长时抛 LLMOverloaded，调用方走规则兜底）
+                # ask_many 指定的 rate_limit 随调用链传递（contextvar），只约束本批次的请求
+                bucket = current_llm_rate_limit()
+                if bucket is not None:
+                    bucket.acquire()
+                # 路由器已放弃这次请求（超预算 / 对冲另一方已返回）或推测执行的候选模板已胜出时，
+                # 还在排队的直接撤回，不再发出付费请求
+                cancelled = _AnyEvent(current_call_abandoned(), _speculation_abandoned.get())
+                t_queue = time.perf_counter()
+                with self.llm_admission.slot(current_llm_session(self.session_id), cancelled=cancelled):
+                    span.set(queue_ms=round((time.perf_counter() - t_queue) * 1000.0, 2))
+                    if cancelled.is_set():
+                        raise LLMCancelled("LLM 请求已被放弃")
+                    response = self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                usage = getattr(response, "usage", None)
+                prompt_tokens, cached_tokens = self._record_prompt_cache(stage, usage)
+                span.set(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens,
+                         completion_tokens=getattr(usage, "completion_tokens", None))
+                return response
+
+        # 按阶段选模型；超过 hedge_ms 向快速模型发备份请求，超过 budget_ms 抛 LLMDeadlineExceeded
+        with self.tracer.span("qa.llm", stage=stage, model=self._get_llm_router().model_for(stage)):
+            return self._get_llm_router().call(stage, self.tracer.bind(create))
+
+    def _get_llm_router(self):
+        if self.llm_router is None:
+            # 线程池按全进程准入上限开：同时在途的请求本来就不会超过它，多开的线程只会在准入队列里等
+            self.llm_router = StageRouter(self.model_id, stage_models=self.config.stage_models,
+                                          hedge_model=self.config.hedge_model_id, slo_ms=self.config.stage_slo_ms,
+                                          max_workers=self.llm_admission.max_concurrency)
+        return self.llm_router
+
+    def llm_admission_report(self):
+        """全进程 LLM 准入统计：队列深度、在途数、放行/拒绝次数、排队等待分位数"""
+        return self.llm_admission.stats()
+
+    def llm_stage_report(self):
+        """分阶段模型路由统计：各阶段模型、SLO、对冲次数/胜出次数、超预算次数、耗时 p50/p95"""
+        return self._get_llm_router().report()
+
+    def _record_prompt_cache(self, stage, usage):
+        """累计各阶段的输入 token 与前缀缓存命中 token（服务端未返回 usage 时只计调用次数）"""
+        prompt_tokens = getattr(usage, "prompt_tokens", None) if usage is not None else None
+        details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+        if isinstance(details, dict):
+            cached = details.get("cached_tokens")
+        else:
+            cached = getattr(details, "cached_tokens", None)
+        with self._prompt_cache_lock:
+            st = self.prompt_cache_stats.setdefault(
+                stage, {"calls": 0, "reported": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            st["calls"] += 1
+            if isinstance(prompt_tokens, int):
+                st["reported"] += 1
+                st["prompt_tokens"] += prompt_tokens
+                st["cached_tokens"] += cached if isinstance(cached, int) else 0
+        return prompt_tokens, cached
+
+    def prompt_cache_report(self):
+        """前缀缓存统计：各阶段调用数、输入 token、缓存命中 token 与命中率，以及当前 Cypher 提示词版本"""
+        with self._prompt_cache_lock:
+            stages = {k: dict(v) for k, v in self.prompt_cache_stats.items()}
+        for st in stages.values():
+            st["hit_rate"] = round(st["cached_tokens"] / st["prompt_tokens"], 4) if st["prompt_tokens"] else None
+        return {"system_prompt_version": self.system_prompt_version, "stages": stages}
+
+    def _get_entity_linker(self):
+        """懒加载实体链接器：首次使用时从图谱一次性构建，失败则用空词典（退回正则抽取）"""
+        if self.entity_linker is None:
+            try:
+                self.entity_linker = EntityLinker.from_graph(self.driver)
+            except Exception:
+                self.entity_linker = EntityLinker()
+        return self.entity_linker
+
+    def _get_similarity_index(self):
+        """懒加载角色相似度索引：首次使用时从图谱一次性读取特征，失败则用空索引"""
+        if self.similarity_index is None:
+            try:
+                self.similarity_index = SimilarityIndex.from_graph(self.driver)
+            except Exception as e:
+                self._report("warning", f"构建角色相似度索引失败：{str(e)}")
+                self.similarity_index = SimilarityIndex([])
+        return self.similarity_index
+
+    def similar_characters(self, name, k=5, facets=None, metric="cosine"):
+        """
+        与某角色最相似的 k 个角色（替代候选排序）
+        Args:
+            name: 角色名或昵称（会先做实体链接得到规范名）
+            facets: None（全部特征面）/ 特征面名列表 / {特征面: 权重}，见 modules/similarity.py
+        Returns:
+            [{"name", "score", "shared"}]
+        """
+        canonical = self._link_character(name) or name
+        return self._get_similarity_index().similar(canonical, k=k, facets=facets, metric=metric)
+
+    def _rank_role_tag_candidates(self, core, rows):
+        """SUBSTITUTE_BY_ROLE_TAG 的结果行：每个定位标签下的候选按与核心角色的相似度排序"""
+        index = self._get_similarity_index()
+        canonical = self._link_character(core) or core
+        ranked = []
+        for row in rows:
+            if isinstance(row, dict) and isinstance(row.get("candidates"), list):
+                row = dict(row, candidates=index.rank(canonical, row["candidates"]))
+            ranked.append(row)
+        return ranked
+
+    def _get_schema_snapshot(self):
+        """懒加载 Schema 快照：首次使用时从图谱元数据读取，失败则用手工Schema（宽松校验）"""
+        if self.schema_snapshot is None:
+            try:
+                self.schema_snapshot = SchemaSnapshot.from_graph(self.driver)
+            except Exception:
+                self.schema_snapshot = SchemaSnapshot.manual()
+        return self.schema_snapshot
+
+    def _link_character(self, question):
+        """用实体链接器取问题里的第一个角色规范名（昵称会被映射到规范名）"""
+        linker = self._get_entity_linker()
+        return linker.first(question, "character") if linker else None
+
+    def plan_query(self, question, routed=_NOT_ROUTED):
+        """
+        问题 -> 查询计划
+        Args:
+            routed: 调用方已经做过的无 LLM 路由结果（_route_without_llm 的返回值，None 表示未命中），传入时不再重复路由
+        Returns:
+            {"intent", "cypher", "params", "error", "source"}，source 为 "rule" 或 "llm"
+        """
+        question = (question or "").strip()
+        if routed is not _NOT_ROUTED and routed:
+            return routed
+        with self.tracer.span("qa.plan") as span:
+            # 0) 规则路由 / 文本检索：命中则不调用 LLM
+            plan = self._route_without_llm(question) if routed is _NOT_ROUTED else None
+            if not plan:
+                # 1) 其它问题：走LLM生成Cypher（有候选模板时与之并行推测执行）
+                plan = self._plan_by_llm(question)
+            span.set(source=plan.get("source"), intent=plan.get("intent"), error=plan.get("error"))
+            return plan
+
+    def _plan_by_llm(self, question, llm_pool=None):
+        """
+        LLM 规划；有推测候选时 LLM 请求放进线程池，同时在当前线程执行候选模板查询：
+        候选结果通过合理性检查就直接采用（不再等待 LLM），否则等 LLM 的结果
+        Args:
+            llm_pool: 可选，LLM 请求使用的线程池（ask_many 传入自己的 LLM 池）
+        """
+        spec = speculative_intent(question, self._get_entity_linker())
+        if not self.config.speculative_execution or spec is None or self.driver is None:
+            if llm_pool is None:
+                cypher, error = self._generate_cypher_by_llm(question)
+            else:
+                cypher, error = llm_pool.submit(self.tracer.bind(self._generate_cypher_by_llm), question).result()
+            if error and spec is not None and self.driver is not None:
+                # LLM 失败（过载被拒/超时等）：退回关键词候选模板，有结果就用
+                rows, spec_error = self.execute_query(spec["cypher"], spec["params"] or {})
+                if not spec_error and rows:
+                    return self._spec_plan(spec, rows, source="rule_fallback")
+            return self._llm_plan(question, cypher, error)
+
+        pool = llm_pool or self._get_speculation_pool()
+        llm_abandoned = threading.Event()
+        future = pool.submit(self.tracer.bind(self._speculative_cypher_by_llm), question, llm_abandoned)
+        rows, spec_error = self.execute_query(spec["cypher"], spec["params"] or {})
+        if spec_error is None and self._speculation_ok(spec, rows):
+            hit_at = time.perf_counter()
+            # 还没开始的任务直接取消；已开始的在发出 LLM 请求（含修正轮次）前检查放弃信号并撤回，
+            # 已经发出的同步请求无法中断，结果到达后丢弃，只记录节省的时间
+            llm_abandoned.set()
+            abandoned = not future.cancel()
+            self._bump_speculation(hits=1, llm_abandoned=int(abandoned))
+            if abandoned:
+                future.add_done_callback(
+                    lambda f: self._bump_speculation(saved_ms=(time.perf_counter() - hit_at) * 1000.0))
+            return self._spec_plan(spec, rows, source="speculative")
+
+        self._bump_speculation(misses=1)
+        cypher, error = future.result()
+        if error and not spec_error and rows:
+            # LLM 失败（过载被拒/超时等）：候选模板虽未通过合理性检查，有结果也比没有好
+            return self._spec_plan(spec, rows, source="rule_fallback")
+        return self._llm_plan(question, cypher, error)
+
+    def _speculative_cypher_by_llm(self, question, abandoned):
+        """推测执行里的 LLM 规划：把放弃信号放进上下文，候选模板胜出后未发出的请求不再发出"""
+        token = _speculation_abandoned.set(abandoned)
+        try:
+            return self._generate_cypher_by_llm(question)
+        finally:
+            _speculation_abandoned.reset(token)
+
+    def _spec_plan(self, spec, rows, source):
+        return {"intent": spec["intent"], "cypher": spec["cypher"], "params": spec["params"], "error": None,
+                "source": source, "prefetched": rows}
+
+    def _get_speculation_pool(self):
+        if self._speculation_pool is None:
+            with self._speculation_lock:
+                if self._speculation_pool is None:
+                    self._speculation_pool = ThreadPoolExecutor(max_workers=max(4, self.max_parallel_subqueries),
+                                                                thread_name_prefix="qa-speculate")
+        return self._speculation_pool
+
+    def _bump_speculation(self, **delta):
+        with self._speculation_lock:
+            if "hits" in delta or "misses" in delta:
+                self.speculation_stats["attempts"] += 1
+            for k, v in delta.items():
+                self.speculation_stats[k] += v
+
+    def _speculation_ok(self, spec, rows):
+        """候选结果的合理性检查：非空、未被截断、至少一行有主实体之外的有效值，且结果里能找到主实体"""
+        if not isinstance(rows, list) or not rows:
+            return False
+        if self.query_budget.row_cap and len(rows) >= self.query_budget.row_cap:
+            return False
+        subject = str((spec.get("params") or {}).get("name") or "")
+        found_subject = not subject
+        has_value = False
+        for r in rows:
+            if not isinstance(r, dict):
+                return False
+            for v in r.values():
+                if v is None or v == "" or v == [] or v == {}:
+                    continue
+                if subject and subject in json.dumps(v, ensure_ascii=False, default=str):
+                    found_subject = True
+                    if v == subject:
+                        continue
+                has_value = True
+        return found_subject and has_value
+
+    def speculation_report(self):
+        """推测执行统计：尝试次数、命中率、被放弃的 LLM 请求数、累计节省的等待时间（毫秒）"""
+        with self._speculation_lock:
+            stats = dict(self.speculation_stats)
+        stats["hit_rate"] = round(stats["hits"] / stats["attempts"], 4) if stats["attempts"] else None
+        stats["saved_ms"] = round(stats["saved_ms"], 2)
+        return stats
+
+    def _llm_plan(self, question, cypher, error):
+        """LLM 生成结果 -> 查询计划；生成失败时如果文本检索有结果，改走文本检索"""
+        if error:
+            text_plan = self._text_plan(question, force=True)
+            if text_plan and self.search_texts(**text_plan["params"]):
+                return text_plan
+        return {"intent": "llm", "cypher": cypher, "params": {} if cypher else None, "error": error, "source": "llm"}
+
+    def _route_without_llm(self, question):
+        """不调用 LLM 的路由：规则路由优先，其次是故事/语音/攻略类文本问题"""
+        with self.tracer.span("qa.route") as span:
+            linker = self._get_entity_linker()
+            with self.tracer.span("qa.entity_link") as link_span:
+                entities = linker.link(question) if linker else []
+                link_span.set(entities=[f"{e['label']}:{e['name']}" for e in entities])
+            plan = route_by_rules(question, linker)
+            if plan:
+                plan["source"] = "rule"
+            else:
+                plan = self._text_plan(question)
+            span.set(hit=plan is not None, intent=plan.get("intent") if plan else None)
+            return plan
+
+    def _text_plan(self, question, force=False):
+        """
+        文本检索计划（没有 Cypher）
+        Args:
+            force: 问题里没有文本类关键词时也检索（LLM 生成 Cypher 失败后的兜底）
+        """
+        if self.text_retriever is None:
+            return None
+        sources = detect_sources(question)
+        if not sources and not force:
+            return None
+        params = {"query": question, "character": self._link_character(question), "sources": sources}
+        return {"intent": "text_search", "cypher": None, "params": params, "error": None, "source": "text"}
+
+    def search_texts(self, query, character=None, sources=None, k=None):
+        """
+        在角色故事/语音/攻略文本里做 BM25 检索
+        Returns:
+            [{"character", "source", "title", "text", "score"}]；没有索引时返回 []
+        """
+        if self.text_retriever is None:
+            return []
+        return self.text_retriever.search(query, k=k or self.config.text_top_k, character=character, sources=sources)
+
+    def _text_display(self, params):
+        sources = "、".join(SOURCE_LABELS[s] for s in (params.get("sources") or [])) or "全部文本"
+        scope = f"{params['character']}的" if params.get("character") else ""
+        return f"// 文本检索（BM25，{scope}{sources}，未访问数据库）：{params.get('query')}"
+
+    def generate_cypher(self, question):
+        """将自然语言问题映射为 (cypher, params, error)"""
+        plan = self.plan_query(question)
+        return plan["cypher"], plan["params"], plan["error"]
+
+    def _generate_cypher_by_llm(self, question):
+        """调用 LLM 生成 Cypher，返回 (cypher, error)"""
+        if not self.client:
+            return None, "LLM客户端未初始化，请检查API配置"
+        with self.tracer.span("qa.cypher_generation") as span:
+            cypher, error = self._generate_cypher_with_repairs(question)
+            span.set(error=error)
+            return cypher, error
+
+    def _generate_cypher_with_repairs(self, question):
+        try:
+            with self.tracer.span("qa.prompt_build") as span:
+                if not self.system_prompt:
+                    self.system_prompt = self._get_fallback_prompt()
+                    self.system_prompt_version = prompt_version(self.system_prompt)
+
+                # 不变的提示词整体作为 system 前缀，问题放在最后
+                messages = [
+                    {"role": "system", "content": self.system_prompt},
+                    {"role": "user", "content": CYPHER_QUESTION_TEMPLATE.format(question=question)}
+                ]
+                span.set(prompt_version=self.system_prompt_version, prompt_chars=len(self.system_prompt))
+
+            # 生成后先做本地静态校验；不通过则把错误反馈给 LLM 重新生成，仍不通过就不访问数据库
+            # （缺少 LIMIT 不在此返工：执行时 EXPLAIN 预检前由 ensure_limit 补上）
+            for attempt in range(self.max_cypher_repairs + 1):
+                response = self._chat(
+                    "cypher",
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens
+                )
+
+                raw = response.choices[0].message.content
+                cypher, sanitize_err = _sanitize_cypher_output(raw)
+                if sanitize_err:
+                    return None, sanitize_err
+
+                with self.tracer.span("qa.cypher_validate", attempt=attempt) as span:
+                    problems = validate_cypher(cypher, self._get_schema_snapshot())
+                    span.set(problems=len(problems))
+                if not problems:
+                    return cypher, None
+                if attempt < self.max_cypher_repairs:
+                    feedback = "\n".join(f"- {p}" for p in problems)
+                    messages = messages + [
+                        {"role": "assistant", "content": cypher},
+                        {"role": "user", "content": CYPHER_REPAIR_TEMPLATE.format(feedback=feedback)},
+                    ]
+
+            return None, "生成的Cypher未通过校验: " + "；".join(problems)
+
+        except Exception as e:
+            return None, f"生成Cypher查询失败: {str(e)}"
+
+    def execute_query(self, cypher, params=None, preflight=False):
+        """
+        执行Cypher查询（带事务超时与行数上限）
+        Args:
+            preflight: 是否先 EXPLAIN 预检成本；LLM 生成的查询需要，规则模板可以跳过
+        """
+        with self.tracer.span("qa.db", preflight=preflight, cypher=(cypher or "")[:300]) as span:
+            stats = {}
+            try:
+                rows, error = guarded_run(self.driver, cypher, params or {}, self.query_budget, preflight=preflight,
+                                          stats=stats)
+            except Exception as e:
+                rows, error = None, f"执行查询失败: {str(e)}"
+            span.set(error=error, **stats)
+            return rows, error
+
+    def _clean_results(self, query_results, max_rows=120):
+        """1) 精确去重 2) 截断超长字符串 3) 限制行数，减少LLM跑偏"""
+        if not isinstance(query_results, list):
+            return query_results
+        with self.tracer.span("qa.postprocess", rows_in=len(query_results)) as span:
+            cleaned = self._clean_rows(query_results, max_rows)
+            span.set(rows_out=len(cleaned))
+            return cleaned
+
+    def _clean_rows(self, query_results, max_rows):
+        seen = set()
+        cleaned = []
+        for r in query_results:
+            if not isinstance(r, dict):
+                continue
+            r2 = {}
+            for k, v in r.items():
+                if isinstance(v, str) and len(v) > 300:
+                    r2[k] = v[:300] + "…"
+                else:
+                    r2[k] = v
+
+            key = row_key(r2)
+            if key in seen:
+                continue
+            seen.add(key)
+            cleaned.append(r2)
+
+            if len(cleaned) >= max_rows:
+                break
+        return cleaned
+
+    def _format_facts_block(self, query_results):
+        """把查询结果格式化为【不可改写】的事实清单（逐行锁死），确保数值不会被LLM改动"""
+        if isinstance(query_results, dict):
+            rows = [query_results]
+        elif isinstance(query_results, list):
+            rows = query_results
+        else:
+            return f"- value: {query_results}"
+
+        lines = []
+        for row in rows:
+            if not isinstance(row, dict):
+                lines.append(f"- value: {row}")
+                continue
+
+            parts = []
+            for k in sorted(row.keys()):
+                v = row.get(k)
+                if isinstance(v, (dict, list)):
+                    v_str = json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+                else:
+                    v_str = "null" if v is None else str(v)
+                parts.append(f"{k}: {v_str}")
+            lines.append("- " + "；".join(parts))
+
+        return "\n".join(lines).strip()
+
+    # ---------------------------
+    # 通用结果渲染（非配队问题）：结构化结果 -> 易读自然语言
+    # ---------------------------
+    def _collect_number_atoms(self, rows):
+        nums = set()
+        if not isinstance(rows, list):
+            return nums
+        for r in rows:
+            if not isinstance(r, dict):
+                continue
+            for v in r.values():
+                if isinstance(v, (int, float)):
+                    nums.add(str(v))
+                elif isinstance(v, str):
+                    for m in re.findall(r"\d+(?:\.\d+)?", v):
+                        nums.add(m)
+        return nums
+
+    def _numbers_outside_whitelist(self, text, whitelist):
+        found = set(re.findall(r"\d+(?:\.\d+)?", text or ""))
+        return sorted(found - set(whitelist or []))
+
+    def _render_generic_answer(self, question, cleaned_rows, intent=None):
+        # 规则优先：小结果集按形状/意图直接格式化（更稳、更不幻觉，也不花 LLM 调用）
+        # 文本检索的段落需要归纳作答，有 LLM 时不直接罗列原文
+        rule_first = intent != "text_search" or not self.client
+        if rule_first and isinstance(cleaned_rows, list) and len(cleaned_rows) <= self.render_row_threshold:
+            rule = render_rows(cleaned_rows, intent=intent, max_rows=self.render_row_threshold)
+            if rule:
+                return rule
+
+        facts_block = self._format_facts_block(cleaned_rows)
+
+        # 无 LLM：直接返回事实清单（不强制逐字符锁死）
+        if not self.client:
+            return "根据查询结果：\n" + facts_block
+
+        # 相同意图 + 相同结果行已经润色过：直接复用（只限规则路由的意图，见 MEMO_INTENTS）
+        memo_key_, memoized = self._memo_get("answer", intent, cleaned_rows) if intent in MEMO_INTENTS else (None, None)
+        if memoized:
+            return memoized
+
+        # 结果编码成列式表格，并按 token 预算裁剪列/行
+        table, token_report = fit_rows(cleaned_rows, self.config.answer_token_budget, max_rows=50)
+        self._set_token_report("answer", token_report)
+
+        prompt = f"""查询结果：
+{table}
+
+用户问题：{question}"""
+
+        try:
+            resp = self._chat(
+                "answer",
+                messages=[
+                    {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.2,
+                max_tokens=800,
+            )
+            answer = (resp.choices[0].message.content or "").strip()
+
+            # 数字白名单：防止模型乱改数值/次数/稀有度等
+            illegal_nums = self._numbers_outside_whitelist(answer, self._collect_number_atoms(cleaned_rows))
+            if illegal_nums:
+                return "为保证准确性，这里先基于原始查询结果给出要点：\n" + facts_block
+
+            if answer:
+                self._memo_put(memo_key_, answer)
+            return answer or ("根据查询结果：\n" + facts_block)
+        except (LLMDeadlineExceeded, LLMOverloaded):
+            # 超出延迟预算 / LLM 排队过长：不再等 LLM，用确定性渲染器（不受小结果集阈值限制）
+            return render_rows(cleaned_rows, intent=intent, max_rows=50) or ("根据查询结果：\n" + facts_block)
+        except Exception:
+            return "根据查询结果：\n" + facts_block
+
+    def _contains_any_numbers(self, s):
+        """检测非事实区域是否出现“任何数字表达”"""
+        if re.search(r"\d", s or ""):
+            return True
+        if re.search(r"[零一二三四五六七八九十百千万两]+(?:个|条|项|种|次|位|名|级|层|段|天|年|月|日|小时|分钟|秒)", s or ""):
+            return True
+        return False
+
+
+
+    def _assemble_team_facts(self, core_name: str, templates: list, expanded_rows: list):
+        """把 TEAM_TEMPLATE_LIST + TEAM_TEMPLATE_EXPAND(_BATCH) 的结果聚合成更适合展示/二次加工的结构。"""
+        # templates: list[dict] from TEAM_TEMPLATE_LIST
+        # expanded_rows: list[dict] from TEAM_TEMPLATE_EXPAND (one row per candidate, possibly multiple templates mixed)
+        #                or TEAM_TEMPLATE_EXPAND_BATCH (one row per slot, candidates already collected server-side)
+        tmap = {t.get("team_template_id"): t for t in (templates or []) if isinstance(t, dict)}
+
+        # group expanded rows by (team_template_id, slot_group, slot)
+        groups = {}
+        for r in (expanded_rows or []):
+            if not isinstance(r, dict):
+                continue
+            tid = r.get("team_template_id")
+            if not tid:
+                continue
+            key = (tid, r.get("slot_group"), r.get("slot"))
+            groups.setdefault(key, []).append(r)
+
+        facts = []
+        for (tid, slot_group, slot), rows in groups.items():
+            # pick a representative row for metadata
+            rep = rows[0]
+            tt = tmap.get(tid, {}) or {}
+            # aggregate candidates, dedup by candidate_id/name
+            cand_seen = set()
+            candidates = []
+            for row in rows:
+                # 批量展开的行自带 candidates 列表；单模板展开则每行就是一个候选
+                cand_rows = row.get("candidates") if isinstance(row.get("candidates"), list) else [row]
+                for c in cand_rows:
+                    if not isinstance(c, dict):
+                        continue
+                    cid = c.get("candidate_id")
+                    cname = c.get("candidate_name")
+                    ckey = cid or cname
+                    if not ckey or ckey in cand_seen:
+                        continue
+                    cand_seen.add(ckey)
+                    candidates.append({
+                        "candidate_id": cid,
+                        "candidate_name": cname,
+                        "fit": c.get("fit"),
+                        "confidence": c.get("confidence"),
+                        "hint": c.get("hint"),
+                    })
+
+            # sort candidates by confidence desc (None last)
+            def _conf_key(c):
+                v = c.get("confidence")
+                return (-float(v) if isinstance(v, (int, float)) else float("-inf")) if v is not None else float("inf")
+            candidates.sort(key=_conf_key)
+
+            facts.append({
+                "team_template_id": tid,
+                "archetype": rep.get("archetype") or tt.get("archetype"),
+                "focus": bool(tt.get("focus")) if "focus" in tt else None,
+                "core_character": core_name,
+                "example_members": tt.get("example_members"),
+                "example_evidence": tt.get("example_evidence"),
+                "slot_group": slot_group,
+                "sg_min": rep.get("sg_min"),
+                "sg_max": rep.get("sg_max"),
+                "sg_mutex": rep.get("sg_mutex"),
+                "slot": slot,
+                "must": rep.get("must"),
+                "need": rep.get("need"),
+                "candidates": candidates,
+            })
+
+        # stable ordering: focus desc, archetype, must desc, slot_group, slot
+        def _bool_sort(x):
+            return 1 if x else 0
+        facts.sort(key=lambda x: (
+            -_bool_sort(x.get("focus")),
+            str(x.get("archetype") or ""),
+            -_bool_sort(x.get("must")),
+            str(x.get("slot_group") or ""),
+            str(x.get("slot") or ""),
+        ))
+        return facts
+
+    def _team_payload_for_llm(self, team_facts: list):
+        """给 LLM 的配队润色输入：只保留纯文本字段，移除所有可能导致数值被改写的字段。"""
+        payload = []
+        # group by template
+        by_tid = {}
+        for item in (team_facts or []):
+            if not isinstance(item, dict):
+                continue
+            tid = item.get("team_template_id")
+            if not tid:
+                continue
+            by_tid.setdefault(tid, {"team_template_id": tid,
+                                    "archetype": item.get("archetype"),
+                                    "example_members": item.get("example_members"),
+                                    "example_evidence": item.get("example_evidence"),
+                                    "slots": []})
+            # slot entry
+            slot_entry = {
+                "slot_group": item.get("slot_group"),
+                "slot": item.get("slot"),
+                "must": bool(item.get("must")),
+                "need": item.get("need"),
+                "candidates": []
+            }
+            for c in (item.get("candidates") or []):
+                if not isinstance(c, dict):
+                    continue
+                slot_entry["candidates"].append({
+                    "name": c.get("candidate_name"),
+                    "hint": c.get("hint"),
+                    "fit": c.get("fit"),
+                })
+            by_tid[tid]["slots"].append(slot_entry)
+
+        # ordering stable
+        for tid in sorted(by_tid.keys()):
+            payload.append(by_tid[tid])
+        return payload
+
+    def _team_rows_for_llm(self, payload: list):
+        """把按模板分组的配队摘要展开成“每个位置一行”的表格行，便于列式编码"""
+        rows = []
+        for tt in payload or []:
+            for slot in tt.get("slots") or []:
+                candidates = []
+                for c in slot.get("candidates") or []:
+                    extra = "；".join(str(x) for x in (c.get("hint"), c.get("fit")) if x)
+                    candidates.append(f"{c.get('name')}（{extra}）" if extra else str(c.get("name")))
+                rows.append({
+                    "阵容": tt.get("archetype") or tt.get("team_template_id"),
+                    "示例队伍": tt.get("example_members"),
+                    "示例说明": tt.get("example_evidence"),
+                    "槽位组": slot.get("slot_group"),
+                    "位置": slot.get("slot"),
+                    "必选": slot.get("must"),
+                    "需求": slot.get("need"),
+                    "候选": candidates,
+                })
+        return rows
+
+    def _set_token_report(self, stage, report):
+        report = dict(report, stage=stage)
+        self._local.token_report = report
+
+    def _with_token_report(self, fn, *args):
+        """在同一线程里执行 fn 并取出它产生的 token 报告（线程池任务用）"""
+        return fn(*args), self.last_token_report()
+
+    def last_token_report(self):
+        """当前线程最近一次交给 LLM 的结果表格的 token 压缩报告（没有调用 LLM 时为 None）"""
+        return getattr(self._local, "token_report", None)
+
+    def _render_team_answer_fallback(self, question: str, team_facts: list):
+        """无需LLM的兜底：纯规则生成，保证不产生任何数字表达。"""
+        payload = self._team_payload_for_llm(team_facts)
+        if not payload:
+            return "没有查到可用的配队模板或候选队友。"
+
+        lines = []
+        # 注意：这里刻意不输出任何数字
+        lines.append(f"关于「{question}」，根据知识图谱的配队模板与候选信息，我整理成更易读的版本如下：")
+        for tpl in payload:
+            archetype = tpl.get("archetype") or "推荐阵容"
+            lines.append(f"\n**{archetype}**")
+            em = tpl.get("example_members")
+            if isinstance(em, list) and em:
+                lines.append("示例队伍：" + "、".join([str(x) for x in em if x]))
+            ev = tpl.get("example_evidence")
+            if isinstance(ev, str) and ev.strip():
+                lines.append("备注：" + ev.strip())
+
+            # slots
+            for s in tpl.get("slots") or []:
+                slot = s.get("slot") or "位置"
+                must = s.get("must")
+                need = s.get("need")
+                head = f"- {slot}"
+                if must:
+                    head += "（必选）"
+                if isinstance(need, str) and need.strip():
+                    head += f"：需求为「{need.strip()}」"
+                lines.append(head)
+
+                cands = []
+                for c in s.get("candidates") or []:
+                    name = c.get("name")
+                    hint = c.get("hint")
+                    if name and hint:
+                        cands.append(f"  - {name}：{hint}")
+                    elif name:
+                        cands.append(f"  - {name}")
+                if cands:
+                    lines.extend(cands)
+        return "\n".join(lines).strip()
+    def generate_answer(self, question, query_results, *, intent=None):
+        """将查询结果转换为自然语言回答（intent 为路由得到的意图，用于选择确定性渲染器）"""
+        self._local.token_report = None
+        if not query_results:
+            return "查询结果为空，没有找到相关信息。"
+
+        # ===== 配队问题：给用户更友好的文本（同时保证不改动任何数值）=====
+        if is_team_question(question):
+            # query_results 可能已经是聚合后的 facts，也可能是 expand 的原始行
+            team_facts = None
+            if isinstance(query_results, list) and query_results and isinstance(query_results[0], dict) and "candidates" in query_results[0]:
+                team_facts = query_results
+            else:
+                # 兜底：把“原始 expand 行”聚合一下（没有 template 元数据也能输出）
+                core_name = self._link_character(question) or extract_core_name(question) or ""
+                team_facts = self._assemble_team_facts(core_name, templates=[], expanded_rows=query_results)
+
+            # 1) 无LLM：规则化生成（保证不出现数字）
+            if not self.client:
+                return self._render_team_answer_fallback(question, team_facts)
+
+            # 2) 有LLM：只给纯文本摘要（不含任何数字字段），让LLM做“润色”
+            try:
+                payload = self._team_payload_for_llm(team_facts)
+                memo_key_, memoized = self._memo_get("team", "team", payload)
+                if memoized:
+                    return memoized
+                payload_str = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+                table, token_report = fit_rows(self._team_rows_for_llm(payload), self.config.answer_token_budget,
+                                               max_rows=60, baseline_text=payload_str)
+                self._set_token_report("team", token_report)
+                prompt = f"""配队事实摘要：
+{table}
+
+用户问题：{question}"""
+
+                response = self._chat(
+                    "team",
+                    messages=[
+                        {"role": "system", "content": TEAM_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.2,
+                    max_tokens=800
+                )
+                answer = response.choices[0].message.content.strip()
+
+                # 安全校验：如果LLM仍输出了数字，直接回退到规则生成
+                if self._contains_any_numbers(answer):
+                    return self._render_team_answer_fallback(question, team_facts)
+                self._memo_put(memo_key_, answer)
+                return answer
+            except Exception:
+                return self._render_team_answer_fallback(question, team_facts)
+
+        # ===== 非配队问题：通用渲染（结构化结果 -> 易读自然语言）=====
+        cleaned = self._clean_results(query_results)
+        return self._render_generic_answer(question, cleaned, intent=intent)
+
+
+    def _split_compound(self, question):
+        """复合问题拆分（配队/替代问题有专门的多步流程，不拆）"""
+        if is_team_question(question) or is_substitute_question(question):
+            return None
+        linker = self._get_entity_linker()
+        return split_compound_question(
+            question, linker,
+            can_route=lambda q: route_by_rules(q, linker) is not None,
+        )
+
+    def _run_subquery(self, sub_question):
+        """单个子问题：规划 + 执行查询（在线程池中运行，彼此独立）"""
+        plan = self.plan_query(sub_question)
+        part = {"question": sub_question, "intent": plan["intent"], "cypher": plan["cypher"], "rows": None, "error": None}
+        if plan.get("source") == "text":
+            part["cypher"] = self._text_display(plan["params"])
+            part["rows"] = self.search_texts(**plan["params"])
+            return part
+        if plan["error"] or not plan["cypher"]:
+            part["error"] = plan["error"] or "未能生成查询语句"
+            return part
+        if plan.get("prefetched") is not None:
+            part["rows"] = plan["prefetched"]
+            return part
+        rows, error = self.execute_query(plan["cypher"], plan["params"] or {}, preflight=plan.get("source") == "llm")
+        part["rows"], part["error"] = rows, error
+        return part
+
+    def _ask_compound(self, question, sub_questions):
+        """复合问题：子查询并发执行，合并事实后统一渲染；总耗时取决于最慢的子查询"""
+        self._local.token_report = None
+        workers = max(1, min(len(sub_questions), self.max_parallel_subqueries))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(self.tracer.bind(self._run_subquery), sub_questions))
+
+        cypher_display = "\n\n".join(
+            f"// 子问题：{p['question']}\n{p['cypher'] or '// 未生成查询：' + str(p['error'])}" for p in parts
+        )
+        if not any(p["rows"] for p in parts):
+            errors = [p["error"] for p in parts if p["error"]]
+            if errors:
+                return cypher_display, "；".join(errors), None
+            return cypher_display, [], "查询结果为空，没有找到相关信息。"
+
+        merged = [{"sub_question": p["question"], **row} for p in parts for row in (p["rows"] or []) if isinstance(row, dict)]
+
+        # 每个子问题都能确定性渲染时直接拼接；否则把合并后的事实一次性交给 LLM
+        sections = []
+        for p in parts:
+            if not p["rows"]:
+                sections.append(f"**{p['question']}**\n结果中未找到相关信息。")
+                continue
+            rendered = render_rows(self._clean_results(p["rows"]), intent=p["intent"], max_rows=self.render_row_threshold)
+            if not rendered:
+                sections = None
+                break
+            sections.append(f"**{p['question']}**\n{rendered}")
+
+        try:
+            if sections:
+                answer = "\n\n".join(sections)
+            else:
+                answer = self._render_generic_answer(question, self._clean_results(merged))
+        except Exception as e:
+            answer = f"查询成功，但生成回答时出错：{str(e)}"
+        return cypher_display, merged, answer
+
+    def _fill_params(self, question, cypher, params):
+        """参数兜底：如果 Cypher 引用了参数但 params 里没有，则从 question 尝试补齐"""
+        params = dict(params or {})
+
+        # 优先用实体链接器得到规范角色名，正则抽取只做最后兜底
+        if "$core_name" in (cypher or "") and "core_name" not in params:
+            core_fallback = self._link_character(question) or extract_core_name(question)
+            if core_fallback:
+                params["core_name"] = core_fallback
+
+        # 参数兜底：替代问题优先用 extract_subject_name_for_substitute 抽主体
+        if is_substitute_question(question) and "core_name" not in params:
+            sub_core = self._link_character(question) or extract_subject_name_for_substitute(question)
+            if sub_core:
+                params["core_name"] = sub_core
+        if "$team_template_id" in (cypher or "") and "team_template_id" not in params:
+            tid_fallback = extract_team_template_id(question)
+            if tid_fallback:
+                params["team_template_id"] = tid_fallback
+        if "$k" in (cypher or "") and "k" not in params:
+            params["k"] = 3
+        if "$topn" in (cypher or "") and "topn" not in params:
+            params["topn"] = 6
+        return params
+
+    def _lookup_team_table(self, cypher, params):
+        """
+        配队推荐/替代查询先查预计算配队表
+        Returns:
+            (rows, 说明注释)；表不存在、角色未收录或参数与生成时不同返回 (None, None)
+        """
+        if self.team_table is None:
+            return None, None
+        params = params or {}
+        if cypher not in (TEAM_RECOMMEND, SUBSTITUTE_BY_SLOT, SUBSTITUTE_BY_ROLE_TAG):
+            return None, None
+        try:
+            current = self.team_table.is_current(fingerprint_of(self.current_graph_version()))
+        except Exception as e:
+            self._report("warning", f"读取预计算配队表失败，改为实时查询：{str(e)}")
+            return None, None
+        if not current:
+            # 图谱重新导入后表已过期：实时查询，直到重跑 scripts/materialize_team_table.py
+            if not self._team_table_stale_reported:
+                self._team_table_stale_reported = True
+                self._report("warning", "预计算配队表与当前图谱版本不一致，已改为实时查询；请重跑 scripts/materialize_team_table.py")
+            return None, None
+        if cypher == TEAM_RECOMMEND:
+            meta = self.team_table.meta()
+            if (params.get("k"), params.get("topn")) != (meta.get("team_recommend_k"), meta.get("team_recommend_topn")):
+                return None, None
+            kind = "team_recommend"
+        elif cypher == SUBSTITUTE_BY_SLOT:
+            kind = "substitute"
+        elif cypher == SUBSTITUTE_BY_ROLE_TAG:
+            kind = "substitute_role_tag"
+        else:
+            return None, None
+        key = params.get("core_name")
+        try:
+            rows = self.team_table.get(kind, key)
+        except Exception as e:
+            self._report("warning", f"读取预计算配队表失败，改为实时查询：{str(e)}")
+            return None, None
+        if rows is None:
+            return None, None
+        return rows, f"// 预计算配队表命中（{kind}: {key}），未访问数据库"
+
+    def _retrieve(self, question, plan):
+        """
+        检索阶段（只访问数据库）：执行主查询，并处理替代问题兜底、配队模板展开
+        Returns:
+            {"cypher": 用于展示的Cypher, "results": 结果或聚合后的配队facts, "error": 错误信息}
+        """
+        with self.tracer.span("qa.retrieve", source=plan.get("source"), intent=plan.get("intent")) as span:
+            retrieved = self._retrieve_rows(question, plan)
+            results = retrieved["results"]
+            span.set(rows=len(results) if isinstance(results, list) else None, error=retrieved["error"],
+                     note=retrieved["cypher"].split("\n", 1)[0] if (retrieved["cypher"] or "").startswith("//") else None)
+            return retrieved
+
+    def _retrieve_rows(self, question, plan):
+        # 1) 文本检索：不访问数据库
+        if plan.get("source") == "text":
+            with self.tracer.span("qa.text_search") as span:
+                hits = self.search_texts(**plan["params"])
+                span.set(hits=len(hits))
+            return {"cypher": self._text_display(plan["params"]), "results": hits, "error": None}
+
+        cypher = plan["cypher"]
+        params = self._fill_params(question, cypher, plan["params"])
+
+        # 2) 执行查询（配队推荐/替代先查预计算表；LLM 生成的查询先做 EXPLAIN 成本预检）
+        results, note = self._lookup_team_table(cypher, params)
+        if results is not None:
+            error = None
+            cypher = note + "\n" + cypher
+        elif plan.get("prefetched") is not None:
+            # 推测执行 / LLM 失败后的候选模板兜底已经取回了结果
+            results, error = plan["prefetched"], None
+            if plan.get("source") == "rule_fallback":
+                cypher = "// LLM 不可用（繁忙或超时），按关键词候选模板作答\n" + cypher
+            else:
+                cypher = "// 推测执行命中（候选模板与 LLM 并行执行，采用模板结果）\n" + cypher
+        else:
+            results, error = self.execute_query(cypher, params, preflight=plan.get("source") == "llm")
+        if error:
+            return {"cypher": cypher, "results": None, "error": error}
+
+        # 2.1) “替代/平替”问题兜底：如果 slot 候选没查到，退回 role_tag“功能相近”的候选并按角色相似度排序；
+        #      连共同定位标签的角色都没有时，直接按相似度索引给候选
+        if is_substitute_question(question):
+            if isinstance(results, list) and len(results) == 0:
+                core = (params.get("core_name") or self._link_character(question)
+                        or extract_subject_name_for_substitute(question) or extract_core_name(question) or "")
+                if core:
+                    cypher_fallback = SUBSTITUTE_BY_ROLE_TAG
+                    results2, note = self._lookup_team_table(cypher_fallback, {"core_name": core})
+                    if results2 is not None:
+                        err2 = None
+                        cypher_fallback = note + "\n" + cypher_fallback
+                    else:
+                        results2, err2 = self.execute_query(cypher_fallback, {"core_name": core})
+                    if not err2 and isinstance(results2, list) and results2:
+                        # 把 cypher 显示成“主查询 + fallback”，方便你调试
+                        cypher = (cypher + "\n\n// --- fallback by role_tag（候选按角色相似度排序）---\n"
+                                  + cypher_fallback)
+                        results = self._rank_role_tag_candidates(core, results2)
+                    else:
+                        similar = self.similar_characters(core, k=SUBSTITUTE_SIMILAR_K)
+                        if similar:
+                            cypher = cypher + "\n\n// --- fallback by similarity（角色相似度索引，未访问数据库）---"
+                            results = similar
+
+        # 2.2) 配队问题：如果只是列出模板，则继续展开 slot/candidate，再聚合成 facts
+        if is_team_question(question):
+            if isinstance(results, list) and results and isinstance(results[0], dict) and "team_template_id" in results[0] and "candidates" not in results[0]:
+                core_name = params.get("core_name") or self._link_character(question) or extract_core_name(question) or ""
+                templates = results
+
+                focus_templates = [t for t in templates if isinstance(t, dict) and t.get("focus")]
+                expand_targets = focus_templates[:3] if focus_templates else templates[:3]
+
+                # 一次 UNWIND 批量展开所有目标模板，避免逐模板往返数据库
+                tids = [t.get("team_template_id") for t in expand_targets if t.get("team_template_id")]
+                expanded_rows = []
+                if tids:
+                    rows, err2 = self.execute_query(TEAM_TEMPLATE_EXPAND_BATCH, {"team_template_ids": tids})
+                    if not err2 and rows:
+                        expanded_rows = rows
+
+                facts = self._assemble_team_facts(core_name, templates=templates, expanded_rows=expanded_rows)
+                cypher_display = TEAM_TEMPLATE_LIST + "\n\n// ---\n// expanded by:\n" + TEAM_TEMPLATE_EXPAND_BATCH
+                return {"cypher": cypher_display, "results": facts, "error": None}
+
+        return {"cypher": cypher, "results": results, "error": None}
+
+    def _respond(self, question, plan, results):
+        """回答阶段：配队问题走配队渲染，其它问题按意图渲染（可能调用 LLM）"""
+        with self.tracer.span("qa.render", intent=plan.get("intent") if plan else None) as span:
+            try:
+                # TEAM_RECOMMEND / TEAM_TEMPLATE_EXPAND / 聚合后的 facts：直接走 generate_answer 的配队分支
+                if is_team_question(question):
+                    return self.generate_answer(question, results)
+                return self.generate_answer(question, results, intent=plan["intent"])
+            except Exception as e:
+                span.set(error=str(e))
+                return f"查询成功，但生成回答时出错：{str(e)}"
+
+    def ask(self, question, conversation=None):
+        """
+        完整的问答流程
+        Args:
+            conversation: 可选的 ConversationContext；传入时先用上下文补全追问，
+                能由缓存结果回答的不再访问数据库，回答后记录本轮
+        Returns:
+            (cypher, results 或错误信息, answer)
+        """
+        with self.tracer.span("qa.ask", question=question, conversation=conversation is not None) as span:
+            cypher, results, answer = self._ask(question, conversation)
+            span.set(rows=len(results) if isinstance(results, list) else None,
+                     error=results if isinstance(results, str) else None)
+            return cypher, results, answer
+
+    def last_trace(self):
+        """当前线程最近一次 ask 的 span 列表（按开始时间排序），供界面画瀑布图"""
+        return self.tracer.last_trace()
+
+    def _ask(self, question, conversation):
+        if conversation is None:
+            return self._ask_single(question)
+
+        linker = self._get_entity_linker()
+        resolved = conversation.resolve(question, linker, can_route=lambda q: route_by_rules(q, linker) is not None)
+        spans = linker.link(resolved) if linker else []
+        entity = resolved[spans[0]["start"]:spans[0]["end"]] if spans else None
+
+        # 无 LLM 路由只做一次：结果既用来查追问缓存，也传给后面的规划（未命中才调用 LLM）
+        with self.tracer.span("qa.plan") as span:
+            routed = self._route_without_llm(resolved)
+            plan = routed if routed and routed.get("source") == "rule" else None
+            # 追问命中缓存：同一查询计划，或只是问上一轮角色信息里已有的属性
+            cached = conversation.find_rows(plan) if plan and not plan.get("error") else None
+            span.set(source=routed.get("source") if routed else None, intent=routed.get("intent") if routed else None,
+                     conversation_cache=cached is not None)
+        if cached:
+            self._local.token_report = None
+            source = cached["turn"]
+            if cached["exact"]:
+                cypher = "// 复用上一轮查询结果（未访问数据库）\n" + (source["cypher"] or "")
+            else:
+                cypher = f"// 由上一轮结果（{source['intent']}）直接回答（未访问数据库）"
+            answer = self._respond(resolved, plan, cached["rows"])
+            conversation.add_turn(question, resolved, plan, entity, cypher, cached["rows"], answer, from_cache=True)
+            return cypher, cached["rows"], answer
+
+        cypher, results, answer = self._ask_single(resolved, routed=routed)
+        conversation.add_turn(question, resolved, plan, entity, cypher, results, answer)
+        return cypher, results, answer
+
+    def start_faq_precompute(self, questions=None):
+        """
+        启动常见问题预计算（后台线程，不阻塞调用方）：按图谱版本补算缺失的答案，之后这些问题直接查表作答
+        存储路径与模型/提示词版本都相同的引擎全进程共用一个预计算实例：已有实例时直接复用，不再重复计算
+        Args:
+            questions: 问题列表；默认取 config.faq_questions，未配置时为示例问题 + 追踪日志里的高频问题
+        """
+        if self.driver is None:
+            return None
+        if questions is None:
+            questions = self.config.faq_questions
+        path = faq_path_for(self.config.faq_path, self.faq_config_tag()) if self.config.faq_path else None
+        key = os.path.abspath(path) if path else None
+        with _faq_caches_lock:
+            faq = _faq_caches.get(key) if key else None
+            if faq is None:
+                if questions is None:
+                    questions = DEFAULT_FAQ_QUESTIONS + top_logged_questions(self.config.trace_path)
+                worker = self._make_faq_worker()
+                faq = FAQCache(path, questions, version_fn=lambda: worker.current_graph_version(refresh=True))
+                faq.refresh_async(worker._precompute_answer)
+                if key:
+                    _faq_caches[key] = faq
+        self.faq = faq
+        return self.faq
+
+    def faq_config_tag(self):
+        """预计算答案依赖的模型与提示词版本（短哈希）：配置不同的引擎不共用预计算答案"""
+        parts = {"models": {stage: self._get_llm_router().model_for(stage) for stage in STAGES},
+                 "prompts": [self.system_prompt_version, ANSWER_PROMPT_VERSION, TEAM_PROMPT_VERSION]}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+
+    def _make_faq_worker(self):
+        """
+        预计算用的无界面引擎：共用 driver 与实体链接器，配置按值复制、LLM 客户端按配置重建
+        不引用发起预计算的会话引擎（会话结束后可回收），后台线程里的提示也只写日志，不调用界面层的 _report
+        """
+        return KGQAEngine(config=copy.deepcopy(self.config), driver=self.driver,
+                          entity_linker=self.entity_linker)
+
+    def current_graph_version(self, refresh=False):
+        """
+        图谱版本（各标签/关系类型计数的指纹）
+        首次同步获取；之后超过检查间隔时在后台刷新，本次先用已知版本。refresh=True 时同步重新获取
+        """
+        if self.driver is None:
+            return None
+        stale = time.monotonic() - self._graph_version_at > VERSION_CHECK_INTERVAL_S
+        if refresh or self._graph_version is None:
+            self._refresh_graph_version()
+        elif stale and not self._graph_version_refreshing:
+            self._graph_version_refreshing = True
+            threading.Thread(target=self._refresh_graph_version, name="graph-version", daemon=True).start()
+        return self._graph_version
+
+    def _refresh_graph_version(self):
+        try:
+            version = graph_version(self.driver)
+            with self._graph_version_lock:
+                self._graph_version, self._graph_version_at = version, time.monotonic()
+        except Exception as e:
+            self._report("warning", f"获取图谱版本失败：{str(e)}")
+        finally:
+            self._graph_version_refreshing = False
+
+    def _memo_get(self, stage, intent, rows):
+        """回答记忆查找；返回 (key, answer)，关闭或出错时为 (None, None)"""
+        if self.answer_memo is None:
+            return None, None
+        prompt_ver = ANSWER_PROMPT_VERSION if stage == "answer" else TEAM_PROMPT_VERSION
+        key = memo_key(stage, intent, rows, prompt_ver, self._get_llm_router().model_for(stage))
+        try:
+            answer = self.answer_memo.get(key, self.current_graph_version())
+        except Exception as e:
+            self._report("warning", f"读取回答记忆失败：{str(e)}")
+            return None, None
+        self.tracer.set(memo_hit=answer is not None)
+        return key, answer
+
+    def _memo_put(self, key, answer):
+        if key is None or self.answer_memo is None:
+            return
+        try:
+            self.answer_memo.put(key, self.current_graph_version(), answer)
+        except Exception as e:
+            self._report("warning", f"写入回答记忆失败：{str(e)}")
+
+    def answer_memo_report(self):
+        """回答记忆统计：命中/未命中/因图谱版本失效/写入/淘汰次数与条目数"""
+        return self.answer_memo.report() if self.answer_memo is not None else None
+
+    def _precompute_answer(self, question):
+        with self.tracer.span("qa.faq_precompute", question=question):
+            return self._answer_question(question)
+
+    def _ask_single(self, question, routed=_NOT_ROUTED):
+        """单轮问答流程（不使用对话上下文）；常见问题先查预计算答案。routed 见 plan_query"""
+        hit = self.faq.get(question) if self.faq is not None else None
+        if hit:
+            self._local.token_report = None
+            self.tracer.set(faq_hit=True)
+            cypher = f"// 预计算答案（图谱版本 {hit['version']}，{hit['computed_at']}），未访问数据库\n" + (hit["cypher"] or "")
+            return cypher, hit["results"], hit["answer"]
+        return self._answer_question(question, routed=routed)
+
+    def _answer_question(self, question, routed=_NOT_ROUTED):
+        # 0) 复合问题：拆成独立子问题并发检索
+        sub_questions = self._split_compound(question)
+        if sub_questions:
+            return self._ask_compound(question, sub_questions)
+
+        # 1) 生成Cypher + 参数（规则路由优先，未命中才走 LLM）
+        plan = self.plan_query(question, routed=routed)
+        if plan["error"]:
+            return None, plan["error"], None
+        if not plan["cypher"] and plan.get("source") != "text":
+            return None, "未能生成查询语句", None
+
+        # 2) 执行查询
+        retrieved = self._retrieve(question, plan)
+        if retrieved["error"]:
+            return retrieved["cypher"], retrieved["error"], None
+
+        # 3) 生成回答
+        answer = self._respond(question, plan, retrieved["results"])
+        return retrieved["cypher"], retrieved["results"], answer
+
+    def ask_many(self, questions, max_concurrency=8, rate_limit=None, llm_workers=None, db_workers=None):
+        """
+        批量问答：多个问题在“规划(LLM) -> 检索(DB) -> 回答(LLM)”三个阶段间流水线执行
+        Args:
+            questions: 问题列表
+            max_concurrency: 同时在途的问题数
+            rate_limit: LLM 调用速率上限（次/秒），None 表示不限速
+            llm_workers / db_workers: LLM 与数据库两个工作池的大小，默认等于 max_concurrency
+        Returns:
+            与输入顺序一致的列表，每项为
+            {"question", "cypher", "results", "answer", "error", "tokens", "timings": {plan_ms, retrieve_ms, answer_ms, total_ms}}
+            tokens 为交给 LLM 的结果表格的 token 压缩报告（未调用 LLM 时为 None）
+        """
+        questions = list(questions or [])
+        if not questions:
+            return []
+        max_concurrency = max(1, int(max_concurrency or 1))
+        llm_pool = ThreadPoolExecutor(max_workers=llm_workers or max_concurrency, thread_name_prefix="qa-llm")
+        db_pool = ThreadPoolExecutor(max_workers=db_workers or max_concurrency, thread_name_prefix="qa-db")
+        # 本批次专用的令牌桶：通过 contextvar 传给各阶段，不修改共享引擎的状态（并发的 ask/其它批次不受影响）
+        bucket = TokenBucket(rate_limit) if rate_limit else None
+
+        # 实体链接器只读共享，先在主线程构建好，避免各线程重复构建
+        self._get_entity_linker()
+
+        def _ms(t0):
+            return round((time.perf_counter() - t0) * 1000.0, 2)
+
+        def pipeline(question):
+            with llm_rate_limit(bucket), self.tracer.span("qa.ask", question=question, batch=True):
+                return run(question)
+
+        def run(question):
+            item = {"question": question, "cypher": None, "results": None, "answer": None, "error": None, "tokens": None,
+                    "timings": {"plan_ms": None, "retrieve_ms": None, "answer_ms": None, "total_ms": None}}
+            timings = item["timings"]
+            t_start = time.perf_counter()
+            try:
+                sub_questions = self._split_compound(question)
+                if sub_questions:
+                    # 复合问题内部已有子查询并发，整体放到 DB 池里跑
+                    t0 = time.perf_counter()
+                    (cypher, results_or_error, answer), item["tokens"] = db_pool.submit(
+                        self.tracer.bind(self._with_token_report), self._ask_compound, question, sub_questions).result()
+                    timings["retrieve_ms"] = _ms(t0)
+                    item["cypher"], item["answer"] = cypher, answer
+                    if isinstance(results_or_error, str):
+                        item["error"] = results_or_error
+                    else:
+                        item["results"] = results_or_error
+                    return item
+
+                # 1) 规划：规则路由/文本检索在本线程完成，只有需要 LLM 时才进入 LLM 池
+                t0 = time.perf_counter()
+                plan = self._route_without_llm(question) or self._plan_by_llm(question, llm_pool=llm_pool)
+                timings["plan_ms"] = _ms(t0)
+                if plan["error"] or (not plan["cypher"] and plan.get("source") != "text"):
+                    item["error"] = plan["error"] or "未能生成查询语句"
+                    return item
+
+                # 2) 检索：DB 池
+                t0 = time.perf_counter()
+                retrieved = db_pool.submit(self.tracer.bind(self._retrieve), question, plan).result()
+                timings["retrieve_ms"] = _ms(t0)
+                item["cypher"] = retrieved["cypher"]
+                if retrieved["error"]:
+                    item["error"] = retrieved["error"]
+                    return item
+                item["results"] = retrieved["results"]
+
+                # 3) 回答：LLM 池（确定性渲染时不会真正调用 LLM）
+                t0 = time.perf_counter()
+                item["answer"], item["tokens"] = llm_pool.submit(
+                    self.tracer.bind(self._with_token_report), self._respond, question, plan, retrieved["results"]).result()
+                timings["answer_ms"] = _ms(t0)
+                return item
+            except Exception as e:
+                item["error"] = f"问答流程失败: {str(e)}"
+                return item
+            finally:
+                timings["total_ms"] = _ms(t_start)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="qa-pipeline") as coordinator:
+                return list(coordinator.map(pipeline, questions))
+        finally:
+            llm_pool.shutdown(wait=True)
+            db_pool.shutdown(wait=True)
@@ -0,0 +1,183 @@
+"""
+查询成本护栏模块 - 防止一条 LLM 生成的查询拖垮共享的 Neo4j 实例
+
+- EXPLAIN 预检（不执行查询）：检查执行计划里的 CartesianProduct / AllNodesScan / 无上界 VarLengthExpand，
+  以及各算子的预估行数，超出预算直接拒绝
+- 缺少 LIMIT 的查询自动补上 LIMIT（改写而不是拒绝）
+- 执行时设置服务端事务超时；客户端按 fetch_size 分批拉取、边拉边去重，凑够行数上限就丢弃剩余结果
+"""
+import json
+import re
+from typing import List, Optional, Tuple
+
+from neo4j import Query
+
+# 默认预算
+DEFAULT_TIMEOUT_S = 10.0
+DEFAULT_ROW_CAP = 120
+DEFAULT_MAX_ESTIMATED_ROWS = 200000
+FORBIDDEN_OPERATORS = ("CartesianProduct", "AllNodesScan")
+
+_LEADING_EXPLAIN_RE = re.compile(r"^\s*(EXPLAIN|PROFILE)\b", re.I)
+_RETURN_RE = re.compile(r"\bRETURN\b", re.I)
+_LIMIT_RE = re.compile(r"\bLIMIT\s+(\d+|\$\w+)", re.I)
+# VarLengthExpand 的 Details 形如 (a)-[anon_0*]->(b) 或 (a)-[r*1..]->(b)
+_UNBOUNDED_VAR_LENGTH_RE = re.compile(r"\*\s*(?:\d*\s*\.\.\s*)?\]")
+
+
+class QueryBudget:
+    """单条查询的成本预算"""
+
+    def __init__(self, max_estimated_rows=DEFAULT_MAX_ESTIMATED_ROWS, forbidden_operators=FORBIDDEN_OPERATORS,
+                 timeout_s=DEFAULT_TIMEOUT_S, row_cap=DEFAULT_ROW_CAP, fetch_size=None):
+        self.max_estimated_rows = max_estimated_rows
+        self.forbidden_operators = tuple(forbidden_operators or ())
+        # 服务端事务超时（秒）
+        self.timeout_s = timeout_s
+        # 客户端最多保留的（去重后）行数，凑够后丢弃剩余结果并结束结果流
+        self.row_cap = row_cap
+        # 每批从服务端拉取的记录数；默认与行数上限一致，通常一批即可凑够
+        self.fetch_size = fetch_size or row_cap or 1000
+
+
+def _json_key(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+
+
+# 编码后的嵌套值前面加的标记：查询结果里不可能出现这个对象，编码结果因此不会与普通字符串/列表值相等
+_ENCODED = object()
+
+
+def row_key(row: dict):
+    """
+    结果行的去重键
+    同一查询返回的列顺序固定，标量行直接用 (列, 值) 元组；
+    列表列转成元组；更深的嵌套才退回紧凑 JSON。避免每行都递归构造排序后的嵌套 tuple。
+    JSON 编码的值带上 _ENCODED 标记，{"a": {"x": 1}} 与 {"a": '{"x":1}'} 不会得到同一个键
+    """
+    key = tuple(row.items())
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        pass
+    key = tuple((c, tuple(v) if type(v) is list else ((_ENCODED, _json_key(v)) if type(v) is dict else v))
+                for c, v in row.items())
+    try:
+        hash(key)
+        return key
+    except TypeError:
+        return _ENCODED, _json_key(row)
+
+
+def _operator_name(plan: dict) -> str:
+    # Neo4j 5 的算子名带运行时后缀，如 "AllNodesScan@neo4j"
+    return str(plan.get("operatorType") or plan.get("operator_type") or "").split("@")[0]
+
+
+def iter_plan_operators(plan) -> List[dict]:
+    """把 EXPLAIN 返回的计划树展开成 [{operator, estimated_rows, details}]"""
+    if not plan:
+        return []
+    ops = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        args = node.get("args") or node.get("arguments") or {}
+        ops.append({
+            "operator": _operator_name(node),
+            "estimated_rows": float(args.get("EstimatedRows") or 0.0),
+            "details": str(args.get("Details") or ""),
+        })
+        stack.extend(node.get("children") or [])
+    return ops
+
+
+def check_plan(plan, budget: QueryBudget) -> List[str]:
+    """按预算检查执行计划，返回拒绝原因列表（空表示通过）"""
+    reasons = []
+    for op in iter_plan_operators(plan):
+        name = op["operator"]
+        if any(name.startswith(f) for f in budget.forbidden_operators):
+            reasons.append(f"执行计划包含 {name}（笛卡尔积/全图扫描），请给每个节点加上标签并用关系把它们连起来")
+        if name.startswith("VarLengthExpand") and _UNBOUNDED_VAR_LENGTH_RE.search(op["details"]):
+            reasons.append(f"执行计划包含无上界的变长扩展：{op['details']}")
+        if budget.max_estimated_rows and op["estimated_rows"] > budget.max_estimated_rows:
+            reasons.append(f"{name} 预估行数 {int(op['estimated_rows'])} 超出预算 {budget.max_estimated_rows}")
+    deduped = []
+    for r in reasons:
+        if r not in deduped:
+            deduped.append(r)
+    return deduped
+
+
+def ensure_limit(cypher: str, row_cap: int) -> str:
+    """返回行的查询如果没有 LIMIT，在末尾补上 LIMIT row_cap"""
+    returns = list(_RETURN_RE.finditer(cypher or ""))
+    if not returns or _LIMIT_RE.search(cypher[returns[-1].end():]):
+        return cypher
+    return cypher.rstrip().rstrip(";") + f"\nLIMIT {int(row_cap)}"
+
+
+def explain(session, cypher: str, params: Optional[dict] = None):
+    """只编译不执行，返回计划树（dict）；驱动没有返回计划时为 None"""
+    summary = session.run("EXPLAIN " + cypher, params or {}).consume()
+    return getattr(summary, "plan", None) if summary is not None else None
+
+
+def run_capped(session, cypher: str, params: Optional[dict], budget: QueryBudget, distinct: bool = True,
+               stats: Optional[dict] = None) -> Tuple[list, bool]:
+    """
+    带服务端超时执行，逐条消费结果：distinct=True 时边拉边去重，凑够 row_cap 行即停止
+    Args:
+        stats: 可选，填入服务端耗时（server_ready_ms / server_consumed_ms）
+    Returns:
+        (rows, truncated)；truncated 表示服务端还有未读取的结果被丢弃
+    """
+    result = session.run(Query(cypher, timeout=budget.timeout_s), params or {})
+    rows = []
+    seen = set()
+    truncated = False
+    for record in result:
+        if budget.row_cap and len(rows) >= budget.row_cap:
+            truncated = True
+            break
+        row = dict(record)
+        if distinct:
+            key = row_key(row)
+            if key in seen:
+                continue
+            seen.add(key)
+        rows.append(row)
+    # 截断时丢弃剩余结果（DISCARD），让服务端尽早结束这条查询；未截断时结果已读完，consume 只取回摘要
+    summary = result.consume() if (truncated or stats is not None) else None
+    if stats is not None and summary is not None:
+        stats["server_ready_ms"] = getattr(summary, "result_available_after", None)
+        stats["server_consumed_ms"] = getattr(summary, "result_consumed_after", None)
+    return rows, truncated
+
+
+def guarded_run(driver, cypher: str, params: Optional[dict] = None, budget: Optional[QueryBudget] = None,
+                preflight: bool = True, stats: Optional[dict] = None):
+    """
+    带成本护栏执行查询
+    Args:
+        preflight: 是否先做 EXPLAIN 预检（规则模板等可信查询可以跳过）
+        stats: 可选，填入 rows / truncated 与服务端耗时，供链路追踪使用
+    Returns:
+        (rows, error)；rows 超过上限时被截断
+    """
+    budget = budget or QueryBudget()
+    cypher = _LEADING_EXPLAIN_RE.sub("", cypher or "", count=1).strip()
+    with driver.session(fetch_size=budget.fetch_size) as session:
+        if preflight:
+            cypher = ensure_limit(cypher, budget.row_cap)
+            reasons = check_plan(explain(session, cypher, params), budget)
+            if reasons:
+                return None, "查询成本超出预算，已拒绝执行：" + "；".join(reasons)
+        rows, truncated = run_capped(session, cypher, params, budget, stats=stats)
+        if stats is not None:
+            stats.update(rows=len(rows), truncated=truncated)
+        return rows, None
@@ -1,12 +1,18 @@
 # modules/relationship_visualizer.py
 import streamlit as st
 from pyvis.network import Network
+from jinja2 import DictLoader, Environment
 import tempfile
 import os
+import glob
 import logging
+import threading
 import traceback
 import json
-from typing import List, Dict, Any, Tuple
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+from modules.graph_layout import compute_layout
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -19,6 +25,18 @@ country_colors = {
     None: "#9E9E9E"
 }
 
+# 渲染好的 HTML 按 (视图, 节点数) 缓存在进程内存里，所有会话共享；超出容量淘汰最久未用的
+HTML_CACHE_MAX_ENTRIES = int(os.environ.get("GRAPH_HTML_CACHE_SIZE", "32"))
+# 旧版每次渲染都用 mkstemp 在临时目录留下一个 tmp*.html；含这段注入脚本标记的才是本模块写的
+LEGACY_TEMP_MARKER = "initInteraction"
+LEGACY_TEMP_MAX_BYTES = 5 << 20
+
+_html_cache = OrderedDict()
+_html_cache_lock = threading.Lock()
+_template_env = None
+_template_lock = threading.Lock()
+_legacy_cleanup_started = False
+
 
 # --- 辅助函数 ---
 
@@ -99,34 +117,82 @@ def inject_custom_js(html_content: str) -> str:
     return html_content + custom_js
 
 
-def save_network_to_html(net: Network) -> str:
-    """保存并注入JS"""
-    try:
-        fd, temp_path = tempfile.mkstemp(suffix='.html')
-        os.close(fd)
-        net.save_graph(temp_path)
-        content = safe_read_file(temp_path)
-
-        # 清理内容
-        lines = [l for l in content.split('\n') if 'Genshin Impact' not in l and '原神' not in l]
-        content = '\n'.join(lines)
-        if '<head>' in content and '<meta charset=' not in content:
-            content = content.replace('<head>', '<head>\n    <meta charset="UTF-8">')
-
-        content = inject_custom_js(content)
-
-        with open(temp_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        return temp_path
-    except Exception as e:
-        logger.error(f"保存失败: {e}")
-        return ""
+def _get_template_env(net: Network) -> Environment:
+    """pyvis 模板只改一次：补 charset、注入交互脚本，编译后的模板在进程内复用"""
+    global _template_env
+    if _template_env is None:
+        with _template_lock:
+            if _template_env is None:
+                source, _, _ = net.templateEnv.loader.get_source(net.templateEnv, net.path)
+                if '<head>' in source and '<meta charset=' not in source:
+                    source = source.replace('<head>', '<head>\n    <meta charset="UTF-8">')
+                source = inject_custom_js(source)
+                _template_env = Environment(loader=DictLoader({net.path: source}))
+    return _template_env
+
+
+def render_network_html(net: Network) -> str:
+    """在内存里生成 HTML（不落盘）"""
+    net.templateEnv = _get_template_env(net)
+    content = net.generate_html()
+    # 清理内容
+    lines = [l for l in content.split('\n') if 'Genshin Impact' not in l and '原神' not in l]
+    return '\n'.join(lines)
+
+
+def get_cached_html(key) -> Optional[str]:
+    with _html_cache_lock:
+        html = _html_cache.get(key)
+        if html is not None:
+            _html_cache.move_to_end(key)
+        return html
+
+
+def put_cached_html(key, html: str):
+    with _html_cache_lock:
+        _html_cache[key] = html
+        _html_cache.move_to_end(key)
+        while len(_html_cache) > HTML_CACHE_MAX_ENTRIES:
+            _html_cache.popitem(last=False)
+
+
+def cleanup_legacy_temp_files() -> int:
+    """删除旧版渲染留在临时目录里的 HTML 文件，返回删除的个数"""
+    removed = 0
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), "tmp*.html")):
+        try:
+            if os.path.getsize(path) > LEGACY_TEMP_MAX_BYTES:
+                continue
+            content = safe_read_file(path)
+            if LEGACY_TEMP_MARKER in content and 'vis.Network' in content:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"已清理旧版关系图临时文件 {removed} 个")
+    return removed
+
+
+def _start_legacy_cleanup():
+    """每个进程在后台清理一次旧临时文件；当前会话记录的旧文件路径顺带删掉"""
+    global _legacy_cleanup_started
+    old_path = st.session_state.pop("graph_html_path", None)
+    st.session_state.pop("last_graph_config", None)
+    if old_path and os.path.exists(old_path):
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass
+    if _legacy_cleanup_started:
+        return
+    _legacy_cleanup_started = True
+    threading.Thread(target=cleanup_legacy_temp_files, name="graph-tmp-cleanup", daemon=True).start()
 
 
-def display_html_file(file_path: str, height: int = 800):
-    if file_path and os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            st.components.v1.html(f.read(), height=height, scrolling=False)
+def display_html(html: str, height: int = 800):
+    if html:
+        st.components.v1.html(html, height=height, scrolling=False)
 
 
 def display_color_legend():
@@ -226,14 +292,26 @@ def get_graph_data(_kg, limit: int = 40, focus_character: str = None) -> Tuple[L
         return [], []
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_graph_layout(view: str, limit: int, node_names: Tuple[str, ...],
+                     edge_pairs: Tuple[Tuple[str, str], ...]) -> Dict[str, Tuple[float, float]]:
+    """
+    服务端布局，按 (视图, 节点数) 缓存；节点/边也参与缓存键，图谱数据变了自动重算。
+    布局是确定的，同一张图刷新页面或重启服务后坐标不变。
+    """
+    center = view if view and view != "全局概览" else None
+    return compute_layout(node_names, edge_pairs, center=center)
+
+
 def create_network_graph(characters, relationships, config):
-    """创建 PyVis 对象"""
+    """创建 PyVis 对象；config 带 positions 时按固定坐标绘制，关闭物理引擎"""
     net = Network(height="700px", width="100%", notebook=False, directed=True, bgcolor="#ffffff", font_color="black")
+    positions = config.get('positions') or {}
 
     # 物理引擎配置
     options = {
         "physics": {
-            "enabled": config.get('physics', True),
+            "enabled": config.get('physics', True) and not positions,
             "solver": "barnesHut",
             "barnesHut": {
                 "gravitationalConstant": -3000, "centralGravity": 0.3, "springLength": 120, "avoidOverlap": 0.2
@@ -279,6 +357,9 @@ def create_network_graph(characters, relationships, config):
             "font": {"size": 14}
         }
     }
+    if positions:
+        # 固定坐标时 dynamic 依赖物理引擎，改用顺时针弯曲：A->B 与 B->A 自然弯向两侧，同样不重合
+        options["edges"]["smooth"] = {"enabled": True, "type": "curvedCW", "roundness": 0.2}
     net.set_options(json.dumps(options))
 
     # 添加节点
@@ -290,11 +371,16 @@ def create_network_graph(characters, relationships, config):
         size = 35 if is_focus else (25 if str(c.get('rarity')).startswith('5') else 18)
         border = 3 if is_focus else (2 if str(c.get('rarity')).startswith('5') else 1)
 
+        extra = {}
+        if name in positions:
+            extra["x"], extra["y"] = positions[name]
+
         net.add_node(
             n_id=name, label=name,
             color=country_colors.get(c.get('country'), "#9E9E9E"),
             size=size, borderWidth=border,
-            title=f"{name}\n{c.get('country')}"
+            title=f"{name}\n{c.get('country')}",
+            **extra
         )
 
     # 添加边
@@ -338,20 +424,16 @@ def display_character_relationship_visualization(kg):
             force_refresh = st.button("🔄 刷新视图")
 
     # --- 缓存与状态管理 ---
-    # 定义配置指纹
-    current_config = {
-        "view": selected_view,
-        "limit": limit_num,
-        "ts": 0  # 简单的版本控制
-    }
+    _start_legacy_cleanup()
+    # 配置指纹：HTML 缓存键
+    cache_key = (selected_view, int(limit_num))
 
     # 检查是否可以直接使用缓存HTML
-    if (not force_refresh and
-            st.session_state.get("last_graph_config") == current_config and
-            os.path.exists(st.session_state.get("graph_html_path", ""))):
+    cached_html = None if force_refresh else get_cached_html(cache_key)
+    if cached_html is not None:
 
         # 显示缓存
-        display_html_file(st.session_state.graph_html_path, height=700)
+        display_html(cached_html, height=700)
 
         # 显示当前模式的状态提示
         if selected_view == "全局概览":
@@ -383,26 +465,29 @@ def display_character_relationship_visualization(kg):
         status.text(f"正在渲染 {len(chars)} 个节点, {len(rels)} 条关系...")
         progress.progress(60)
 
+        # 布局在服务端算好（按视图与节点数缓存），浏览器直接按坐标绘制，不再跑 barnesHut 稳定化
+        positions = get_graph_layout(selected_view, limit_num,
+                                     tuple(c['name'] for c in chars),
+                                     tuple((r['source'], r['target']) for r in rels))
+
         graph_config = {
-            "physics": True,
+            "physics": False,
             "high_perf": True,
+            "positions": positions,
             "focus_char": selected_view  # 传入选中的角色名，用于高亮
         }
         net = create_network_graph(chars, rels, graph_config)
 
-        # 3. 保存 HTML
-        html_path = save_network_to_html(net)
-
-        # 更新 Session
-        st.session_state.graph_html_path = html_path
-        st.session_state.last_graph_config = current_config
+        # 3. 生成 HTML（内存中）并缓存
+        html = render_network_html(net)
+        put_cached_html(cache_key, html)
 
         progress.progress(100)
         status.empty()
         progress.empty()
 
         # 4. 显示
-        display_html_file(html_path, height=700)
+        display_html(html, height=700)
 
         # 底部信息
         if selected_view == "全局概览":
@@ -0,0 +1,298 @@
+"""
+角色相似度模块 - 基于稀疏特征矩阵的向量化相似角色检索（替代角色的排序兜底）
+
+每个特征面（facet）一张 角色 × 特征 的稀疏矩阵，值为置信度/权重：
+- role_tag    : 定位标签（belongs_role_tag 的 evidence_confidence）
+- element     : 元素
+- weapon_type : 武器类型
+- slot        : 配队槽位共现（同一 SlotTemplate 的 CANDIDATE，值为候选置信度）
+- weapon      : 适配武器（suits_weapon）
+- artifact    : 适配圣遗物（suits）
+相似度按特征面加权平均（cosine 或 jaccard），整张 角色 × 角色 相似度矩阵一次矩阵乘法算出，
+并按 (特征面, 权重, 度量) 缓存每个角色的 top-k 排序；之后每次查询只是一次下标查找。
+rank() 用同一张矩阵给外部给出的候选（如按定位标签查到的角色）排序。
+"""
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# 各特征面的默认权重：定位标签与槽位共现最能说明“能不能顶替”，其余为辅助
+DEFAULT_FACET_WEIGHTS = {
+    "role_tag": 3.0,
+    "slot": 2.0,
+    "element": 1.0,
+    "weapon_type": 1.0,
+    "weapon": 1.0,
+    "artifact": 1.0,
+}
+FACETS = tuple(DEFAULT_FACET_WEIGHTS.keys())
+METRICS = ("cosine", "jaccard")
+
+# 每个角色缓存的候选数；超过时按需从相似度矩阵现排
+CACHED_TOP_K = 30
+# 解释“为什么相似”时每个特征面最多列出的共同特征数 / 总数
+MAX_SHARED_PER_FACET = 3
+MAX_SHARED_FEATURES = 8
+
+ALL_CHARACTERS = """
+MATCH (c:character)
+WHERE c.name IS NOT NULL
+RETURN c.name AS name
+""".strip()
+
+# 每个特征面一条查询，统一返回 (name, feature, weight)
+FACET_QUERIES = {
+    "role_tag": """
+MATCH (c:character)-[r:belongs_role_tag]->(t:role_tag)
+RETURN c.name AS name, t.name AS feature, coalesce(r.evidence_confidence, 1.0) AS weight
+""".strip(),
+    "element": """
+MATCH (c:character)
+WHERE c.element IS NOT NULL AND c.element <> ''
+RETURN c.name AS name, c.element AS feature, 1.0 AS weight
+""".strip(),
+    "weapon_type": """
+MATCH (c:character)
+WHERE c.weapon_type IS NOT NULL AND c.weapon_type <> ''
+RETURN c.name AS name, c.weapon_type AS feature, 1.0 AS weight
+""".strip(),
+    "slot": """
+MATCH (st:SlotTemplate)-[cand:CANDIDATE]->(c:character)
+RETURN c.name AS name, coalesce(st.id, st.team_template_id + ':' + st.slot) AS feature,
+       coalesce(cand.evidence_confidence, 1.0) AS weight
+""".strip(),
+    "weapon": """
+MATCH (c:character)-[r:suits_weapon]->(w:weapon)
+RETURN c.name AS name, w.name AS feature, coalesce(r.evidence_confidence, 1.0) AS weight
+""".strip(),
+    "artifact": """
+MATCH (c:character)-[r:suits]->(a:artifact)
+RETURN c.name AS name, a.name AS feature, coalesce(r.evidence_confidence, 1.0) AS weight
+""".strip(),
+}
+
+
+def _normalize_facets(facets) -> Tuple[Tuple[str, float], ...]:
+    """facets: None（全部，默认权重）/ 特征面名列表（默认权重）/ {特征面: 权重}"""
+    if facets is None:
+        weights = dict(DEFAULT_FACET_WEIGHTS)
+    elif isinstance(facets, dict):
+        weights = {f: float(w) for f, w in facets.items()}
+    elif isinstance(facets, str):
+        weights = {facets: DEFAULT_FACET_WEIGHTS.get(facets, 1.0)}
+    else:
+        weights = {f: DEFAULT_FACET_WEIGHTS.get(f, 1.0) for f in facets}
+    unknown = [f for f in weights if f not in DEFAULT_FACET_WEIGHTS]
+    if unknown:
+        raise ValueError(f"不支持的特征面: {', '.join(unknown)}（可选: {', '.join(FACETS)}）")
+    weights = {f: w for f, w in weights.items() if w > 0}
+    if not weights:
+        raise ValueError("至少需要一个权重大于 0 的特征面")
+    return tuple(sorted(weights.items()))
+
+
+def _feature_label(facet: str, feature: str) -> str:
+    # 槽位 id 形如 ST:TT:胡桃:双水蒸发:水位，展示成“胡桃·双水蒸发·水位”
+    if facet == "slot":
+        parts = [p for p in str(feature).split(":") if p not in ("ST", "TT")]
+        return "·".join(parts) or str(feature)
+    return str(feature)
+
+
+def _row_normalize(m: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ m
+
+
+class SimilarityIndex:
+    """
+    角色相似度索引（构建后只读，可多线程共享）
+
+    用法：
+        index = SimilarityIndex.from_graph(driver)
+        index.similar("行秋", k=5)                                  # 全部特征面，默认权重
+        index.similar("行秋", k=5, facets=["role_tag", "slot"])     # 只看定位与槽位
+        index.similar("行秋", k=5, facets={"element": 1, "weapon": 2}, metric="jaccard")
+    """
+
+    def __init__(self, names: Iterable[str], triples: Optional[Dict[str, Iterable[Tuple[str, str, float]]]] = None):
+        self.names = []
+        self.index = {}
+        for n in names or []:
+            if n and n not in self.index:
+                self.index[n] = len(self.names)
+                self.names.append(n)
+        self.matrices: Dict[str, sparse.csr_matrix] = {}
+        self.features: Dict[str, List[str]] = {}
+        for facet, items in (triples or {}).items():
+            self._add_facet(facet, items)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _add_facet(self, facet: str, items: Iterable[Tuple[str, str, float]]):
+        # 同一 (角色, 特征) 多条记录取最大权重
+        cells = {}
+        feature_index = {}
+        for name, feature, weight in items or []:
+            i = self.index.get(name)
+            if i is None or feature is None or feature == "":
+                continue
+            j = feature_index.setdefault(str(feature), len(feature_index))
+            w = float(weight if weight is not None else 1.0)
+            cells[(i, j)] = max(cells.get((i, j), 0.0), w)
+        rows = np.fromiter((k[0] for k in cells), dtype=np.int32, count=len(cells))
+        cols = np.fromiter((k[1] for k in cells), dtype=np.int32, count=len(cells))
+        vals = np.fromiter(cells.values(), dtype=np.float32, count=len(cells))
+        self.matrices[facet] = sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.names), len(feature_index)))
+        self.features[facet] = list(feature_index)
+
+    @classmethod
+    def from_graph(cls, driver):
+        """从 Neo4j 一次性读取各特征面（每个特征面一条查询）"""
+        with driver.session() as session:
+            names = [r["name"] for r in session.run(ALL_CHARACTERS)]
+            triples = {facet: [(r["name"], r["feature"], r["weight"]) for r in session.run(q)]
+                       for facet, q in FACET_QUERIES.items()}
+        return cls(names, triples)
+
+    @classmethod
+    def from_json_dir(cls, data_dir: str):
+        """从 data_preprocess/dataKG（entities/ + relations/）构建（离线脚本/无数据库时使用）"""
+        def load(*parts):
+            path = os.path.join(data_dir, *parts)
+            if not os.path.exists(path):
+                return []
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        characters = [c for c in load("entities", "character.json") if isinstance(c, dict) and c.get("name")]
+        by_id = {c["id"]: c["name"] for c in characters}
+        role_tags = {t["id"]: t["name"] for t in load("entities", "role_tag.json") if isinstance(t, dict)}
+        weapons = {w["id"]: w["name"] for w in load("entities", "weapon.json") if isinstance(w, dict)}
+        artifacts = {a["id"]: a["name"] for a in load("entities", "artifact.json") if isinstance(a, dict)}
+
+        def edges(filename, targets):
+            return [(by_id.get(e.get("subject_id")), targets.get(e.get("object_id")), e.get("evidence_confidence"))
+                    for e in load("relations", filename) if isinstance(e, dict)]
+
+        team_edges = load("relations", "team_strategy_edges_rich.json")
+        team_edges = team_edges.get("edges", []) if isinstance(team_edges, dict) else team_edges
+        triples = {
+            "role_tag": edges("character_belongs_role_tag_relation.json", role_tags),
+            "element": [(c["name"], c.get("element"), 1.0) for c in characters],
+            "weapon_type": [(c["name"], c.get("weapon_type"), 1.0) for c in characters],
+            "slot": [(by_id.get(e.get("object_id")), e.get("subject_id"), e.get("evidence_confidence"))
+                     for e in team_edges if isinstance(e, dict) and e.get("predicate") == "CANDIDATE"],
+            "weapon": edges("suits_weapon_relation.json", weapons),
+            "artifact": edges("suits_artifact_relation.json", artifacts),
+        }
+        return cls([c["name"] for c in characters], triples)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _similarity_matrix(self, facet_weights: Tuple[Tuple[str, float], ...], metric: str) -> np.ndarray:
+        """按特征面加权平均的 角色 × 角色 相似度矩阵（对角线置为 -inf）"""
+        n = len(self.names)
+        total = np.zeros((n, n), dtype=np.float32)
+        weight_sum = sum(w for _, w in facet_weights) or 1.0
+        for facet, w in facet_weights:
+            m = self.matrices.get(facet)
+            if m is None or m.shape[1] == 0:
+                continue
+            if metric == "cosine":
+                x = _row_normalize(m)
+                s = (x @ x.T).toarray()
+            else:
+                b = (m > 0).astype(np.float32)
+                inter = (b @ b.T).toarray()
+                size = np.asarray(b.sum(axis=1)).ravel()
+                union = size[:, None] + size[None, :] - inter
+                s = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+            total += (w / weight_sum) * s.astype(np.float32)
+        np.fill_diagonal(total, -np.inf)
+        return total
+
+    def _ranking(self, facet_weights, metric):
+        """(相似度矩阵, 每行前 CACHED_TOP_K 个下标)；按参数缓存"""
+        key = (facet_weights, metric)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                sim = self._similarity_matrix(facet_weights, metric)
+                top = min(CACHED_TOP_K, max(len(self.names) - 1, 0))
+                if top:
+                    part = np.argpartition(-sim, top - 1, axis=1)[:, :top]
+                    order = np.take_along_axis(sim, part, axis=1).argsort(axis=1)[:, ::-1]
+                    top_idx = np.take_along_axis(part, order, axis=1)
+                else:
+                    top_idx = np.zeros((len(self.names), 0), dtype=np.int64)
+                cached = (sim, top_idx)
+                self._cache[key] = cached
+        return cached
+
+    def _shared(self, i: int, j: int, facet_weights) -> str:
+        """两个角色在各特征面上的共同特征（权重高的特征面在前，用于解释排序）"""
+        parts = []
+        for facet, _ in sorted(facet_weights, key=lambda fw: -fw[1]):
+            m = self.matrices.get(facet)
+            if m is None:
+                continue
+            a = set(m.indices[m.indptr[i]:m.indptr[i + 1]])
+            common = [self.features[facet][c] for c in m.indices[m.indptr[j]:m.indptr[j + 1]] if c in a]
+            parts.extend(_feature_label(facet, f) for f in common[:MAX_SHARED_PER_FACET])
+        return "、".join(parts[:MAX_SHARED_FEATURES])
+
+    def similar(self, name: str, k: int = 5, facets=None, metric: str = "cosine", explain: bool = True) -> List[dict]:
+        """
+        与 name 最相似的 k 个角色
+        Args:
+            facets: None（全部特征面）/ 特征面名列表 / {特征面: 权重}
+            metric: cosine（带权重）或 jaccard（只看有无）
+            explain: 是否附带共同特征说明（shared）
+        Returns:
+            [{"name", "score", "shared"}]，score 为 0~1 的加权相似度；角色不在索引中返回 []
+        """
+        if metric not in METRICS:
+            raise ValueError(f"不支持的相似度度量: {metric}（可选: {', '.join(METRICS)}）")
+        i = self.index.get(name)
+        if i is None or k <= 0:
+            return []
+        facet_weights = _normalize_facets(facets)
+        sim, top_idx = self._ranking(facet_weights, metric)
+        if k <= top_idx.shape[1]:
+            candidates = top_idx[i, :k]
+        else:
+            candidates = np.argsort(-sim[i])[:k]
+        out = []
+        for j in candidates:
+            score = float(sim[i, j])
+            if not np.isfinite(score) or score <= 0:
+                break
+            item = {"name": self.names[j], "score": round(score, 3)}
+            if explain:
+                item["shared"] = self._shared(i, int(j), facet_weights)
+            out.append(item)
+        return out
+
+    def rank(self, name: str, candidates: Iterable[str], facets=None, metric: str = "cosine") -> List[str]:
+        """
+        按与 name 的相似度给一组候选排序（高在前）；不在索引里的候选保持原顺序排在最后
+        name 不在索引中时原样返回候选
+        """
+        candidates = list(candidates or [])
+        i = self.index.get(name)
+        if i is None or not candidates:
+            return candidates
+        sim, _ = self._ranking(_normalize_facets(facets), metric)
+        known = [c for c in candidates if c in self.index and c != name]
+        known.sort(key=lambda c: -float(sim[i, self.index[c]]))
+        return known + [c for c in candidates if c not in self.index]
@@ -0,0 +1,127 @@
+"""
+预计算配队表模块 - 配队推荐/替代问题用一次键查找代替多跳遍历
+
+配队模板数据只在导入时变化，由 scripts/materialize_team_table.py 离线生成本地 SQLite 键值表：
+- team_recommend      : 核心角色 -> TEAM_RECOMMEND 的结果行（排好序的模板、槽位、前几名候选）
+- substitute          : 角色 -> SUBSTITUTE_BY_SLOT 的结果行（同槽位的其它候选，按置信度排序）
+- substitute_role_tag : 角色 -> SUBSTITUTE_BY_ROLE_TAG 的结果行（槽位候选为空时的兜底）
+值为紧凑 JSON，行结构与实时查询完全一致，下游渲染逻辑无需区分来源。
+查不到（表不存在、角色未收录、参数与生成时不同）时返回 None，由调用方回退到实时查询。
+生成时在 meta 里记下图谱数据指纹（graph_fingerprint）；重新导入图谱后指纹不一致，整表跳过直到重跑脚本。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+DEFAULT_TEAM_TABLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       "data", "team_table.sqlite")
+
+KINDS = ("team_recommend", "substitute", "substitute_role_tag")
+
+LABELS_QUERY = "CALL db.labels() YIELD label RETURN label ORDER BY label"
+REL_TYPES_QUERY = "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType AS type ORDER BY type"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    kind  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _quote(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def graph_fingerprint(driver) -> str:
+    """图谱数据指纹：各标签节点数、各关系类型数量的哈希（单标签/单类型计数由计数存储直接给出）"""
+    counts = {}
+    with driver.session() as session:
+        labels = [r["label"] for r in session.run(LABELS_QUERY)]
+        rel_types = [r["type"] for r in session.run(REL_TYPES_QUERY)]
+        for label in labels:
+            counts["n:" + label] = session.run(f"MATCH (n:{_quote(label)}) RETURN count(n) AS c").single()["c"]
+        for rel_type in rel_types:
+            counts["r:" + rel_type] = session.run(f"MATCH ()-[r:{_quote(rel_type)}]->() RETURN count(r) AS c").single()["c"]
+    return hashlib.sha256(json.dumps(counts, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class TeamTable:
+    """
+    本地 SQLite 键值表（只读查询可多线程共享：每个线程一个连接）
+
+    用法：
+        table = TeamTable.open("data/team_table.sqlite")   # 文件不存在返回 None
+        rows = table.get("team_recommend", "胡桃")
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._meta = None
+
+    @classmethod
+    def open(cls, path: Optional[str]) -> Optional["TeamTable"]:
+        """打开已生成的表；路径为空或文件不存在返回 None"""
+        if not path or not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind: str, key: str):
+        """按 (kind, key) 取解码后的值；未收录返回 None"""
+        if not key:
+            return None
+        row = self._conn().execute("SELECT value FROM kv WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def meta(self) -> Dict[str, object]:
+        """生成信息：built_at、各类条目数、生成时使用的参数等"""
+        if self._meta is None:
+            rows = self._conn().execute("SELECT key, value FROM meta").fetchall()
+            self._meta = {k: json.loads(v) for k, v in rows}
+        return self._meta
+
+    def is_current(self, fingerprint: Optional[str]) -> bool:
+        """表是否对应当前图谱：当前指纹未知时（连不上数据库）照常使用；表里没有指纹（旧版生成）视为过期"""
+        if not fingerprint:
+            return True
+        return self.meta().get("graph_fingerprint") == fingerprint
+
+    def write(self, entries: Iterable[Tuple[str, str, object]], meta: Optional[dict] = None):
+        """整表重写：entries 为 (kind, key, value)；在一个事务里替换，读者看不到半成品"""
+        conn = self._conn()
+        counts = {k: 0 for k in KINDS}
+        with conn:
+            conn.execute("DELETE FROM kv")
+            conn.execute("DELETE FROM meta")
+            for kind, key, value in entries:
+                conn.execute("INSERT OR REPLACE INTO kv (kind, key, value) VALUES (?, ?, ?)", (kind, key, _dumps(value)))
+                counts[kind] = counts.get(kind, 0) + 1
+            info = dict(meta or {})
+            info.setdefault("built_at", time.strftime("%Y-%m-%d %H:%M:%S"))
+            info["counts"] = counts
+            conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [(k, _dumps(v)) for k, v in info.items()])
+        self._meta = None
+        return counts
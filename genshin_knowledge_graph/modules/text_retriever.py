@@ -0,0 +1,322 @@
+"""
+文本检索模块 - 角色故事/语音/攻略文本的进程内 BM25 检索
+
+这些文本（data_preprocess/dataExternal 下的 character_story.json / character_voice.json /
+character_strategy.json）不在图谱里，Cypher 查不到；这里建一份倒排索引直接检索原文段落。
+- 分词：中文按字二元组（bigram），英文/数字按词，不依赖分词库
+- 段落：故事/攻略按句切成不超过 MAX_PASSAGE_CHARS 字的段落，语音每条一段
+- 持久化：scripts/build_text_index.py 离线构建，写成一组 .npy + 二进制文本块；
+  启动时用 np.load(mmap_mode="r") 映射，不把全部倒排表读进内存
+- 检索：查询词的倒排表用 NumPy 一次性累加 BM25 分数，可按角色/文本来源过滤
+"""
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+DEFAULT_TEXT_INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                       "data", "text_index")
+
+# 索引格式变更时递增；版本不一致的索引拒绝加载
+INDEX_VERSION = 1
+SOURCES = ("story", "voice", "strategy")
+SOURCE_LABELS = {"story": "角色故事", "voice": "角色语音", "strategy": "角色攻略"}
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 故事/攻略文本切段的最大字数（交给 LLM 时每段都要放进 token 预算）
+MAX_PASSAGE_CHARS = 180
+
+# 问题里出现这些词时走文本检索，并只检索对应来源
+TEXT_SOURCE_KEYWORDS = {
+    "voice": ["语音", "台词", "说过", "说了什么", "怎么说", "口头禅"],
+    "story": ["故事", "背景", "身世", "经历", "过去", "往事", "剧情", "神之眼", "好感"],
+    "strategy": ["攻略", "玩法", "怎么玩", "配装", "手法", "机制", "评价", "强度", "定位", "输出方式"],
+}
+# 查询里不参与打分的疑问/虚词
+_QUERY_STOPWORDS = ["是什么", "什么", "怎么样", "怎么", "如何", "哪些", "哪个", "有没有", "请问", "一下", "介绍",
+                    "吗", "呢", "吧", "的", "了", "和", "与", "是"]
+
+_CJK_RUN_RE = re.compile(r"[㐀-鿿豈-﫿]+")
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]+[。！？!?]*")
+_UNLOCK_NOTE_RE = re.compile(r"\s*（解锁条件[^）]*）")
+
+_FILES = ("terms.bin", "term_offsets.npy", "post_offsets.npy", "post_docs.npy", "post_tf.npy",
+          "doc_len.npy", "doc_source.npy", "doc_character.npy", "texts.bin", "text_offsets.npy", "meta.json")
+
+
+def tokenize(text: str) -> List[str]:
+    """中文连续片段切成字二元组（单字片段保留单字），英文/数字整词小写"""
+    text = text or ""
+    tokens = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(w.lower() for w in _WORD_RE.findall(text))
+    return tokens
+
+
+def detect_sources(question: str) -> Optional[List[str]]:
+    """按关键词判断问题问的是哪类文本；不像文本问题返回 None"""
+    q = question or ""
+    hit = [source for source, words in TEXT_SOURCE_KEYWORDS.items() if any(w in q for w in words)]
+    return hit or None
+
+
+def split_passages(text: str, max_chars: int = MAX_PASSAGE_CHARS) -> List[str]:
+    """按句子切段，相邻句子合并到 max_chars 以内；单句超长时硬切"""
+    passages, buf = [], ""
+    for sentence in _SENTENCE_RE.findall(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if buf:
+                passages.append(buf)
+                buf = ""
+            passages.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(buf) + len(sentence) > max_chars and buf:
+            passages.append(buf)
+            buf = ""
+        buf += sentence
+    if buf:
+        passages.append(buf)
+    return passages
+
+
+def iter_documents(data_dir: str) -> Iterable[dict]:
+    """从 dataExternal 目录产出段落 {source, character, title, text}"""
+    def load(name):
+        path = os.path.join(data_dir, name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    for item in load("character_story.json"):
+        name = item.get("name") if isinstance(item, dict) else None
+        for title, text in ((item.get("stories") or {}).items() if name else []):
+            for passage in split_passages(text):
+                yield {"source": "story", "character": name, "title": _UNLOCK_NOTE_RE.sub("", title), "text": passage}
+
+    for item in load("character_voice.json"):
+        if isinstance(item, dict) and item.get("name") and item.get("cn_text"):
+            yield {"source": "voice", "character": item["name"], "title": item.get("title") or "",
+                   "text": str(item["cn_text"]).strip()}
+
+    for item in load("character_strategy.json"):
+        name = item.get("character") if isinstance(item, dict) else None
+        if not name:
+            continue
+        for paragraph in item.get("role_paragraphs") or []:
+            for passage in split_passages(paragraph):
+                yield {"source": "strategy", "character": name, "title": "定位", "text": passage}
+        for w in item.get("weapons") or []:
+            if isinstance(w, dict) and w.get("description"):
+                for passage in split_passages(w["description"]):
+                    yield {"source": "strategy", "character": name, "title": "武器推荐", "text": passage}
+        for passage in split_passages(item.get("team_strategy") or ""):
+            yield {"source": "strategy", "character": name, "title": "配队", "text": passage}
+
+
+def _write_blob(folder: str, blob_name: str, offsets_name: str, strings: List[str]):
+    """字符串数组 -> 拼接的 UTF-8 二进制块 + 偏移数组"""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded], dtype=np.int64)
+    with open(os.path.join(folder, blob_name), "wb") as f:
+        for b in encoded:
+            f.write(b)
+    np.save(os.path.join(folder, offsets_name), offsets)
+
+
+def build_index(documents: Iterable[dict], out_dir: str) -> dict:
+    """
+    构建并写出索引
+    Returns:
+        meta（文档数、词表大小、各来源段落数等）
+    """
+    docs = list(documents)
+    characters, char_ids = [], {}
+    doc_source = np.zeros(len(docs), dtype=np.int8)
+    doc_character = np.zeros(len(docs), dtype=np.int32)
+    doc_len = np.zeros(len(docs), dtype=np.int32)
+    titles = []
+    term_docs: Dict[str, List[int]] = {}
+    term_tfs: Dict[str, List[int]] = {}
+    for d, doc in enumerate(docs):
+        doc_source[d] = SOURCES.index(doc["source"])
+        cid = char_ids.get(doc["character"])
+        if cid is None:
+            cid = char_ids[doc["character"]] = len(characters)
+            characters.append(doc["character"])
+        doc_character[d] = cid
+        titles.append(doc.get("title") or "")
+        # 标题也参与检索（如语音标题“关于钟离…”）
+        counts = Counter(tokenize(doc["text"]) + tokenize(doc.get("title") or ""))
+        doc_len[d] = sum(counts.values())
+        for term, tf in counts.items():
+            term_docs.setdefault(term, []).append(d)
+            term_tfs.setdefault(term, []).append(min(tf, 65535))
+
+    # 词表按 UTF-8 字节序排序，查询时在映射的二进制块上二分查找
+    terms = sorted(term_docs, key=lambda t: t.encode("utf-8"))
+    post_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    post_offsets[1:] = np.cumsum([len(term_docs[t]) for t in terms], dtype=np.int64)
+    post_docs = np.fromiter((d for t in terms for d in term_docs[t]), dtype=np.int32, count=int(post_offsets[-1]))
+    post_tf = np.fromiter((tf for t in terms for tf in term_tfs[t]), dtype=np.uint16, count=int(post_offsets[-1]))
+
+    os.makedirs(out_dir, exist_ok=True)
+    _write_blob(out_dir, "terms.bin", "term_offsets.npy", terms)
+    _write_blob(out_dir, "texts.bin", "text_offsets.npy", [doc["text"] for doc in docs])
+    for name, arr in (("post_offsets", post_offsets), ("post_docs", post_docs), ("post_tf", post_tf),
+                      ("doc_len", doc_len), ("doc_source", doc_source), ("doc_character", doc_character)):
+        np.save(os.path.join(out_dir, f"{name}.npy"), arr)
+    meta = {
+        "version": INDEX_VERSION,
+        "built_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "n_docs": len(docs),
+        "n_terms": len(terms),
+        "avgdl": float(doc_len.mean()) if len(docs) else 0.0,
+        "source_counts": {s: int((doc_source == i).sum()) for i, s in enumerate(SOURCES)},
+        "characters": characters,
+        "titles": titles,
+    }
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+    return {k: v for k, v in meta.items() if k not in ("characters", "titles")}
+
+
+class TextRetriever:
+    """
+    BM25 文本检索器（只读，可多线程共享）
+
+    用法：
+        retriever = TextRetriever.open("data/text_index")     # 索引不存在返回 None
+        retriever.search("胡桃 往生堂 的故事", k=4, character="胡桃", sources=["story"])
+    """
+
+    def __init__(self, index_dir: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"文本索引版本不匹配（{meta.get('version')} != {INDEX_VERSION}），请重新构建")
+        self.meta = meta
+        self.k1, self.b = k1, b
+        self.characters = meta["characters"]
+        self.char_ids = {c: i for i, c in enumerate(self.characters)}
+        self.titles = meta["titles"]
+        self.n_docs = int(meta["n_docs"])
+        self.avgdl = float(meta["avgdl"]) or 1.0
+
+        def mm(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode="r")
+
+        self._term_offsets = mm("term_offsets.npy")
+        self._post_offsets = mm("post_offsets.npy")
+        self._post_docs = mm("post_docs.npy")
+        self._post_tf = mm("post_tf.npy")
+        self._doc_source = mm("doc_source.npy")
+        self._doc_character = mm("doc_character.npy")
+        self._text_offsets = mm("text_offsets.npy")
+        self._terms = np.memmap(os.path.join(index_dir, "terms.bin"), dtype=np.uint8, mode="r") \
+            if self._term_offsets[-1] else np.zeros(0, dtype=np.uint8)
+        self._texts = np.memmap(os.path.join(index_dir, "texts.bin"), dtype=np.uint8, mode="r") \
+            if self._text_offsets[-1] else np.zeros(0, dtype=np.uint8)
+        # 文档长度归一化项只依赖文档本身，加载时算一次
+        doc_len = np.asarray(mm("doc_len.npy"), dtype=np.float32)
+        self._len_norm = self.k1 * (1.0 - self.b + self.b * doc_len / self.avgdl)
+
+    @classmethod
+    def open(cls, index_dir: Optional[str]) -> Optional["TextRetriever"]:
+        """打开已构建的索引；路径为空或文件不全返回 None"""
+        if not index_dir or not all(os.path.exists(os.path.join(index_dir, f)) for f in _FILES):
+            return None
+        return cls(index_dir)
+
+    def __len__(self):
+        return self.n_docs
+
+    def _term(self, i: int) -> bytes:
+        return self._terms[self._term_offsets[i]:self._term_offsets[i + 1]].tobytes()
+
+    def _term_id(self, term: str) -> Optional[int]:
+        """在映射的有序词表上二分查找"""
+        target = term.encode("utf-8")
+        lo, hi = 0, len(self._term_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._term_offsets) - 1 and self._term(lo) == target:
+            return lo
+        return None
+
+    def text(self, doc_id: int) -> str:
+        return self._texts[self._text_offsets[doc_id]:self._text_offsets[doc_id + 1]].tobytes().decode("utf-8")
+
+    def search(self, query: str, k: int = 5, character: Optional[str] = None,
+               sources: Optional[List[str]] = None) -> List[dict]:
+        """
+        BM25 检索
+        Args:
+            character: 只在该角色的文本里检索（角色没有文本时不过滤）
+            sources: 只检索这些来源（story / voice / strategy）
+        Returns:
+            [{"character", "source", "title", "text", "score"}]，按分数降序
+        """
+        q = query or ""
+        for w in _QUERY_STOPWORDS:
+            q = q.replace(w, " ")
+        if character:
+            q = q.replace(character, " ")
+        term_ids = {t for t in (self._term_id(tok) for tok in tokenize(q)) if t is not None}
+
+        mask = None
+        if sources:
+            wanted = [SOURCES.index(s) for s in sources if s in SOURCES]
+            mask = np.isin(self._doc_source, wanted)
+        cid = self.char_ids.get(character) if character else None
+        if cid is not None:
+            char_mask = self._doc_character == cid
+            mask = char_mask if mask is None else (mask & char_mask)
+
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for t in term_ids:
+            start, end = int(self._post_offsets[t]), int(self._post_offsets[t + 1])
+            docs = self._post_docs[start:end]
+            tf = self._post_tf[start:end].astype(np.float32)
+            idf = math.log(1.0 + (self.n_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + self._len_norm[docs])
+
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+            # 查询词在过滤范围内都没命中（如“胡桃的语音”）时，按文档顺序取该范围内的段落
+            if not scores.any():
+                scores = mask.astype(np.float32) * 1e-3
+        hits = np.flatnonzero(scores > 0)
+        if hits.size == 0:
+            return []
+        k = min(k, hits.size)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [{
+            "character": self.characters[int(self._doc_character[d])],
+            "source": SOURCE_LABELS[SOURCES[int(self._doc_source[d])]],
+            "title": self.titles[d],
+            "text": self.text(int(d)),
+            "score": round(float(scores[d]), 3),
+        } for d in top]
@@ -0,0 +1,155 @@
+"""
+Token 预算模块 - 把查询结果压缩成紧凑的列式文本再交给 LLM
+
+- estimate_tokens：不依赖分词器的粗略 token 估计（中文约 1 字 1 token，其它约 4 字符 1 token）
+- 列式编码：表头只写一次，每行只写值（JSON 对象每行都要重复全部键名）
+- 低价值列：全空列 / id、图片链接等直接丢弃；所有行取值相同的列提到表头说明里
+- 仍超预算时：先逐级截短长文本，再逐步减少行数，直到放进预算
+每次压缩都返回报告（压缩前后的估计 token 数、行/列变化），用于按问题统计节省量。
+"""
+import json
+from typing import List, Optional, Tuple
+
+# 对回答没有帮助、只占 token 的列
+LOW_VALUE_COLUMNS = {"id", "img_src", "embedding", "label", "slot_template_ids", "evidence_rule", "evidence_field"}
+
+# 截短阶段每个单元格依次尝试保留的字符数（先轻后重，仍超预算才减少行数）
+CELL_CHAR_STEPS = (80, 24)
+# 列表单元格最多保留的元素数
+MAX_LIST_CELL_ITEMS = 20
+
+
+def estimate_tokens(text) -> int:
+    """粗略估计 token 数：CJK 字符约 1 token，其它字符约 4 个 1 token"""
+    text = text if isinstance(text, str) else json.dumps(text, ensure_ascii=False, default=str)
+    cjk = sum(1 for ch in text if "　" <= ch <= "鿿" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _is_empty(v) -> bool:
+    return v is None or v == "" or v == [] or v == {}
+
+
+def _cell(v, max_chars: Optional[int] = None) -> str:
+    if isinstance(v, bool):
+        s = "是" if v else "否"
+    elif isinstance(v, (list, tuple)):
+        items = [x for x in v if not _is_empty(x)]
+        s = "、".join(_cell(x) for x in items[:MAX_LIST_CELL_ITEMS])
+        if len(items) > MAX_LIST_CELL_ITEMS:
+            s += "…"
+    elif isinstance(v, dict):
+        s = json.dumps(v, ensure_ascii=False, separators=(",", ":"), default=str)
+    elif v is None:
+        s = ""
+    else:
+        s = str(v)
+    s = s.replace("|", "/").replace("\n", " ")
+    if max_chars and len(s) > max_chars:
+        s = s[:max_chars] + "…"
+    return s
+
+
+def _columns_of(rows: List[dict]) -> List[str]:
+    columns = []
+    for r in rows:
+        for k in r.keys():
+            if k not in columns:
+                columns.append(k)
+    return columns
+
+
+def prune_columns(rows: List[dict]) -> Tuple[List[str], dict, List[str]]:
+    """
+    列筛选
+    Returns:
+        (保留的列, 各行取值相同的列 {列: 值}, 丢弃的列)
+    """
+    columns = _columns_of(rows)
+    kept, constants, dropped = [], {}, []
+    for c in columns:
+        values = [r.get(c) for r in rows]
+        if c in LOW_VALUE_COLUMNS or all(_is_empty(v) for v in values):
+            dropped.append(c)
+            continue
+        if len(rows) > 1:
+            first = _cell(values[0])
+            if first and all(_cell(v) == first for v in values[1:]):
+                constants[c] = values[0]
+                continue
+        kept.append(c)
+    return kept, constants, dropped
+
+
+def encode_columnar(rows: List[dict], columns: List[str], constants: Optional[dict] = None,
+                    max_cell_chars: Optional[int] = None, omitted_note: Optional[str] = None) -> str:
+    """列式编码：可选的“所有行相同”说明 + 表头一行 + 每行一行值（| 分隔）"""
+    lines = []
+    for c, v in (constants or {}).items():
+        lines.append(f"# 所有行 {c} = {_cell(v, max_cell_chars)}")
+    if columns:
+        lines.append("|".join(columns))
+        for r in rows:
+            lines.append("|".join(_cell(r.get(c), max_cell_chars) for c in columns))
+    if omitted_note:
+        lines.append(omitted_note)
+    return "\n".join(lines)
+
+
+def fit_rows(rows: List[dict], budget_tokens: int, max_rows: int = 50,
+             baseline_text: Optional[str] = None) -> Tuple[str, dict]:
+    """
+    在 token 预算内编码结果行
+    Args:
+        rows: 结果行（list[dict]）
+        budget_tokens: 编码后文本的 token 上限
+        max_rows: 最多编码的行数
+        baseline_text: 用于对比的原编码（默认按旧做法把前 max_rows 行 JSON 序列化）
+    Returns:
+        (编码文本, 报告 {baseline_tokens, tokens, saved_tokens, rows_in, rows_out, columns_in, columns_out, dropped_columns})
+    """
+    rows = [r for r in (rows or []) if isinstance(r, dict)]
+    if baseline_text is None:
+        baseline_text = json.dumps(rows[:max_rows], ensure_ascii=False, separators=(",", ":"), default=str)
+    baseline_tokens = estimate_tokens(baseline_text)
+
+    candidate_rows = rows[:max_rows]
+    columns, constants, dropped = prune_columns(candidate_rows) if candidate_rows else ([], {}, [])
+
+    def note(kept_n):
+        # 不写具体行数：回答会经过数字白名单校验，配队润色更要求输入不含数字
+        return "# 其余结果从略（未全部列出）" if len(rows) > kept_n else None
+
+    # 1) 全量列式编码；2) 逐级截短长文本；3) 二分减少行数
+    max_chars = None
+    text = encode_columnar(candidate_rows, columns, constants, None, note(len(candidate_rows)))
+    for step in CELL_CHAR_STEPS:
+        if estimate_tokens(text) <= budget_tokens:
+            break
+        max_chars = step
+        text = encode_columnar(candidate_rows, columns, constants, max_chars, note(len(candidate_rows)))
+    kept_n = len(candidate_rows)
+    if estimate_tokens(text) > budget_tokens and kept_n > 1:
+        lo, hi = 1, kept_n
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            t = encode_columnar(candidate_rows[:mid], columns, constants, max_chars, note(mid))
+            if estimate_tokens(t) <= budget_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        kept_n = lo
+        text = encode_columnar(candidate_rows[:kept_n], columns, constants, max_chars, note(kept_n))
+
+    tokens = estimate_tokens(text)
+    report = {
+        "baseline_tokens": baseline_tokens,
+        "tokens": tokens,
+        "saved_tokens": baseline_tokens - tokens,
+        "rows_in": len(rows),
+        "rows_out": kept_n,
+        "columns_in": len(_columns_of(candidate_rows)),
+        "columns_out": len(columns),
+        "dropped_columns": dropped,
+    }
+    return text, report
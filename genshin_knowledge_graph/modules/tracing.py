@@ -0,0 +1,184 @@
+"""
+问答链路追踪模块 - 按阶段记录 span（路由、实体链接、提示词、LLM、Cypher 校验、数据库、后处理、渲染）
+
+- 不依赖 opentelemetry 包：span 结构与导出格式遵循 OTLP/JSON（与 OTel Collector 的 file exporter 相同），
+  每条完成的 trace 写一行 {"resourceSpans": [...]}，可直接导入 Jaeger / Tempo 等后端
+- 当前 span 存在 contextvars 里；提交到线程池的函数用 bind() 包一层，子线程里的 span 才能挂到同一条 trace 上
+- 根 span 结束时整条 trace 定稿：写入 JSONL（配置了路径时），并记为当前线程的“最近一条 trace”供界面展示
+"""
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SERVICE_NAME = "genshin-kgqa"
+SCOPE_NAME = "modules.tracing"
+
+_current_span = contextvars.ContextVar("qa_current_span", default=None)
+
+
+class Span:
+    """一个计时区间；attributes 只放标量（字符串/数字/布尔），其它值会转成字符串"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Optional[dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {}
+        self.error = None
+        self.set(**(attributes or {}))
+
+    def set(self, **attributes):
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            if not isinstance(value, (str, int, float, bool)):
+                value = json.dumps(value, ensure_ascii=False, default=str)
+            self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        """简化结构（界面画瀑布图用）"""
+        return {"name": self.name, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start_ns": self.start_ns, "end_ns": self.end_ns, "duration_ms": self.duration_ms,
+                "attributes": dict(self.attributes), "error": self.error}
+
+    def to_otlp(self) -> dict:
+        def typed(value):
+            if isinstance(value, bool):
+                return {"boolValue": value}
+            if isinstance(value, int):
+                return {"intValue": str(value)}
+            if isinstance(value, float):
+                return {"doubleValue": value}
+            return {"stringValue": value}
+
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": "SPAN_KIND_INTERNAL",
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [{"key": k, "value": typed(v)} for k, v in self.attributes.items()],
+            "status": {"code": "STATUS_CODE_ERROR", "message": self.error} if self.error else {"code": "STATUS_CODE_OK"},
+        }
+
+
+class Tracer:
+    """
+    用法：
+        tracer = Tracer("logs/qa_traces.jsonl")
+        with tracer.span("qa.ask", question=q):
+            with tracer.span("qa.db", rows=3) as sp:
+                ...
+                sp.set(rows=len(rows))
+        tracer.last_trace()   # 当前线程最近一条完成的 trace（span 字典列表，按开始时间排序）
+    """
+
+    def __init__(self, path: Optional[str] = None, service_name: str = SERVICE_NAME):
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        self._open: Dict[str, List[Span]] = {}
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        span = Span(name, trace_id, parent.span_id if parent is not None else None, attributes)
+        with self._lock:
+            if parent is None:
+                self._open[trace_id] = [span]
+            elif trace_id in self._open:
+                # 根 span 已结束后才开始的 span（如被放弃的后台 LLM 请求）不再计入
+                self._open[trace_id].append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if parent is None:
+                self._finish(trace_id)
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def set(self, **attributes):
+        """给当前 span 补充属性（没有进行中的 span 时忽略）"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    @staticmethod
+    def bind(fn):
+        """把当前上下文（含当前 span）带进线程池里执行的函数；每次调用用一份副本，可被多个线程同时执行"""
+        ctx = contextvars.copy_context()
+        return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+    def _finish(self, trace_id: str):
+        with self._lock:
+            spans = self._open.pop(trace_id, [])
+        spans.sort(key=lambda s: s.start_ns)
+        self._local.last = [s.to_dict() for s in spans]
+        if self.path:
+            self.export(spans)
+
+    def export(self, spans: List[Span]):
+        """追加一行 OTLP/JSON；写文件失败不影响问答"""
+        record = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        try:
+            folder = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(folder, exist_ok=True)
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError:
+            pass
+
+    def last_trace(self) -> List[dict]:
+        return list(getattr(self._local, "last", None) or [])
+
+
+def waterfall_rows(spans: List[dict]) -> List[dict]:
+    """span 列表 -> 瀑布图数据：相对根 span 的起止毫秒与缩进层级"""
+    if not spans:
+        return []
+    t0 = min(s["start_ns"] for s in spans)
+    by_id = {s["span_id"]: s for s in spans}
+
+    def depth(s):
+        d, parent = 0, s["parent_id"]
+        while parent in by_id:
+            d, parent = d + 1, by_id[parent]["parent_id"]
+        return d
+
+    rows = []
+    for s in spans:
+        end_ns = s["end_ns"] or s["start_ns"]
+        rows.append({"span": "  " * depth(s) + s["name"], "start_ms": round((s["start_ns"] - t0) / 1e6, 2),
+                     "end_ms": round((end_ns - t0) / 1e6, 2), "duration_ms": round((end_ns - s["start_ns"]) / 1e6, 2),
+                     "attributes": s["attributes"], "error": s["error"]})
+    return rows
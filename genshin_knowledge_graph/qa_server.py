@@ -0,0 +1,260 @@
+"""
+问答 HTTP 服务 - 基于 KGQAEngine 的最小 ASGI 应用（不依赖 Streamlit / Web 框架）
+
+启动（需要 uvicorn）：
+    uvicorn qa_server:app --host 0.0.0.0 --port 8000 --workers 4
+    或 python qa_server.py
+
+接口：
+    GET  /health                         -> {"status": "ok", "engine_ready": bool, "faq": 预计算答案状态或 null,
+                                             "llm_admission": LLM 排队深度/在途数/拒绝次数}
+    POST /ask        {"question": "...", "session_id": "可选"}
+                                         -> {"question", "resolved_question", "cypher", "results", "answer", "error", "elapsed_ms"}
+                                            带 session_id 时按会话保留最近几轮上下文，追问可复用上一轮结果
+    POST /ask_many   {"questions": [...], "max_concurrency": 8, "rate_limit": 可选（次/秒）}
+                                         -> {"items": [...]}（与 KGQAEngine.ask_many 输出一致）
+
+配置（环境变量）：
+    NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
+    OPENAI_API_KEY（可选：OPENAI_API_BASE, OPENAI_MODEL_ID）
+    QA_SERVER_THREADS  每个进程处理问答的线程数（默认 16）
+    QA_MAX_SESSIONS    每个进程保留的对话上下文数量（默认 1000，按最近使用淘汰）
+    QA_MAX_BATCH_QUESTIONS / QA_MAX_BATCH_CONCURRENCY
+                       /ask_many 单次最多问题数（默认 200）与 max_concurrency 上限（默认 16，超出按上限处理）
+    FAQ_PATH           常见问题预计算答案文件（默认 data/faq_cache.json；实际文件名带模型/提示词版本，如 faq_cache.<tag>.json）
+    LLM_GLOBAL_RATE / LLM_MAX_CONCURRENCY / LLM_MAX_QUEUE / LLM_MAX_WAIT_S
+                       每个进程的 LLM 准入：全局速率、并发上限、排队上限（超出直接走规则兜底）、最长排队秒数
+
+每个进程持有一个引擎实例（Neo4j driver 与实体链接器线程安全、只读共享），
+同步的问答流程放到线程池里执行，事件循环只负责收发请求；水平扩展时增加进程/机器即可。
+对话上下文保存在进程内存中，多进程部署时需要按 session_id 做会话粘滞，否则追问退化为单轮问答。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import GraphDatabase
+
+from modules.qa_engine import KGQAEngine, QAConfig
+from modules.conversation import ConversationContext
+from modules.llm_limiter import llm_session, get_llm_limiter
+
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_QUESTIONS = int(os.environ.get("QA_MAX_BATCH_QUESTIONS", "200"))
+# /ask_many 的 max_concurrency 上限：引擎按它开线程池、占数据库会话，不能由请求随意指定
+MAX_BATCH_CONCURRENCY = int(os.environ.get("QA_MAX_BATCH_CONCURRENCY", "16"))
+DEFAULT_BATCH_CONCURRENCY = 8
+MAX_SESSIONS = int(os.environ.get("QA_MAX_SESSIONS", "1000"))
+
+_engine = None
+_engine_lock = threading.Lock()
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("QA_SERVER_THREADS", "16")),
+                               thread_name_prefix="qa-server")
+
+
+def build_engine_from_env():
+    """按环境变量创建 Neo4j driver 与问答引擎"""
+    uri = os.environ.get("NEO4J_URI")
+    user = os.environ.get("NEO4J_USER")
+    password = os.environ.get("NEO4J_PASSWORD")
+    if not (uri and user and password):
+        raise RuntimeError("请先设置环境变量 NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD")
+    driver = GraphDatabase.driver(uri, auth=(user, password))
+    driver.verify_connectivity()
+    return KGQAEngine(driver=driver, config=QAConfig.from_env())
+
+
+def get_engine():
+    """进程内单例：首次使用时初始化（lifespan 启动时会提前调用）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = build_engine_from_env()
+                # 实体链接器在启动时构建好，避免第一个请求承担加载开销
+                engine._get_entity_linker()
+                # 常见问题按图谱版本在后台预计算（答案文件各进程共享，已是当前版本的不会重算）
+                engine.start_faq_precompute()
+                _engine = engine
+    return _engine
+
+
+def set_engine(engine):
+    """注入已构建好的引擎（嵌入其他服务或脚本时使用）"""
+    global _engine
+    _engine = engine
+
+
+def get_conversation(session_id):
+    """按 session_id 取对话上下文（LRU，超出 MAX_SESSIONS 时淘汰最久未用的会话）"""
+    if not session_id:
+        return None
+    key = str(session_id)
+    with _sessions_lock:
+        conversation = _sessions.get(key)
+        if conversation is None:
+            conversation = ConversationContext()
+            _sessions[key] = conversation
+            while len(_sessions) > MAX_SESSIONS:
+                _sessions.popitem(last=False)
+        else:
+            _sessions.move_to_end(key)
+        return conversation
+
+
+# ---------------------------
+# 问答处理（在线程池中执行）
+# ---------------------------
+
+def _handle_ask(payload):
+    question = (payload.get("question") or "").strip()
+    if not question:
+        return 400, {"error": "缺少 question 字段"}
+    t0 = time.perf_counter()
+    conversation = get_conversation(payload.get("session_id"))
+    # LLM 公平队列按会话轮转；没有 session_id 的请求各自算一个会话
+    with llm_session(payload.get("session_id") or f"anon-{id(payload)}"):
+        cypher, results_or_error, answer = get_engine().ask(question, conversation=conversation)
+    error = results_or_error if isinstance(results_or_error, str) else None
+    last = conversation.last_turn() if conversation is not None else None
+    return 200, {
+        "question": question,
+        "resolved_question": last["resolved_question"] if last else question,
+        "cypher": cypher,
+        "results": None if error else results_or_error,
+        "answer": answer,
+        "error": error,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+
+
+def _handle_ask_many(payload):
+    questions = payload.get("questions")
+    if not isinstance(questions, list) or not questions:
+        return 400, {"error": "questions 必须是非空列表"}
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return 400, {"error": f"单次最多 {MAX_BATCH_QUESTIONS} 个问题"}
+    max_concurrency = payload.get("max_concurrency", DEFAULT_BATCH_CONCURRENCY)
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency <= 0:
+        return 400, {"error": "max_concurrency 必须是正整数"}
+    rate_limit = payload.get("rate_limit")
+    if rate_limit is not None and (isinstance(rate_limit, bool) or not isinstance(rate_limit, (int, float))
+                                   or rate_limit <= 0):
+        return 400, {"error": "rate_limit 必须是正数（次/秒）"}
+    items = get_engine().ask_many(
+        [str(q) for q in questions],
+        # 超过上限的按上限处理，一个请求不能在共享引擎上开出成千上万的线程
+        max_concurrency=min(max_concurrency, MAX_BATCH_CONCURRENCY),
+        rate_limit=rate_limit,
+    )
+    return 200, {"items": items}
+
+
+ROUTES = {
+    ("POST", "/ask"): _handle_ask,
+    ("POST", "/ask_many"): _handle_ask_many,
+}
+
+
+# ---------------------------
+# ASGI
+# ---------------------------
+
+async def _read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send_json(send, status, data):
+    # 图谱结果里可能有 neo4j 的日期等类型，统一转成字符串
+    body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    loop = asyncio.get_running_loop()
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await loop.run_in_executor(_executor, get_engine)
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            engine = _engine
+            if engine is not None and engine.driver is not None:
+                engine.driver.close()
+            _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"].rstrip("/") or "/"
+    if method == "GET" and path == "/health":
+        faq = getattr(_engine, "faq", None)
+        await _send_json(send, 200, {"status": "ok", "engine_ready": _engine is not None,
+                                     "faq": faq.status() if faq is not None else None,
+                                     "llm_admission": get_llm_limiter().stats()})
+        return
+
+    handler = ROUTES.get((method, path))
+    if handler is None:
+        await _send_json(send, 404, {"error": f"未知接口: {method} {path}"})
+        return
+
+    raw = await _read_body(receive)
+    if raw is None:
+        await _send_json(send, 413, {"error": "请求体过大或连接已断开"})
+        return
+    try:
+        payload = json.loads(raw.decode("utf-8") or "{}")
+        if not isinstance(payload, dict):
+            raise ValueError("请求体必须是 JSON 对象")
+    except Exception as e:
+        await _send_json(send, 400, {"error": f"请求体解析失败: {str(e)}"})
+        return
+
+    loop = asyncio.get_running_loop()
+    try:
+        status, data = await loop.run_in_executor(_executor, handler, payload)
+    except Exception as e:
+        status, data = 500, {"error": f"问答流程失败: {str(e)}"}
+    await _send_json(send, status, data)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.environ.get("QA_SERVER_HOST", "0.0.0.0"),
+                port=int(os.environ.get("QA_SERVER_PORT", "8000")))
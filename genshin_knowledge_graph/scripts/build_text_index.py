@@ -0,0 +1,54 @@
+"""build_text_index.py — 构建角色故事/语音/攻略文本的 BM25 检索索引
+
+用途:
+- 读取 data_preprocess/dataExternal 下的 character_story.json / character_voice.json / character_strategy.json，
+  切成段落后按字二元组建倒排索引，写成一组 .npy + 二进制文本块（问答引擎启动时内存映射加载）。
+- 文本数据更新后重跑即可；不连接数据库、不调用 LLM。
+
+用法:
+        python scripts/build_text_index.py --out data/text_index
+
+参数:
+    --data-dir  文本数据目录（默认: ../data_preprocess/dataExternal）
+    --out       索引输出目录（默认: data/text_index，问答引擎的默认读取位置）
+    --query     可选，构建后用该问题试检索一次
+"""
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from modules.text_retriever import build_index, iter_documents, TextRetriever, DEFAULT_TEXT_INDEX_PATH
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(ROOT), 'data_preprocess', 'dataExternal')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the BM25 text index over character story/voice/strategy texts')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='dataExternal directory')
+    parser.add_argument('--out', default=DEFAULT_TEXT_INDEX_PATH, help='output index directory')
+    parser.add_argument('--query', default=None, help='optional test query')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    meta = build_index(iter_documents(args.data_dir), args.out)
+    size = sum(os.path.getsize(os.path.join(args.out, f)) for f in os.listdir(args.out))
+    print(f'已写入 {args.out}（耗时 {time.perf_counter() - t0:.1f}s，{size / 1e6:.1f} MB）')
+    print(f'  段落数: {meta["n_docs"]}，词表大小: {meta["n_terms"]}，平均段落长度: {meta["avgdl"]:.1f}')
+    for source, n in meta['source_counts'].items():
+        print(f'  {source}: {n} 段')
+
+    if args.query:
+        retriever = TextRetriever.open(args.out)
+        t0 = time.perf_counter()
+        hits = retriever.search(args.query)
+        print(f'试检索「{args.query}」（{(time.perf_counter() - t0) * 1000:.2f}ms）:')
+        for h in hits:
+            print(f'  [{h["score"]}] {h["character"]}·{h["source"]}·{h["title"]}: {h["text"][:60]}')
+
+
+if __name__ == '__main__':
+    main()
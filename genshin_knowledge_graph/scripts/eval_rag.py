@@ -3,15 +3,18 @@ RAG 测试与评估脚本
 
 用法示例：
 python scripts/eval_rag.py --testset tests\generated_testset_artifact_qs.jsonl --out report.json
+python scripts/eval_rag.py --testset tests\generated_testset_artifact_qs.jsonl --out report.json --concurrency 8 --rate-limit 5
+python scripts/eval_rag.py --testset tests\generated_testset_artifact_qs.jsonl --out report.json --llm-transport record --llm-store tests\llm_cassette.jsonl
+python scripts/eval_rag.py --testset tests\generated_testset_artifact_qs.jsonl --out report.json --llm-transport replay --llm-store tests\llm_cassette.jsonl --llm-latency-ms 800
 
 需要环境变量：
 NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD
-OPENAI_API_KEY (可选：OPENAI_API_BASE, OPENAI_MODEL_ID)
+OPENAI_API_KEY (可选：OPENAI_API_BASE, OPENAI_MODEL_ID；--llm-transport replay 时不需要)
 
 该脚本会：
 - 连接 Neo4j
-- 初始化 QA 系统（绕过 Streamlit 的自动初始化）
-- 对每个问题调用 `qa.ask(question)` 获取生成答案
+- 初始化问答引擎 KGQAEngine（不依赖 Streamlit）
+- 对每个问题调用 `qa.ask(question)` 获取生成答案（--concurrency > 1 时改用 `qa.ask_many` 批量流水线执行）
 - 计算若干文本相似性指标（exact match, LCS-based ROUGE-L, difflib ratio）
 - 输出 JSON 报告和 CSV 汇总
 """
@@ -21,7 +24,6 @@ import json
 import argparse
 from typing import List, Dict
 from datetime import datetime
-from openai import OpenAI
 import time
 import statistics
 try:
@@ -34,9 +36,8 @@ ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(ROOT)
 
 from neo4j_connector import GenshinKnowledgeGraph
-from modules.qa_panel import KGQA_System
+from modules.qa_engine import KGQAEngine, QAConfig
 
-import streamlit as st
 import difflib
 
 
@@ -187,6 +188,12 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--testset', required=True, help='JSONL 文件，每行: {"id":.., "question":.., "answer":..}')
     parser.add_argument('--out', default='report.json', help='输出 JSON 报告路径')
+    parser.add_argument('--concurrency', type=int, default=1, help='批量问答并发数（>1 时使用 ask_many）')
+    parser.add_argument('--rate-limit', type=float, default=None, help='LLM 调用速率上限（次/秒）')
+    parser.add_argument('--llm-transport', choices=['live', 'record', 'replay', 'auto'], default='live',
+                        help='LLM 调用方式：直连 / 录制到存档 / 只从存档回放 / 命中回放否则录制')
+    parser.add_argument('--llm-store', default='tests/llm_cassette.jsonl', help='LLM 录制/回放存档（JSONL）')
+    parser.add_argument('--llm-latency-ms', default='0', help='回放时模拟的 LLM 延迟（毫秒，或 recorded 使用录制耗时）')
     args = parser.parse_args()
 
     # 从环境变量读取连接与 LLM 配置
@@ -201,7 +208,7 @@ def main():
         print('请先设置环境变量 NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD')
         sys.exit(1)
 
-    if not openai_key:
+    if not openai_key and args.llm_transport != 'replay':
         print('警告：未检测到 OPENAI_API_KEY，LLM 可能无法工作（仅当问题走规则化路径时可继续）')
 
     print('连接 Neo4j...')
@@ -211,19 +218,13 @@ def main():
         print('无法连接 Neo4j')
         sys.exit(1)
 
-    # 绕过 KGQA_System 在构造时尝试使用 Streamlit 初始化 LLM 的动作
-    KGQA_System._init_llm_client = lambda self: None
-    st.session_state.clear()
-
-    qa = KGQA_System(kg)
-    # 手动注入 OpenAI 客户端
-    if openai_key:
-        try:
-            qa.client = OpenAI(api_key=openai_key, base_url=openai_base) if openai_base else OpenAI(api_key=openai_key)
-            qa.model_id = openai_model
-            print('已设置 OpenAI 客户端')
-        except Exception as e:
-            print('设置 OpenAI 客户端失败：', e)
+    # 问答引擎：配置显式传入；评测沿用手工Schema约束的默认提示词，保证不同库状态下结果可比
+    latency = args.llm_latency_ms if args.llm_latency_ms == 'recorded' else float(args.llm_latency_ms)
+    config = QAConfig(api_key=openai_key, api_base=openai_base, model_id=openai_model, dynamic_schema_prompt=False,
+                      llm_transport=args.llm_transport, llm_store=args.llm_store, llm_latency_ms=latency)
+    qa = KGQAEngine(kg, config=config)
+    if qa.client:
+        print(f'已设置 OpenAI 客户端（{args.llm_transport}）')
 
     # 读入测试集
     test_items = read_jsonl(args.testset)
@@ -233,15 +234,36 @@ def main():
     cpu_samples = []
     mem_samples = []
 
-    for item in test_items:
+    # 批量模式：规划/检索/回答三阶段跨问题流水线执行，结果与输入顺序一致
+    batch = None
+    if args.concurrency > 1:
+        print(f'批量问答：并发 {args.concurrency}，LLM 限速 {args.rate_limit or "不限"}')
+        t_batch0 = time.perf_counter()
+        batch = qa.ask_many([item.get('question') for item in test_items],
+                            max_concurrency=args.concurrency, rate_limit=args.rate_limit)
+        print(f'批量问答完成，用时 {time.perf_counter() - t_batch0:.1f}s')
+
+    for idx, item in enumerate(test_items):
         qid = item.get('id') or item.get('qid') or None
         question = item.get('question')
         reference = item.get('answer') or item.get('ground_truth') or ""
         print(f'[{qid}] 提问：{question}')
 
-        # 优先使用 KGQA_System 的分阶段方法以获得检索结果和各阶段延迟
+        # 优先使用 KGQAEngine 的分阶段方法以获得检索结果和各阶段延迟
+        token_report = None
         start_e2e = time.perf_counter()
         try:
+            if batch is not None:
+                # 直接使用 ask_many 的结果与分阶段耗时
+                b = batch[idx]
+                cypher = b['cypher']
+                query_results = b['results']
+                answer = b['answer'] or ""
+                retrieval_latency_ms = b['timings'].get('retrieve_ms')
+                generation_latency_ms = b['timings'].get('answer_ms')
+                end_to_end_ms = b['timings'].get('total_ms')
+                token_report = b.get('tokens')
+                raise StopIteration
             if hasattr(qa, 'generate_cypher') and hasattr(qa, 'execute_query') and hasattr(qa, 'generate_answer'):
                 cypher = qa.generate_cypher(question)
                 # 兼容 generate_cypher 可能返回的不同结构
@@ -383,11 +405,18 @@ def main():
         # 幻觉比例（预测中不在检索内容的 token 比例）
         hallucination_fraction = proportion_out_of_retrieval(pred, retrieved_text)
 
+        # 回答阶段交给 LLM 的结果表格：压缩前后的估计 token 数（逐题）
+        if batch is None and hasattr(qa, 'last_token_report'):
+            token_report = qa.last_token_report()
+
         # 系统性能（ms）
         rec_perf = {
             'retrieval_latency_ms': retrieval_latency_ms,
             'generation_latency_ms': generation_latency_ms,
             'end_to_end_ms': end_to_end_ms,
+            'llm_payload_tokens': token_report.get('tokens') if token_report else None,
+            'llm_payload_tokens_baseline': token_report.get('baseline_tokens') if token_report else None,
+            'llm_payload_tokens_saved': token_report.get('saved_tokens') if token_report else None,
         }
 
         # 用户体验近似指标
@@ -431,8 +460,44 @@ def main():
 
     meta = {
         'generated_at': datetime.utcnow().isoformat() + 'Z',
-        'count': len(results)
+        'count': len(results),
+        'llm_transport': args.llm_transport,
     }
+    saved = [r['llm_payload_tokens_saved'] for r in results if r.get('llm_payload_tokens_saved') is not None]
+    if saved:
+        meta['llm_payload_tokens_saved_total'] = sum(saved)
+        print(f'结果表格压缩：{len(saved)} 题调用了 LLM，共节省约 {sum(saved)} 个输入 token')
+    # 录制/回放统计：回放未命中说明存档需要重新录制
+    llm_stats = getattr(qa.client, 'stats', None)
+    if llm_stats is not None:
+        meta['llm_transport_stats'] = dict(llm_stats)
+        print(f"LLM 存档统计：命中 {llm_stats['hits']}，未命中 {llm_stats['misses']}，新录制 {llm_stats['recorded']}")
+
+    # 推测执行统计：命中率与节省的 LLM 等待时间
+    spec_stats = qa.speculation_report()
+    if spec_stats['attempts']:
+        meta['speculation'] = spec_stats
+        print(f"推测执行：尝试 {spec_stats['attempts']}，命中率 {spec_stats['hit_rate']:.0%}，"
+              f"约节省 {spec_stats['saved_ms'] / 1000:.1f}s LLM 等待")
+
+    # 提示词前缀缓存：服务端返回 cached_tokens 时统计各阶段命中率
+    cache_report = qa.prompt_cache_report()
+    meta['prompt_cache'] = cache_report
+    for stage, st in cache_report['stages'].items():
+        if st['hit_rate'] is not None:
+            print(f"前缀缓存[{stage}]：{st['calls']} 次调用，输入 {st['prompt_tokens']} token，"
+                  f"缓存命中 {st['cached_tokens']}（{st['hit_rate']:.0%}）")
+
+    # 回答记忆：相同结果行复用润色回答的命中情况
+    memo_report = qa.answer_memo_report()
+    if memo_report is not None:
+        meta['answer_memo'] = memo_report
+        print(f"回答记忆：命中 {memo_report['hits']}，未命中 {memo_report['misses']}，条目 {memo_report['entries']}")
+
+    # 分阶段模型路由：对冲/超预算次数与耗时分位数
+    meta['llm_stages'] = qa.llm_stage_report()
+    # LLM 准入：排队深度与过载拒绝次数
+    meta['llm_admission'] = qa.llm_admission_report()
 
     out_obj = {'meta': meta, 'results': results}
     with open(args.out, 'w', encoding='utf-8') as f:
@@ -0,0 +1,101 @@
+"""materialize_team_table.py — 离线生成预计算配队表（配队推荐 / 替代候选）
+
+用途:
+- 对每个有配队模板的核心角色执行一次 TEAM_RECOMMEND，对每个角色执行 SUBSTITUTE_BY_SLOT
+  （为空时再执行 SUBSTITUTE_BY_ROLE_TAG），把结果行以紧凑 JSON 写入本地 SQLite 键值表。
+- 问答引擎检测到该文件后，配队推荐/替代问题直接按角色名查表，不再在线做多跳遍历与排序聚合。
+- 配队模板只在导入时变化：每次重新导入图谱后重跑本脚本即可（整表在一个事务里替换）。
+  表里记录生成时的图谱数据指纹，问答引擎发现与当前图谱不一致时不再使用该表。
+
+用法:
+        NEO4J_URI=... NEO4J_USER=... NEO4J_PASSWORD=... python scripts/materialize_team_table.py --out data/team_table.sqlite
+
+参数:
+    --out    输出 SQLite 路径（默认: data/team_table.sqlite，问答引擎的默认读取位置）
+"""
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from neo4j_connector import GenshinKnowledgeGraph
+from modules.qa_engine import (TEAM_RECOMMEND, SUBSTITUTE_BY_SLOT, SUBSTITUTE_BY_ROLE_TAG,
+                               TEAM_RECOMMEND_K, TEAM_RECOMMEND_TOPN)
+from modules.team_table import TeamTable, DEFAULT_TEAM_TABLE_PATH, graph_fingerprint
+
+CORE_CHARACTERS = """
+MATCH (tt)
+WHERE tt.label = 'TeamTemplate' AND tt.core_character IS NOT NULL
+RETURN DISTINCT tt.core_character AS name
+ORDER BY name
+""".strip()
+
+ALL_CHARACTERS = """
+MATCH (c:character)
+WHERE c.name IS NOT NULL
+RETURN c.name AS name
+ORDER BY name
+""".strip()
+
+
+def run(session, cypher, params=None):
+    return [dict(r) for r in session.run(cypher, params or {})]
+
+
+def iter_entries(driver, stats):
+    """逐个角色执行与在线问答相同的查询，产出 (kind, key, rows)"""
+    with driver.session() as session:
+        cores = [r['name'] for r in run(session, CORE_CHARACTERS)]
+        for name in cores:
+            rows = run(session, TEAM_RECOMMEND, {'core_name': name, 'k': TEAM_RECOMMEND_K, 'topn': TEAM_RECOMMEND_TOPN})
+            stats['team_rows'] += len(rows)
+            yield 'team_recommend', name, rows
+
+        for name in [r['name'] for r in run(session, ALL_CHARACTERS)]:
+            rows = run(session, SUBSTITUTE_BY_SLOT, {'core_name': name})
+            stats['substitute_rows'] += len(rows)
+            yield 'substitute', name, rows
+            if not rows:
+                # 空结果也写入，在线时查表即可确定“无兜底候选”，不必再访问数据库
+                yield 'substitute_role_tag', name, run(session, SUBSTITUTE_BY_ROLE_TAG, {'core_name': name})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Materialize team recommendation / substitute table')
+    parser.add_argument('--out', default=DEFAULT_TEAM_TABLE_PATH, help='output sqlite path')
+    args = parser.parse_args()
+
+    neo4j_uri = os.environ.get('NEO4J_URI')
+    neo4j_user = os.environ.get('NEO4J_USER')
+    neo4j_password = os.environ.get('NEO4J_PASSWORD')
+    if not (neo4j_uri and neo4j_user and neo4j_password):
+        print('请先设置环境变量 NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD')
+        sys.exit(1)
+
+    print('连接 Neo4j...')
+    kg = GenshinKnowledgeGraph()
+    if not kg.connect(neo4j_uri, neo4j_user, neo4j_password):
+        print('无法连接 Neo4j')
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    t0 = time.perf_counter()
+    stats = {'team_rows': 0, 'substitute_rows': 0}
+    table = TeamTable(args.out)
+    fingerprint = graph_fingerprint(kg.driver)
+    counts = table.write(iter_entries(kg.driver, stats),
+                         meta={'team_recommend_k': TEAM_RECOMMEND_K, 'team_recommend_topn': TEAM_RECOMMEND_TOPN,
+                               'graph_fingerprint': fingerprint})
+    kg.close()
+
+    print(f'已写入 {args.out}（耗时 {time.perf_counter() - t0:.1f}s，图谱指纹 {fingerprint}）')
+    for kind, n in counts.items():
+        print(f'  {kind}: {n} 个角色')
+    print(f'  配队结果行: {stats["team_rows"]}，替代结果行: {stats["substitute_rows"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""mock_llm_server.py — 本地 OpenAI 兼容模拟服务（无网络的问答基准测试/CI 使用）
+
+用途:
+- 提供 POST /v1/chat/completions 与 GET /v1/models，返回 OpenAI 格式的响应。
+- 指定 --store 时，先按请求哈希（与 modules/llm_transport.py 相同）从录制存档里取响应；
+  未命中则返回确定性的占位回答：生成 Cypher 的请求（按最后一条用户消息判断）返回一条固定的合法 Cypher，
+  其余请求返回固定文本。
+- --latency-ms / --jitter-ms 模拟 LLM 延迟，便于在稳定的 LLM 耗时下度量数据库/流水线优化的收益。
+
+用法:
+        python scripts/mock_llm_server.py --port 8001 --store tests/llm_cassette.jsonl --latency-ms 800
+        OPENAI_API_KEY=mock OPENAI_API_BASE=http://127.0.0.1:8001/v1 python scripts/eval_rag.py --testset ...
+
+参数:
+    --host / --port   监听地址（默认 127.0.0.1:8001）
+    --store           可选，录制存档（JSONL）
+    --latency-ms      每次请求的模拟延迟（毫秒；"recorded" 表示使用存档中录制时的耗时）
+    --jitter-ms       延迟抖动幅度（±毫秒）
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from modules.llm_transport import LLMCassette, request_key
+from modules.token_budget import estimate_tokens
+from modules.qa_engine import CYPHER_QUESTION_TEMPLATE, CYPHER_REPAIR_TEMPLATE
+
+MOCK_CYPHER = "MATCH (c:character) RETURN c.name AS name LIMIT 20"
+MOCK_ANSWER = "这是模拟服务返回的回答。"
+# 生成/修正 Cypher 的请求：最后一条用户消息以这两个模板的结尾收尾（系统提示词里也会出现“Cypher”，不能据此判断）
+CYPHER_REQUEST_SUFFIXES = (CYPHER_QUESTION_TEMPLATE.rsplit('}', 1)[-1], CYPHER_REPAIR_TEMPLATE.rsplit('}', 1)[-1])
+
+
+def is_cypher_request(messages):
+    """按最后一条用户消息判断是否为生成 Cypher 的阶段"""
+    for m in reversed(messages or []):
+        if isinstance(m, dict) and m.get('role') == 'user':
+            content = str(m.get('content') or '').rstrip()
+            return any(content.endswith(suffix.rstrip()) for suffix in CYPHER_REQUEST_SUFFIXES)
+    return False
+
+
+def mock_completion(payload):
+    """未命中存档时的确定性占位响应"""
+    messages = payload.get('messages') or []
+    prompt = "\n".join(str(m.get('content') or '') for m in messages if isinstance(m, dict))
+    content = MOCK_CYPHER if is_cypher_request(messages) else MOCK_ANSWER
+    prompt_tokens, completion_tokens = estimate_tokens(prompt), estimate_tokens(content)
+    return {
+        'id': 'chatcmpl-mock-' + request_key(payload)[:16],
+        'object': 'chat.completion',
+        'created': 0,
+        'model': payload.get('model') or 'mock',
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    cassette = None
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+    # ThreadingHTTPServer 每个请求一个线程，计数与读取都要加锁
+    stats = {'requests': 0, 'hits': 0}
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self, rec):
+        if self.latency_ms == 'recorded':
+            base = float((rec or {}).get('elapsed_ms') or 0.0)
+        else:
+            base = float(self.latency_ms or 0.0)
+        if self.jitter_ms:
+            with self.rng_lock:
+                base += self.rng.uniform(-self.jitter_ms, self.jitter_ms)
+        if base > 0:
+            time.sleep(base / 1000.0)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+        elif self.path.rstrip('/').endswith('/stats'):
+            with self.stats_lock:
+                snapshot = dict(self.stats)
+            self._send_json(200, snapshot)
+        else:
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except Exception as e:
+            self._send_json(400, {'error': {'message': f'invalid json: {e}'}})
+            return
+        if payload.get('stream'):
+            self._send_json(400, {'error': {'message': 'stream is not supported by the mock server'}})
+            return
+
+        rec = self.cassette.get(request_key(payload)) if self.cassette is not None else None
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            if rec is not None:
+                self.stats['hits'] += 1
+        self._delay(rec)
+        self._send_json(200, rec['response'] if rec is not None else mock_completion(payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenAI-compatible mock server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--store', default=None, help='recorded cassette (jsonl)')
+    parser.add_argument('--latency-ms', default='0', help='simulated latency in ms, or "recorded"')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='latency jitter (+/- ms)')
+    args = parser.parse_args()
+
+    MockLLMHandler.cassette = LLMCassette(args.store) if args.store else None
+    MockLLMHandler.latency_ms = args.latency_ms if args.latency_ms == 'recorded' else float(args.latency_ms)
+    MockLLMHandler.jitter_ms = args.jitter_ms
+
+    server = ThreadingHTTPServer((args.host, args.port), MockLLMHandler)
+    server.daemon_threads = True
+    loaded = len(MockLLMHandler.cassette) if MockLLMHandler.cassette is not None else 0
+    print(f'模拟 LLM 服务已启动: http://{args.host}:{args.port}/v1（存档 {loaded} 条，延迟 {args.latency_ms}ms）')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
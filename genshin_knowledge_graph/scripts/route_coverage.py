@@ -0,0 +1,92 @@
+"""route_coverage.py — 规则路由覆盖率报告
+
+用途:
+- 统计测试集中有多少问题能被规则路由（替代/配队硬规则 + 意图目录）直接命中，从而绕过 LLM 生成 Cypher。
+- 按意图输出命中分布，并列出未命中的样例问题，方便继续扩充意图目录。
+
+用法:
+        python scripts/route_coverage.py --testset tests/generated_testset_artifact_qs.jsonl --out tests/route_coverage.json
+
+参数:
+    --testset       输入 JSONL 测试集（每行至少包含 question 字段）
+    --entities-dir  实体 JSON 目录，用于离线构建实体链接器（默认: ../data_preprocess/dataKG/entities）
+    --out           可选，输出 JSON 报告路径
+
+注意:
+- 本脚本不连接数据库、不调用 LLM，只做路由层的离线统计。
+"""
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from modules.entity_linker import EntityLinker
+from modules.qa_engine import route_by_rules
+
+DEFAULT_ENTITIES_DIR = os.path.join(os.path.dirname(ROOT), 'data_preprocess', 'dataKG', 'entities')
+
+
+def read_jsonl(path):
+    data = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                data.append(json.loads(line))
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rule-router coverage report')
+    parser.add_argument('--testset', default='tests/generated_testset_artifact_qs.jsonl', help='input jsonl file')
+    parser.add_argument('--entities-dir', default=DEFAULT_ENTITIES_DIR, help='entity json directory')
+    parser.add_argument('--out', default=None, help='output report json')
+    args = parser.parse_args()
+
+    linker = EntityLinker.from_json_dir(args.entities_dir)
+    items = read_jsonl(args.testset)
+
+    by_intent = Counter()
+    rule_errors = []
+    unrouted = []
+    for item in items:
+        question = item.get('question') or ''
+        plan = route_by_rules(question, linker)
+        if plan is None:
+            unrouted.append(question)
+        elif plan.get('error'):
+            rule_errors.append(question)
+        else:
+            by_intent[plan['intent']] += 1
+
+    total = len(items)
+    routed = sum(by_intent.values())
+    report = {
+        'total': total,
+        'routed': routed,
+        'coverage': routed / total if total else 0.0,
+        'rule_errors': len(rule_errors),
+        'llm_fallback': len(unrouted),
+        'by_intent': dict(by_intent.most_common()),
+        'unrouted_samples': unrouted[:20],
+    }
+
+    print(f"总问题数: {total}")
+    print(f"规则路由命中（绕过LLM）: {routed} ({report['coverage']:.1%})")
+    print(f"规则命中但抽取失败: {len(rule_errors)}")
+    print(f"需走LLM: {len(unrouted)}")
+    for intent, n in by_intent.most_common():
+        print(f"  - {intent}: {n}")
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'报告已写入 {args.out}')
+
+
+if __name__ == '__main__':
+    main()
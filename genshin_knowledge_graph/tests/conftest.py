@@ -0,0 +1,100 @@
+"""
+测试公共夹具：不连接 Neo4j、不调用 LLM，实体词典用一小份手写记录
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.entity_linker import EntityLinker  # noqa: E402
+
+ENTITY_RECORDS = [
+    {"label": "character", "name": "胡桃", "nickname": ["堂主"]},
+    {"label": "character", "name": "钟离", "nickname": "帝君、岩王帝君"},
+    {"label": "character", "name": "神里绫华", "nickname": ["绫华"]},
+    {"label": "character", "name": "行秋"},
+    {"label": "character", "name": "夜兰"},
+    {"label": "weapon", "name": "护摩之杖", "aliases": ["护摩"]},
+    {"label": "weapon", "name": "天空之翼"},
+    {"label": "artifact", "name": "炽烈的炎之魔女", "aliases": ["魔女套"]},
+    {"label": "material", "name": "冰雾花"},
+    {"label": "monster", "name": "丘丘人"},
+    {"label": "country", "name": "璃月"},
+    {"label": "element", "name": "火"},
+]
+
+
+@pytest.fixture(scope="session")
+def linker():
+    return EntityLinker().add_records(ENTITY_RECORDS)
+
+
+class FakeLLM:
+    """OpenAI 兼容的假客户端：client.chat.completions.create(**kwargs)，回答由 reply(kwargs) 给出，记录每次调用"""
+
+    def __init__(self, reply=None):
+        self.reply = reply or (lambda kwargs: "MATCH (c:character) RETURN c.name AS name LIMIT 20")
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        message = SimpleNamespace(content=self.reply(kwargs))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class FakeDriver:
+    """Neo4j driver 的替身：session().run(query, params) 的结果行由 rows(query_text, params) 给出，记录执行过的查询"""
+
+    def __init__(self, rows=None):
+        self.rows = rows or (lambda query, params: [])
+        self.queries = []
+
+    def session(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, params=None, **kwargs):
+        text = getattr(query, "text", query)
+        self.queries.append(text)
+        return FakeResult(self.rows(text, params or kwargs))
+
+
+class FakeResult(list):
+    def consume(self):
+        return None
+
+
+@pytest.fixture
+def fake_driver():
+    return FakeDriver
+
+
+@pytest.fixture
+def make_engine(linker, tmp_path):
+    """不连数据库的问答引擎：本地文件都放到临时目录，LLM 用 FakeLLM"""
+    from modules.qa_engine import KGQAEngine, QAConfig
+
+    def make(llm=None, driver=None, **config):
+        config.setdefault("dynamic_schema_prompt", False)
+        config.setdefault("answer_memo_path", None)
+        config.setdefault("team_table_path", str(tmp_path / "team_table.sqlite"))
+        config.setdefault("text_index_path", str(tmp_path / "text_index"))
+        config.setdefault("faq_path", str(tmp_path / "faq_cache.json"))
+        return KGQAEngine(config=QAConfig(model_id="test-model", **config), driver=driver, llm_client=llm,
+                          entity_linker=linker)
+    return make
+
+
+@pytest.fixture
+def fake_llm():
+    return FakeLLM
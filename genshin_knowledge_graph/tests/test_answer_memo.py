@@ -0,0 +1,86 @@
+import time
+
+from modules.answer_memo import AnswerMemo, memo_key, result_hash
+
+
+def test_result_hash_ignores_key_order_but_not_row_order():
+    a = [{"name": "胡桃", "element": "火"}, {"name": "钟离", "element": "岩"}]
+    b = [{"element": "火", "name": "胡桃"}, {"element": "岩", "name": "钟离"}]
+    assert result_hash(a) == result_hash(b)
+    assert result_hash(a) != result_hash(list(reversed(a)))
+
+
+def test_memo_key_depends_on_stage_intent_prompt_and_model():
+    rows = [{"c": 1}]
+    base = memo_key("answer", "COUNTRY_CHARACTER_COUNT", rows, "p1", "m1")
+    assert base == memo_key("answer", "COUNTRY_CHARACTER_COUNT", rows, "p1", "m1")
+    assert len({base,
+                memo_key("team", "COUNTRY_CHARACTER_COUNT", rows, "p1", "m1"),
+                memo_key("answer", None, rows, "p1", "m1"),
+                memo_key("answer", "COUNTRY_CHARACTER_COUNT", rows, "p2", "m1"),
+                memo_key("answer", "COUNTRY_CHARACTER_COUNT", rows, "p1", "m2")}) == 5
+
+
+def test_hit_and_graph_version_invalidation(tmp_path):
+    memo = AnswerMemo(str(tmp_path / "memo.sqlite"))
+    memo.put("k", "v1", "回答")
+    assert memo.get("k", "v1") == "回答"
+    # 图谱版本变了：旧回答删除并视为未命中
+    assert memo.get("k", "v2") is None
+    assert memo.get("k", "v1") is None
+    assert len(memo) == 0
+    report = memo.report()
+    assert report["hits"] == 1 and report["stale"] == 1 and report["misses"] == 2
+
+
+def test_persists_across_instances(tmp_path):
+    path = str(tmp_path / "memo.sqlite")
+    AnswerMemo(path).put("k", "v1", "回答")
+    assert AnswerMemo(path).get("k", "v1") == "回答"
+
+
+def test_empty_answer_not_stored(tmp_path):
+    memo = AnswerMemo(str(tmp_path / "memo.sqlite"))
+    memo.put("k", "v1", "")
+    assert len(memo) == 0
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    memo = AnswerMemo(str(tmp_path / "memo.sqlite"), max_entries=10)
+    for i in range(10):
+        memo.put(f"k{i}", "v1", f"a{i}")
+        time.sleep(0.001)
+    # 最早写入的 k0 刚被用过，不应被淘汰
+    assert memo.get("k0", "v1") == "a0"
+    memo.put("k10", "v1", "a10")
+    # 超出容量：淘汰到 90%（9 条），删掉最久未用的 k1、k2
+    assert len(memo) == 9
+    assert memo.get("k0", "v1") == "a0"
+    assert memo.get("k1", "v1") is None and memo.get("k2", "v1") is None
+    assert memo.get("k10", "v1") == "a10"
+
+
+def _echo_question(kwargs):
+    """回答里带上问题原文：问题不同回答就不同"""
+    return "回答：" + kwargs["messages"][-1]["content"].rsplit("用户问题：", 1)[-1]
+
+
+ROWS = [{"name": "胡桃", "birthday": "7月15日", "country": "璃月", "element": "火"}]
+
+
+def test_llm_planned_questions_do_not_share_answers(make_engine, fake_llm, tmp_path):
+    llm = fake_llm(_echo_question)
+    engine = make_engine(llm, answer_memo_path=str(tmp_path / "memo.sqlite"), render_row_threshold=0)
+    for intent in ("llm", None, "text_search"):
+        first = engine._render_generic_answer("胡桃的生日", ROWS, intent=intent)
+        second = engine._render_generic_answer("胡桃是哪国的", ROWS, intent=intent)
+        assert first == "回答：胡桃的生日" and second == "回答：胡桃是哪国的"
+    assert len(engine.answer_memo) == 0
+
+
+def test_catalogue_intent_reuses_answer(make_engine, fake_llm, tmp_path):
+    llm = fake_llm(_echo_question)
+    engine = make_engine(llm, answer_memo_path=str(tmp_path / "memo.sqlite"), render_row_threshold=0)
+    first = engine._render_generic_answer("胡桃的详细信息是什么？", ROWS, intent="character_info")
+    again = engine._render_generic_answer("介绍一下胡桃", ROWS, intent="character_info")
+    assert again == first and len(llm.calls) == 1
@@ -0,0 +1,95 @@
+from modules import answer_renderers as ar
+from modules.answer_renderers import MAX_TABLE_COLUMNS, render_rows
+
+
+def _winner(rows, intent=None):
+    for renderer in ar.RENDERERS:
+        if renderer(rows, intent):
+            return renderer.__name__
+    return None
+
+
+def test_attribute_value():
+    rows = [{"name": "胡桃", "attribute": "生日", "value": "7月15日"}]
+    assert render_rows(rows) == "胡桃 的生日是：7月15日。"
+    assert _winner(rows) == "render_attribute_value"
+    assert render_rows([{"name": "胡桃", "attribute": "称号", "value": None}]) == "知识图谱中没有记录 胡桃 的称号。"
+
+
+def test_material_sources_table_beats_generic_table():
+    rows = [{"material": "霓裳花", "source": "璃月野外采集", "dropped_by": []},
+            {"material": "史莱姆凝液", "source": "史莱姆", "dropped_by": None}]
+    out = render_rows(rows)
+    assert _winner(rows) == "render_material_sources"
+    assert out.splitlines()[0] == "| 材料 | 来源 | 掉落怪物 |"
+    assert out.splitlines()[2:] == ["| 霓裳花 | 璃月野外采集 | - |", "| 史莱姆凝液 | 史莱姆 | - |"]
+
+
+def test_name_list_uses_intent_template():
+    rows = [{"weapon": "护摩之杖", "characters": ["胡桃", "香菱", ""]}]
+    assert render_rows(rows, intent="weapon_characters") == "适合武器「护摩之杖」的角色：胡桃、香菱"
+    assert render_rows(rows) == "**护摩之杖** 的角色：胡桃、香菱"
+    assert _winner(rows, "weapon_characters") == "render_name_list"
+    assert render_rows([{"weapon": "护摩之杖", "characters": []}]) == "**护摩之杖** 的角色：暂无记录"
+
+
+def test_name_list_truncates_long_lists():
+    items = [f"角色{i}" for i in range(ar.MAX_LIST_ITEMS + 5)]
+    out = render_rows([{"country": "蒙德", "characters": items}], intent="country_characters")
+    assert out.endswith(f"等{len(items)}项")
+    assert f"角色{ar.MAX_LIST_ITEMS}" not in out
+
+
+def test_grouped_counts():
+    rows = [{"country": "蒙德", "character_count": 12}, {"country": "璃月", "character_count": 14}]
+    assert _winner(rows) == "render_grouped_counts"
+    assert render_rows(rows) == "按国家统计的角色数量如下：\n- 蒙德：12\n- 璃月：14"
+
+
+def test_grouped_counts_ignores_booleans():
+    rows = [{"name": "胡桃", "flag": True}, {"name": "钟离", "flag": False}]
+    assert _winner(rows) == "render_table"
+
+
+def test_single_column_dedupes_and_skips_empty():
+    rows = [{"name": "胡桃"}, {"name": "钟离"}, {"name": "胡桃"}, {"name": None}]
+    assert _winner(rows) == "render_single_column"
+    assert render_rows(rows) == "查询到的名称：胡桃、钟离"
+
+
+def test_table_for_homogeneous_scalar_rows():
+    rows = [{"name": "胡桃", "element": "火"}, {"name": "钟离", "element": "岩"}]
+    assert render_rows(rows) == "| 名称 | 元素 |\n| --- | --- |\n| 胡桃 | 火 |\n| 钟离 | 岩 |"
+
+
+def test_wide_rows_bail_out_to_llm():
+    wide = [{f"c{i}": i for i in range(MAX_TABLE_COLUMNS + 1)} for _ in range(2)]
+    assert render_rows(wide) is None
+    narrow = [{f"c{i}": i for i in range(MAX_TABLE_COLUMNS)} for _ in range(2)]
+    assert _winner(narrow) == "render_table"
+
+
+def test_max_rows_bail_out_to_llm():
+    rows = [{"name": f"角色{i}"} for i in range(5)]
+    assert render_rows(rows, max_rows=4) is None
+    assert render_rows(rows, max_rows=5) is not None
+
+
+def test_unrecognised_shapes_return_none():
+    assert render_rows([]) is None
+    assert render_rows([{}]) is None
+    assert render_rows(["胡桃"]) is None
+    assert render_rows([{"name": "胡桃"}, {"element": "火"}]) is None
+
+
+def test_text_passages_only_for_text_search_intent():
+    rows = [{"character": "胡桃", "source": "角色故事", "title": "故事1", "text": "往生堂第七十七代堂主"}]
+    assert render_rows(rows, intent="text_search") == "在角色文本中找到以下相关内容：\n- **胡桃·角色故事·故事1**：往生堂第七十七代堂主"
+    assert _winner(rows) == "render_attribute_card"
+
+
+def test_same_cv_pairs_are_grouped():
+    rows = [{"character1": "胡桃", "character2": "七七", "cn_CV": "X"},
+            {"character1": "七七", "character2": "可莉", "cn_CV": "X"}]
+    assert render_rows(rows) == "这些角色的中文配音演员相同，我按配音演员分组整理如下：\n- **X**：七七、可莉、胡桃"
+    assert _winner(rows, "same_cv_of_character") != "render_by_cn_cv"
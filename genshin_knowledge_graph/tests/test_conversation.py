@@ -0,0 +1,119 @@
+import pytest
+
+from modules.conversation import ConversationContext, _find_pronoun
+from modules.qa_engine import route_by_rules
+
+PREV = "胡桃的详细信息是什么？"
+
+
+@pytest.fixture
+def ctx():
+    ctx = ConversationContext()
+    ctx.add_turn(PREV, PREV, {"intent": "character_info", "params": {"name": "胡桃"}}, "胡桃", "MATCH ...",
+                 [{"name": "胡桃", "birthday": "7月15日"}])
+    return ctx
+
+
+@pytest.fixture
+def resolve(ctx, linker):
+    can_route = lambda q: route_by_rules(q, linker) is not None
+    return lambda q: ctx.resolve(q, linker, can_route=can_route)
+
+
+@pytest.mark.parametrize("question", [
+    # 带其它实体的完整问题（文本检索 / LLM 问题）不改写
+    "钟离的故事是什么？",
+    "钟离和胡桃谁更强？",
+    # 不需要实体、本身就能路由的问题不加前缀
+    "什么角色的中文配音演员相同？",
+    "有哪些国家？每个国家有多少角色？",
+    # “应该”里的“该”不是代词
+    "应该带什么武器",
+    # 没有追问口吻、也没有代词的无实体问题原样交给后续环节
+    "原神里最强的角色是谁",
+    "其他角色有哪些",
+])
+def test_standalone_questions_are_not_rewritten(resolve, question):
+    assert resolve(question) == question
+
+
+def test_entity_only_follow_up_reuses_previous_question(resolve):
+    assert resolve("那钟离呢？") == "钟离的详细信息是什么？"
+    assert resolve("钟离呢") == "钟离的详细信息是什么？"
+
+
+def test_pronouns_are_replaced(resolve):
+    assert resolve("那她的生日呢？") == "胡桃的生日"
+    assert resolve("她用什么武器") == "胡桃用什么武器"
+    # 已带实体的问题不做代词替换
+    assert resolve("钟离和她是什么关系") == "钟离和她是什么关系"
+    assert resolve("和她是什么关系") == "和胡桃是什么关系"
+
+
+def test_elliptical_question_gets_previous_entity_when_routable(resolve):
+    assert resolve("那生日呢") == "胡桃的生日"
+    # 有追问口吻，但补全后也无法规则路由：原样返回
+    assert resolve("那故事呢") == "那故事呢"
+
+
+def test_refinement_of_previous_question(linker):
+    ctx = ConversationContext()
+    prev = "神里绫华什么突破材料"
+    ctx.add_turn(prev, prev, {"intent": "character_materials", "params": {"name": "神里绫华"}}, "神里绫华", None, [])
+    can_route = lambda q: route_by_rules(q, linker) is not None
+    assert ctx.resolve("对应的来源是什么？", linker, can_route) == "神里绫华什么突破材料对应的来源是什么"
+
+
+def test_no_context_or_no_router(linker):
+    assert ConversationContext().resolve("她的生日", linker) == "她的生日"
+    ctx = ConversationContext()
+    ctx.add_turn(PREV, PREV, None, "胡桃", None, None)
+    # 不传 can_route 时只做代词替换与“实体 + 口语首尾”
+    assert ctx.resolve("那生日呢", linker) == "那生日呢"
+    assert ctx.resolve("她的生日", linker) == "胡桃的生日"
+
+
+@pytest.mark.parametrize("text, found", [
+    ("她的生日", (0, 1)),
+    ("和他什么关系", (1, 2)),
+    ("该角色的生日", (0, 3)),
+    ("她们是谁", (0, 2)),
+    ("应该带什么武器", None),
+    ("其他的角色", None),
+    ("其实我想问", None),
+    ("吉他的", None),
+])
+def test_pronoun_word_boundaries(text, found):
+    assert _find_pronoun(text) == found
+
+
+def test_find_rows_reuses_cached_attribute(ctx):
+    plan = {"intent": "character_attribute", "cypher": "MATCH ...",
+            "params": {"name": "胡桃", "attribute": "生日", "prop": "birthday"}}
+    hit = ctx.find_rows(plan)
+    assert hit["exact"] is False
+    assert hit["rows"] == [{"name": "胡桃", "attribute": "生日", "value": "7月15日"}]
+    assert ctx.find_rows(dict(plan, source="llm")) is None
+
+
+def test_engine_routes_follow_up_once_and_traces_cache_hit(make_engine, fake_driver, monkeypatch):
+    driver = fake_driver(lambda query, params: [] if query.startswith(("CALL", "EXPLAIN"))
+                         else [{"name": "胡桃", "birthday": "7月15日"}])
+    engine = make_engine(driver=driver)
+    routed = []
+    route = engine._route_without_llm
+    monkeypatch.setattr(engine, "_route_without_llm", lambda q: routed.append(q) or route(q))
+    conversation = ConversationContext()
+
+    engine.ask(PREV, conversation)
+    assert routed == [PREV]
+    assert [s["name"] for s in engine.last_trace()].count("qa.plan") == 1
+    executed = len(driver.queries)
+
+    cypher, rows, answer = engine.ask("那她的生日呢？", conversation)
+    # 追问只路由一次，并且直接用上一轮的结果行作答
+    assert routed == [PREV, "胡桃的生日"]
+    assert len(driver.queries) == executed
+    assert rows == [{"name": "胡桃", "attribute": "生日", "value": "7月15日"}] and "7月15日" in answer
+    plan_spans = [s for s in engine.last_trace() if s["name"] == "qa.plan"]
+    assert len(plan_spans) == 1 and plan_spans[0]["attributes"]["conversation_cache"] is True
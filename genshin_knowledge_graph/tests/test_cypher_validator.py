@@ -0,0 +1,50 @@
+from modules.cypher_validator import SchemaSnapshot, validate_cypher
+
+STRICT = SchemaSnapshot(
+    {"character": ["name", "birthday", "cn_CV"], "weapon": ["name", "type"]},
+    ["suits_weapon"],
+    {"suits_weapon": ["priority"]},
+    strict=True,
+)
+
+
+def test_valid_query_passes():
+    cypher = ("MATCH (c:character {name: '胡桃'})-[r:suits_weapon]->(w:weapon) "
+              "RETURN c.name, w.name ORDER BY r.priority LIMIT 20")
+    assert validate_cypher(cypher, STRICT) == []
+
+
+def test_unknown_label_relationship_and_property():
+    problems = validate_cypher(
+        "MATCH (c:Character)-[:likes]->(w:weapon) WHERE w.attack > 1 RETURN c.name LIMIT 5", STRICT)
+    assert "图谱中不存在节点标签 :Character" in problems
+    assert "图谱中不存在关系类型 :likes" in problems
+    assert "节点 w:weapon 没有属性 attack" in problems
+    assert validate_cypher("MATCH (c:character {nickname: 'x'}) RETURN c.name LIMIT 1", STRICT) == [
+        "节点 :character 没有属性 nickname"]
+
+
+def test_manual_schema_does_not_check_relationship_types():
+    # 手工 Schema 不穷举角色之间的关系谓词
+    assert validate_cypher("MATCH (a:character)-[:朋友]->(b:character) RETURN b.name LIMIT 5") == []
+
+
+def test_string_literals_are_ignored():
+    assert validate_cypher("MATCH (c:character) WHERE c.name = '(x:Foo) DELETE' RETURN c.name LIMIT 1") == []
+
+
+def test_write_operations_are_rejected():
+    problems = validate_cypher("MATCH (c:character) DETACH DELETE c")
+    assert any("只读" in p for p in problems)
+
+
+def test_var_length_needs_small_upper_bound():
+    assert any("没有跳数上界" in p for p in validate_cypher("MATCH (a:character)-[*]-(b) RETURN b.name LIMIT 5"))
+    assert any("跳数上界过大" in p for p in validate_cypher("MATCH (a:character)-[*1..9]-(b) RETURN b.name LIMIT 5"))
+    assert validate_cypher("MATCH (a:character)-[*1..3]-(b) RETURN b.name LIMIT 5") == []
+
+
+def test_parameters_must_be_provided():
+    cypher = "MATCH (c:character {name: $name}) RETURN c.name LIMIT 1"
+    assert any("$name" in p for p in validate_cypher(cypher))
+    assert validate_cypher(cypher, params={"name": "胡桃"}) == []
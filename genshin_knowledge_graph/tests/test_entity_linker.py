@@ -0,0 +1,64 @@
+from modules.entity_linker import AhoCorasick, EntityLinker
+
+
+def test_automaton_reports_overlapping_matches():
+    ac = AhoCorasick()
+    for word in ["he", "she", "his", "hers"]:
+        ac.add(word, word)
+    found = sorted((start, end, word) for start, end, word in ac.iter_matches("ushers"))
+    assert found == [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")]
+
+
+def test_link_canonical_names_and_aliases(linker):
+    spans = linker.link("堂主和护摩之杖")
+    assert [(s["text"], s["label"], s["name"]) for s in spans] == [
+        ("堂主", "character", "胡桃"), ("护摩之杖", "weapon", "护摩之杖")]
+    assert spans[1]["start"] == 3 and spans[1]["end"] == 7
+
+
+def test_longest_match_wins(linker):
+    # “护摩”是“护摩之杖”的别名，重叠时取最长匹配
+    assert [s["text"] for s in linker.link("护摩之杖适合哪些角色")] == ["护摩之杖"]
+    assert [s["name"] for s in linker.link("神里绫华什么突破材料")] == ["神里绫华"]
+
+
+def test_nickname_string_is_split(linker):
+    assert linker.first("岩王帝君的生日", "character") == "钟离"
+    assert linker.first("帝君的生日", "character") == "钟离"
+
+
+def test_element_needs_suffix(linker):
+    # 单字元素名只通过“X元素”命中，避免“火锅”之类误判
+    assert linker.link("火锅好吃吗") == []
+    assert linker.first("火元素角色有哪些", "element") == "火"
+
+
+def test_label_filter_and_missing_entity(linker):
+    assert linker.first("护摩之杖适合谁", "character") is None
+    assert linker.link("护摩之杖", labels=["character"]) == []
+
+
+def test_ambiguous_alias_prefers_canonical_then_label_priority():
+    linker = EntityLinker().add_records([
+        {"label": "weapon", "name": "雾切", "aliases": ["雾切之回光"]},
+        {"label": "material", "name": "雾切之回光"},
+        {"label": "monster", "name": "雷萤"},
+        {"label": "material", "name": "萤", "aliases": ["雷萤"]},
+    ])
+    assert linker.first("雾切之回光", "weapon") is None
+    assert linker.link("雾切之回光")[0]["label"] == "material"
+    assert linker.link("雷萤")[0]["label"] == "monster"
+
+
+def test_single_char_names_need_allow_list():
+    linker = EntityLinker().add_records([
+        {"label": "monster", "name": "龙"},
+        {"label": "material", "name": "盐"},
+        {"label": "character", "name": "魈"},
+        {"label": "character", "name": "申鹤"},
+    ])
+    # 单字规范名不会在更长的词里误命中，也不会抢走最长匹配
+    assert linker.link("龙脊雪山有什么怪") == []
+    assert [s["name"] for s in linker.link("申鹤的盐焗料理")] == ["申鹤"]
+    # 白名单里的单字角色仍然可以链接
+    assert linker.first("魈的突破材料", "character") == "魈"
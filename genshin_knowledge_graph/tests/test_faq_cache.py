@@ -0,0 +1,137 @@
+import json
+import threading
+
+from modules.faq_cache import FAQCache, faq_path_for, fingerprint_of, normalize_question
+
+
+class Graph:
+    """可变的假图谱版本 + 计数的答案函数"""
+
+    def __init__(self):
+        self.version = "v1-r1"
+        self.calls = []
+
+    def answer(self, question):
+        self.calls.append(question)
+        return "MATCH (n) RETURN n.name AS name LIMIT 20", [{"name": question}], f"{question}@{self.version}"
+
+
+def make_cache(tmp_path, graph, questions=("胡桃的详细信息是什么？", "护摩之杖适合哪些角色")):
+    faq = FAQCache(str(tmp_path / "faq.json"), list(questions), version_fn=lambda: graph.version,
+                   check_interval_s=3600)
+    faq._answer_fn = graph.answer
+    return faq
+
+
+def test_normalize_question_and_fingerprint():
+    assert normalize_question("  胡桃的详细信息是什么？ ") == "胡桃的详细信息是什么"
+    assert fingerprint_of("abc123-r2") == "abc123"
+    assert fingerprint_of(None) is None
+
+
+def test_refresh_computes_then_reuses(tmp_path):
+    graph = Graph()
+    faq = make_cache(tmp_path, graph)
+    assert faq.refresh() == {"computed": 2, "reused": 0, "failed": 0}
+    assert faq.get("胡桃的详细信息是什么")["answer"] == "胡桃的详细信息是什么@v1-r1"
+    assert faq.get("没有预计算的问题") is None
+    # 版本没变：不再调用答案函数
+    assert faq.refresh() == {"computed": 0, "reused": 2, "failed": 0}
+    assert len(graph.calls) == 2
+
+
+def test_version_change_invalidates(tmp_path):
+    graph = Graph()
+    faq = make_cache(tmp_path, graph)
+    faq.refresh()
+    graph.version = "v2-r1"
+    assert faq.refresh()["computed"] == 2
+    assert faq.get("护摩之杖适合哪些角色？")["answer"] == "护摩之杖适合哪些角色@v2-r1"
+    # 文件里只保留当前版本
+    data = json.loads((tmp_path / "faq.json").read_text(encoding="utf-8"))
+    assert {a["version"] for a in data["answers"].values()} == {"v2-r1"}
+
+
+def test_reload_from_file_reuses_same_version(tmp_path):
+    graph = Graph()
+    make_cache(tmp_path, graph).refresh()
+    reloaded = make_cache(tmp_path, graph)
+    assert reloaded.refresh() == {"computed": 0, "reused": 2, "failed": 0}
+    graph.version = "v2-r1"
+    assert make_cache(tmp_path, graph).refresh()["computed"] == 2
+
+
+def test_failed_answers_are_not_cached(tmp_path):
+    faq = FAQCache(str(tmp_path / "faq.json"), ["坏问题"], version_fn=lambda: "v1")
+    faq._answer_fn = lambda q: (None, "查询失败", None)
+    assert faq.refresh() == {"computed": 0, "reused": 0, "failed": 1}
+    assert faq.get("坏问题") is None
+
+
+def test_concurrent_saves_do_not_collide(tmp_path):
+    graph = Graph()
+    caches = [make_cache(tmp_path, graph, questions=[f"问题{i}"]) for i in range(8)]
+    for faq in caches:
+        faq.refresh()
+    errors = []
+
+    def save(faq):
+        try:
+            for _ in range(20):
+                faq._save()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(faq,)) for faq in caches]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    json.loads((tmp_path / "faq.json").read_text(encoding="utf-8"))
+    assert [p.name for p in tmp_path.iterdir()] == ["faq.json"]
+
+
+class EmptyGraph:
+    """没有任何标签/关系的假 driver（只够算图谱版本）"""
+
+    def session(self, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, *args, **kwargs):
+        return []
+
+
+def test_faq_path_for():
+    assert faq_path_for("data/faq_cache.json", "ab12") == "data/faq_cache.ab12.json"
+
+
+def test_precompute_is_shared_and_headless(make_engine):
+    from modules.qa_engine import KGQAEngine
+
+    class SessionEngine(KGQAEngine):
+        def _report(self, level, message):
+            raise AssertionError("预计算不应调用会话引擎的 _report")
+
+    first = make_engine(driver=EmptyGraph())
+    first.__class__ = SessionEngine
+    second = make_engine(driver=EmptyGraph())
+    faq = first.start_faq_precompute(questions=[])
+    assert second.start_faq_precompute(questions=[]) is faq
+    faq._worker.join(5)
+    # 预计算跑在单独的无界面引擎上，不引用发起它的会话
+    worker = faq._answer_fn.__self__
+    assert type(worker) is KGQAEngine and worker is not first and worker is not second
+    assert worker.driver is first.driver and worker.config is not first.config
+
+    # 模型不同：不共用预计算答案
+    other = make_engine(driver=EmptyGraph(), stage_models={"answer": "another-model"})
+    other_faq = other.start_faq_precompute(questions=[])
+    assert other_faq is not faq and other_faq.path != faq.path
+    other_faq._worker.join(5)
@@ -0,0 +1,48 @@
+import itertools
+import math
+
+from modules.graph_layout import MIN_NODE_DISTANCE, compute_layout
+
+NAMES = ["胡桃", "钟离", "行秋", "夜兰", "神里绫华", "甘雨", "香菱", "班尼特", "温迪", "可莉"]
+EDGES = [("胡桃", "钟离"), ("胡桃", "行秋"), ("胡桃", "夜兰"), ("行秋", "香菱"), ("香菱", "班尼特"),
+         ("神里绫华", "甘雨"), ("温迪", "可莉"), ("钟离", "甘雨")]
+
+
+def test_empty_and_tiny_graphs():
+    assert compute_layout([], []) == {}
+    assert compute_layout(["胡桃"], []) == {"胡桃": (0.0, 0.0)}
+    two = compute_layout(["胡桃", "钟离"], [("胡桃", "钟离")])
+    assert set(two) == {"胡桃", "钟离"}
+    assert math.dist(two["胡桃"], two["钟离"]) >= MIN_NODE_DISTANCE - 1e-6
+
+
+def test_deterministic_and_order_independent():
+    first = compute_layout(NAMES, EDGES)
+    assert compute_layout(NAMES, EDGES) == first
+    # 节点与边的顺序、边的方向都不影响结果
+    reversed_edges = [(t, s) for s, t in reversed(EDGES)]
+    assert compute_layout(list(reversed(NAMES)) + ["胡桃"], reversed_edges) == first
+
+
+def test_center_pinned_at_origin():
+    layout = compute_layout(NAMES, EDGES, center="胡桃")
+    assert layout["胡桃"] == (0.0, 0.0)
+    # 不存在的中心节点被忽略
+    assert compute_layout(NAMES, EDGES, center="不存在") == compute_layout(NAMES, EDGES)
+
+
+def test_nodes_do_not_overlap():
+    for center in (None, "胡桃"):
+        layout = compute_layout(NAMES, EDGES, center=center)
+        closest = min(math.dist(layout[a], layout[b]) for a, b in itertools.combinations(NAMES, 2))
+        # 去重叠迭代轮数有限、坐标保留一位小数，留一点余量
+        assert closest >= MIN_NODE_DISTANCE * 0.95
+
+
+def test_connected_nodes_are_closer_than_unrelated_ones():
+    layout = compute_layout(NAMES, EDGES)
+    linked = sum(math.dist(layout[s], layout[t]) for s, t in EDGES) / len(EDGES)
+    pairs = [(a, b) for a, b in itertools.combinations(NAMES, 2)
+             if (a, b) not in EDGES and (b, a) not in EDGES]
+    unrelated = sum(math.dist(layout[a], layout[b]) for a, b in pairs) / len(pairs)
+    assert linked < unrelated
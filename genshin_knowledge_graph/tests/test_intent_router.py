@@ -0,0 +1,53 @@
+import pytest
+
+from modules.intent_router import INTENT_CATALOGUE, match_intent, split_compound_question
+
+
+@pytest.mark.parametrize("question, intent, params", [
+    ("胡桃的详细信息是什么？", "character_info", {"name": "胡桃"}),
+    ("胡桃的生日是哪天", "character_attribute", {"name": "胡桃", "attribute": "生日", "prop": "birthday"}),
+    ("神里绫华什么突破材料？", "character_materials", {"name": "神里绫华"}),
+    ("神里绫华的突破材料在哪里刷", "character_material_sources", {"name": "神里绫华"}),
+    ("胡桃适合什么武器", "character_weapons", {"name": "胡桃"}),
+    ("护摩之杖适合哪些角色？", "weapon_characters", {"name": "护摩之杖"}),
+    ("钟离和胡桃是什么关系", "character_relation", {"name": "钟离", "other": "胡桃"}),
+    ("什么角色的中文配音演员相同？", "same_cv_groups", {}),
+    ("有哪些国家？每个国家有多少角色？", "country_character_count", {}),
+    ("丘丘人掉落什么", "monster_drops", {"name": "丘丘人"}),
+    ("璃月有哪些角色", "country_characters", {"name": "璃月"}),
+    ("火元素有哪些角色", "element_characters", {"name": "火"}),
+])
+def test_match_intent(linker, question, intent, params):
+    plan = match_intent(question, linker)
+    assert plan is not None
+    assert plan["intent"] == intent
+    assert plan["params"] == params
+
+
+def test_exclude_words_and_missing_entities(linker):
+    # “武器类型”是角色属性，不是适配武器
+    assert match_intent("胡桃的武器类型", linker)["intent"] == "character_attribute"
+    # 缺少所需实体时不命中
+    assert match_intent("这把武器适合哪些角色", linker) is None
+    assert match_intent("", linker) is None
+    assert match_intent("钟离的故事是什么", linker) is None
+
+
+def test_catalogue_entries_are_well_formed():
+    names = [intent["name"] for intent in INTENT_CATALOGUE]
+    assert len(names) == len(set(names))
+    for intent in INTENT_CATALOGUE:
+        assert intent["cypher"].lstrip().upper().startswith("MATCH")
+        assert "LIMIT" in intent["cypher"]
+
+
+def test_split_compound_question(linker):
+    can_route = lambda q: match_intent(q, linker) is not None
+    # 对上一问的细化合并成一个问题，不再拆分
+    assert split_compound_question("神里绫华什么突破材料？对应的来源是什么？", linker, can_route) is None
+    # 没有实体的片段继承上一片段的实体
+    assert split_compound_question("胡桃的生日是哪天？用什么武器", linker, can_route) == [
+        "胡桃的生日是哪天", "胡桃用什么武器"]
+    subs = split_compound_question("胡桃的生日是哪天？另外钟离呢", linker, can_route)
+    assert subs == ["胡桃的生日是哪天", "钟离的生日是哪天"]
+    assert split_compound_question("胡桃的生日是哪天？", linker, can_route) is None
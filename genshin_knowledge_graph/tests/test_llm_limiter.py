@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from modules.llm_limiter import (FairLLMLimiter, LLMCancelled, LLMOverloaded, TokenBucket, current_llm_rate_limit,
+                                 llm_rate_limit)
+
+
+def test_token_bucket_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    t0 = time.monotonic()
+    assert bucket.acquire()
+    # 空桶后按 20 个/秒补充：下一个令牌约 50ms
+    assert 0.03 <= time.monotonic() - t0 < 0.5
+
+
+def test_token_bucket_acquire_timeout():
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.acquire()
+    t0 = time.monotonic()
+    assert bucket.acquire(timeout=0.05) is False
+    assert time.monotonic() - t0 < 0.5
+
+
+def test_call_rate_limit_is_scoped_to_context():
+    bucket = TokenBucket(rate=5)
+    seen = {}
+
+    def other_thread():
+        seen["other"] = current_llm_rate_limit()
+
+    with llm_rate_limit(bucket):
+        assert current_llm_rate_limit() is bucket
+        # 新线程不继承调用方的限速（其它请求不受影响）
+        t = threading.Thread(target=other_thread)
+        t.start()
+        t.join()
+        with llm_rate_limit(None):
+            assert current_llm_rate_limit() is None
+        assert current_llm_rate_limit() is bucket
+    assert current_llm_rate_limit() is None
+    assert seen["other"] is None
+
+
+def test_fair_limiter_rotates_sessions():
+    limiter = FairLLMLimiter(max_concurrency=1, max_wait_s=2.0)
+    limiter.acquire("holder")
+    order = []
+
+    def worker(session, tag):
+        with limiter.slot(session):
+            order.append(tag)
+
+    threads = []
+    # 会话 a 先排了 3 个，会话 b 后排 1 个：b 不用等 a 全部跑完
+    for session, tag in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]:
+        t = threading.Thread(target=worker, args=(session, tag))
+        t.start()
+        threads.append(t)
+        time.sleep(0.02)
+    limiter.release()
+    for t in threads:
+        t.join()
+    assert order.index("b1") < order.index("a3")
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_fair_limiter_rejects_when_queue_full():
+    limiter = FairLLMLimiter(max_concurrency=1, max_queue=0)
+    limiter.acquire()
+    t0 = time.monotonic()
+    with pytest.raises(LLMOverloaded):
+        limiter.acquire()
+    assert time.monotonic() - t0 < 0.1
+    assert limiter.stats()["rejected_queue_full"] == 1
+
+
+def test_fair_limiter_wait_timeout():
+    limiter = FairLLMLimiter(max_concurrency=1, max_wait_s=0.05)
+    limiter.acquire()
+    with pytest.raises(LLMOverloaded):
+        limiter.acquire("s")
+    stats = limiter.stats()
+    assert stats["rejected_timeout"] == 1 and stats["queue_depth"] == 0
+
+
+def test_fair_limiter_withdraws_cancelled_ticket():
+    limiter = FairLLMLimiter(max_concurrency=1, max_wait_s=5.0)
+    limiter.acquire()
+    cancelled = threading.Event()
+    errors = []
+
+    def waiter():
+        try:
+            limiter.acquire("s", cancelled=cancelled)
+        except LLMCancelled as e:
+            errors.append(e)
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    time.sleep(0.05)
+    cancelled.set()
+    t.join(1.0)
+    assert not t.is_alive() and len(errors) == 1
+    # 撤回的请求不占名额：释放后队列为空、在途为 0
+    limiter.release()
+    stats = limiter.stats()
+    assert stats["queue_depth"] == 0 and stats["in_flight"] == 0 and stats["cancelled"] == 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from modules.llm_router import LLMDeadlineExceeded, StageRouter, current_call_abandoned
+
+
+def slow(delays, calls=None):
+    """按模型返回的假 create：sleep 指定秒数后返回模型名"""
+    def create(model):
+        if calls is not None:
+            calls.append(model)
+        time.sleep(delays.get(model, 0))
+        return model
+    return create
+
+
+def test_no_budget_without_slo_or_hedge():
+    router = StageRouter("main")
+    assert router.slo_ms == {}
+    # 没有配置 SLO 与对冲：慢请求照常返回，不被默认预算判失败
+    assert router.call("answer", slow({"main": 0.2})) == "main"
+    assert router.report()["answer"]["timeouts"] == 0
+
+
+def test_explicit_budget_without_hedge():
+    router = StageRouter("main", slo_ms={"answer": {"budget_ms": 50}})
+    t0 = time.perf_counter()
+    with pytest.raises(LLMDeadlineExceeded):
+        router.call("answer", slow({"main": 0.5}))
+    assert time.perf_counter() - t0 < 0.3
+    # 没配置的阶段不受影响
+    assert router.call("cypher", slow({"main": 0.1})) == "main"
+
+
+def test_hedge_wins_when_primary_is_slow():
+    calls = []
+    router = StageRouter("main", hedge_model="fast", slo_ms={"answer": {"hedge_ms": 50, "budget_ms": 2000}})
+    t0 = time.perf_counter()
+    assert router.call("answer", slow({"main": 0.5, "fast": 0.01}, calls)) == "fast"
+    assert time.perf_counter() - t0 < 0.3
+    assert calls == ["main", "fast"]
+    report = router.report()["answer"]
+    assert report["hedged"] == 1 and report["hedge_wins"] == 1
+
+
+def test_no_hedge_when_primary_is_fast():
+    calls = []
+    router = StageRouter("main", hedge_model="fast", slo_ms={"answer": {"hedge_ms": 200}})
+    assert router.call("answer", slow({"main": 0.01}, calls)) == "main"
+    assert calls == ["main"]
+
+
+def test_abandoned_calls_are_flagged():
+    seen = []
+    release = threading.Event()
+
+    def create(model):
+        abandoned = current_call_abandoned()
+        seen.append(abandoned)
+        release.wait(1.0)
+        return model
+
+    router = StageRouter("main", slo_ms={"answer": {"budget_ms": 50}})
+    with pytest.raises(LLMDeadlineExceeded):
+        router.call("answer", create)
+    release.set()
+    assert len(seen) == 1 and seen[0] is not None and seen[0].is_set()
+    # 不在路由器线程池里时没有标记
+    assert current_call_abandoned() is None
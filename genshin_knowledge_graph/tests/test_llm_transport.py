@@ -0,0 +1,118 @@
+import json
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from modules import llm_transport
+from modules.llm_transport import LLMCassette, LLMReplayMiss, RecordReplayClient, request_key
+
+REQUEST = {"model": "test-model", "messages": [{"role": "user", "content": "胡桃的生日是哪天？"}], "temperature": 0}
+
+
+def _completion(content):
+    return {"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "test-model",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]}
+
+
+class DictLLM:
+    """返回可序列化响应体的假客户端，记录每次真实调用"""
+
+    def __init__(self, content):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._content = content
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        return _completion(self._content)
+
+
+@pytest.fixture
+def inner():
+    return DictLLM("7月15日")
+
+
+def test_record_then_replay_without_inner_client(tmp_path, inner):
+    store = str(tmp_path / "cassette.jsonl")
+    recorder = RecordReplayClient(inner, store, mode="record")
+    recorder.chat.completions.create(**REQUEST)
+    assert recorder.stats == {"hits": 0, "misses": 0, "recorded": 1} and len(inner.calls) == 1
+
+    player = RecordReplayClient(None, store, mode="replay")
+    # 键顺序不同的同一请求命中同一条录制
+    reply = player.chat.completions.create(**dict(reversed(list(REQUEST.items()))))
+    assert reply.choices[0].message.content == "7月15日"
+    assert player.stats["hits"] == 1 and len(inner.calls) == 1
+
+    with pytest.raises(LLMReplayMiss):
+        player.chat.completions.create(**dict(REQUEST, temperature=0.7))
+    assert player.stats["misses"] == 1
+
+
+def test_auto_mode_records_only_misses(tmp_path, inner):
+    client = RecordReplayClient(inner, str(tmp_path / "cassette.jsonl"), mode="auto")
+    client.chat.completions.create(**REQUEST)
+    client.chat.completions.create(**REQUEST)
+    assert client.stats == {"hits": 1, "misses": 0, "recorded": 1} and len(inner.calls) == 1
+
+
+def test_record_mode_requires_inner_client(tmp_path):
+    with pytest.raises(ValueError):
+        RecordReplayClient(None, str(tmp_path / "cassette.jsonl"), mode="record")
+
+
+def test_replay_uses_recorded_latency(tmp_path, monkeypatch):
+    store = str(tmp_path / "cassette.jsonl")
+    LLMCassette(store).put(request_key(REQUEST), REQUEST, _completion("7月15日"), elapsed_ms=250.0)
+    sleeps = []
+    monkeypatch.setattr(llm_transport.time, "sleep", sleeps.append)
+
+    RecordReplayClient(None, store, mode="replay", latency_ms="recorded").chat.completions.create(**REQUEST)
+    RecordReplayClient(None, store, mode="replay", latency_ms=40).chat.completions.create(**REQUEST)
+    RecordReplayClient(None, store, mode="replay").chat.completions.create(**REQUEST)
+    assert sleeps == [0.25, 0.04]
+
+
+def test_cassette_keeps_last_record_and_skips_bad_lines(tmp_path):
+    store = tmp_path / "cassette.jsonl"
+    cassette = LLMCassette(str(store))
+    cassette.put("k", REQUEST, _completion("旧"), 1.0)
+    cassette.put("k", REQUEST, _completion("新"), 2.0)
+    with open(store, "a", encoding="utf-8") as f:
+        f.write("not json\n\n")
+    reloaded = LLMCassette(str(store))
+    assert len(reloaded) == 1
+    assert reloaded.get("k")["response"]["choices"][0]["message"]["content"] == "新"
+
+
+def test_mock_server_counts_concurrent_requests(monkeypatch):
+    from scripts.mock_llm_server import MOCK_ANSWER, MockLLMHandler
+
+    monkeypatch.setattr(MockLLMHandler, "stats", {"requests": 0, "hits": 0})
+    monkeypatch.setattr(MockLLMHandler, "cassette", None)
+    monkeypatch.setattr(MockLLMHandler, "latency_ms", 0.0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockLLMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    def post(_):
+        req = urllib.request.Request(base + "/chat/completions", data=json.dumps(REQUEST).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return json.loads(resp.read())["choices"][0]["message"]["content"]
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            replies = list(pool.map(post, range(40)))
+        with urllib.request.urlopen(base + "/stats", timeout=10) as resp:
+            stats = json.loads(resp.read())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert replies == [MOCK_ANSWER] * 40
+    assert stats == {"requests": 40, "hits": 0}
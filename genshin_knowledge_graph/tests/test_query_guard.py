@@ -0,0 +1,78 @@
+from modules.cypher_validator import validate_cypher
+from modules.query_guard import QueryBudget, check_plan, ensure_limit, row_key, run_capped
+
+
+def test_ensure_limit_appends_missing_limit():
+    assert ensure_limit("MATCH (c:character) RETURN c.name;", 120) == "MATCH (c:character) RETURN c.name\nLIMIT 120"
+
+
+def test_ensure_limit_keeps_existing_limit():
+    cypher = "MATCH (c:character) RETURN c.name LIMIT 5"
+    assert ensure_limit(cypher, 120) == cypher
+    cypher = "MATCH (c:character) RETURN c.name LIMIT $n"
+    assert ensure_limit(cypher, 120) == cypher
+
+
+def test_ensure_limit_only_looks_after_last_return():
+    cypher = "MATCH (c:character) WITH c LIMIT 5 MATCH (c)-[:suits]->(a:artifact) RETURN c.name, a.name"
+    assert ensure_limit(cypher, 50).endswith("\nLIMIT 50")
+    assert ensure_limit("CALL db.labels()", 50) == "CALL db.labels()"
+
+
+def test_missing_limit_is_deferred_to_the_guard():
+    # 校验器默认不因缺少 LIMIT 要求重新生成，由 ensure_limit 改写
+    cypher = "MATCH (c:character) RETURN c.name"
+    assert validate_cypher(cypher) == []
+    assert validate_cypher(ensure_limit(cypher, 120), require_limit=True) == []
+    assert validate_cypher(cypher, require_limit=True) == ["查询缺少 LIMIT，请在最后的 RETURN 后加上 LIMIT 20"]
+    # 只返回聚合值的查询只有一行
+    assert validate_cypher("MATCH (c:character) RETURN count(c) AS n", require_limit=True) == []
+
+
+def test_check_plan_rejects_forbidden_and_expensive_operators():
+    plan = {"operatorType": "ProduceResults@neo4j", "args": {"EstimatedRows": 10.0}, "children": [
+        {"operatorType": "CartesianProduct@neo4j", "args": {"EstimatedRows": 300000.0}, "children": [
+            {"operatorType": "AllNodesScan@neo4j", "args": {"EstimatedRows": 10.0}},
+            {"operatorType": "VarLengthExpand(All)@neo4j", "args": {"Details": "(a)-[anon_0*]->(b)"}},
+        ]},
+    ]}
+    reasons = check_plan(plan, QueryBudget(max_estimated_rows=1000))
+    assert any("CartesianProduct" in r for r in reasons)
+    assert any("AllNodesScan" in r for r in reasons)
+    assert any("无上界" in r for r in reasons)
+    assert any("预估行数 300000" in r for r in reasons)
+    assert check_plan({"operatorType": "NodeIndexSeek", "args": {"EstimatedRows": 1.0}}, QueryBudget()) == []
+
+
+def test_row_key_handles_nested_values():
+    assert row_key({"a": 1, "b": "x"}) == row_key({"a": 1, "b": "x"})
+    assert row_key({"a": [1, 2]}) == row_key({"a": [1, 2]}) != row_key({"a": [2, 1]})
+    assert row_key({"a": {"k": [1]}}) == row_key({"a": {"k": [1]}})
+
+
+def test_row_key_does_not_confuse_encoded_values_with_strings():
+    # 嵌套值按 JSON 编码比较，但不能与内容恰好相同的字符串/列表值相等
+    assert row_key({"a": {"x": 1}}) != row_key({"a": '{"x":1}'})
+    assert row_key({"a": {"x": 1}, "b": [1]}) != row_key({"a": '{"x":1}', "b": [1]})
+    assert row_key({"a": [{"x": 1}]}) != row_key({"a": '[{"x":1}]'})
+    assert row_key({"a": [{"x": 1}]}) == row_key({"a": [{"x": 1}]})
+
+
+class ListSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def run(self, query, params=None):
+        return ListResult(self.rows)
+
+
+class ListResult(list):
+    def consume(self):
+        return None
+
+
+def test_run_capped_keeps_distinct_rows_with_lookalike_strings():
+    rows = [{"a": {"x": 1}}, {"a": '{"x":1}'}, {"a": {"x": 1}}]
+    session = ListSession(rows)
+    out, truncated = run_capped(session, "MATCH (n) RETURN n.a AS a", {}, QueryBudget(row_cap=10))
+    assert out == rows[:2] and not truncated
@@ -0,0 +1,75 @@
+import pytest
+
+from modules.similarity import SimilarityIndex
+
+NAMES = ["行秋", "夜兰", "胡桃", "钟离", "神里绫华", "香菱"]
+TRIPLES = {
+    "role_tag": [("行秋", "副C", 0.9), ("行秋", "挂水", 0.8), ("夜兰", "副C", 0.9), ("夜兰", "挂水", 0.5),
+                 ("胡桃", "主C", 1.0), ("钟离", "护盾", 1.0), ("神里绫华", "主C", 1.0), ("香菱", "副C", 0.3)],
+    "element": [("行秋", "水", 1.0), ("夜兰", "水", 1.0), ("胡桃", "火", 1.0), ("钟离", "岩", 1.0),
+                ("神里绫华", "冰", 1.0), ("香菱", "火", 1.0)],
+    "weapon_type": [("行秋", "单手剑", 1.0), ("夜兰", "弓", 1.0), ("胡桃", "长柄武器", 1.0),
+                    ("钟离", "长柄武器", 1.0), ("神里绫华", "单手剑", 1.0), ("香菱", "长柄武器", 1.0)],
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SimilarityIndex(NAMES, TRIPLES)
+
+
+def test_default_facets_rank_shared_role_and_element_first(index):
+    top = index.similar("行秋", k=2)
+    assert [r["name"] for r in top][0] == "夜兰"
+    assert "副C" in top[0]["shared"] and "水" in top[0]["shared"]
+    assert all(0 < r["score"] <= 1 for r in top)
+
+
+def test_facet_weighting_changes_ranking(index):
+    assert index.similar("行秋", k=1, facets=["weapon_type"])[0] == {"name": "神里绫华", "score": 1.0,
+                                                                      "shared": "单手剑"}
+    # 加大武器类型的权重后，同为单手剑的神里绫华超过同元素的夜兰
+    by_weapon = index.similar("行秋", k=2, facets={"element": 1, "weapon_type": 3})
+    assert [r["name"] for r in by_weapon] == ["神里绫华", "夜兰"]
+
+
+def test_cosine_uses_weights_and_jaccard_does_not(index):
+    cosine = index.similar("行秋", k=1, facets=["role_tag"])[0]
+    jaccard = index.similar("行秋", k=1, facets=["role_tag"], metric="jaccard")[0]
+    assert cosine["name"] == jaccard["name"] == "夜兰"
+    assert cosine["score"] < 1.0 and jaccard["score"] == 1.0
+
+
+def test_k_bounds(index):
+    assert index.similar("行秋", k=0) == []
+    everyone = index.similar("行秋", k=100, explain=False)
+    names = [r["name"] for r in everyone]
+    # 不含自身，只返回相似度大于 0 的角色，且按分数降序
+    assert "行秋" not in names and len(names) == len(set(names)) <= len(NAMES) - 1
+    assert [r["score"] for r in everyone] == sorted((r["score"] for r in everyone), reverse=True)
+    assert "钟离" not in names
+
+
+def test_unknown_name_facet_and_metric(index):
+    assert index.similar("不存在的角色") == []
+    assert SimilarityIndex([]).similar("行秋") == []
+    with pytest.raises(ValueError):
+        index.similar("行秋", facets=["身高"])
+    with pytest.raises(ValueError):
+        index.similar("行秋", facets={"element": 0})
+    with pytest.raises(ValueError):
+        index.similar("行秋", metric="euclidean")
+
+
+def test_rank_orders_external_candidates(index):
+    assert index.rank("行秋", ["香菱", "不存在", "夜兰"]) == ["夜兰", "香菱", "不存在"]
+    assert index.rank("不存在", ["香菱", "夜兰"]) == ["香菱", "夜兰"]
+    assert index.rank("行秋", []) == []
+
+
+def test_engine_ranks_role_tag_candidates(make_engine, index):
+    engine = make_engine()
+    engine.similarity_index = index
+    rows = [{"shared_role_tag": "副C", "candidates": ["香菱", "夜兰"]}, {"shared_role_tag": "挂水"}]
+    assert engine._rank_role_tag_candidates("行秋", rows) == [
+        {"shared_role_tag": "副C", "candidates": ["夜兰", "香菱"]}, {"shared_role_tag": "挂水"}]
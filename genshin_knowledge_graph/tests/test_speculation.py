@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from modules.llm_limiter import FairLLMLimiter, llm_rate_limit
+
+QUESTION = "胡桃专武是什么"
+WEAPON_ROWS = [{"character": "胡桃", "weapons": ["护摩之杖"]}]
+
+
+@pytest.fixture
+def engine(make_engine, fake_driver, fake_llm):
+    return make_engine(llm=fake_llm(reply=lambda kwargs: "MATCH (c:character) RETURN c.name AS name LIMIT 5"),
+                       driver=fake_driver(rows=lambda q, p: []))
+
+
+@pytest.mark.parametrize("rows", [
+    [{"character": "胡桃", "weapons": ["护摩之杖"]}],
+    [{"weapon": "护摩之杖", "users": ["胡桃", "香菱"]}],
+])
+def test_speculation_accepts_rows_with_subject_and_value(engine, rows):
+    assert engine._speculation_ok({"params": {"name": "胡桃"}}, rows)
+
+
+@pytest.mark.parametrize("rows", [
+    [],
+    None,
+    [{"character": "胡桃", "weapons": []}],
+    [{"character": "胡桃"}],
+    [{"character": "钟离", "weapons": ["护摩之杖"]}],
+    ["胡桃"],
+])
+def test_speculation_rejects_empty_or_unrelated_rows(engine, rows):
+    assert not engine._speculation_ok({"params": {"name": "胡桃"}}, rows)
+
+
+def test_speculation_rejects_truncated_rows(engine):
+    cap = engine.query_budget.row_cap
+    rows = [{"character": "胡桃", "weapons": [f"武器{i}"]} for i in range(cap)]
+    assert not engine._speculation_ok({"params": {"name": "胡桃"}}, rows)
+    assert engine._speculation_ok({"params": {"name": "胡桃"}}, rows[:cap - 1])
+
+
+def test_speculation_without_subject_only_needs_values(engine):
+    assert engine._speculation_ok({"params": {}}, [{"name": "胡桃"}])
+    assert not engine._speculation_ok({"params": None}, [{"name": None}])
+
+
+class GateBucket:
+    """代替限速令牌桶：LLM 请求走到这里时通知测试，并停住直到放行"""
+
+    def __init__(self):
+        self.reached = threading.Event()
+        self.release = threading.Event()
+
+    def acquire(self):
+        self.reached.set()
+        assert self.release.wait(5)
+
+
+def test_winning_template_withdraws_llm_request_before_it_is_sent(make_engine, fake_driver, fake_llm):
+    gate = GateBucket()
+
+    def rows(query, params):
+        # 候选模板查询等 LLM 请求已经开始（线程池里的任务无法再 cancel）后才返回
+        assert gate.reached.wait(5)
+        return WEAPON_ROWS
+
+    llm = fake_llm(reply=lambda kwargs: "MATCH (c:character) RETURN c.name AS name LIMIT 5")
+    engine = make_engine(llm=llm, driver=fake_driver(rows=rows))
+    engine.llm_admission = FairLLMLimiter(max_concurrency=2)
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        with llm_rate_limit(gate):
+            plan = engine._plan_by_llm(QUESTION, llm_pool=pool)
+        gate.release.set()
+    finally:
+        pool.shutdown(wait=True)
+
+    assert plan["source"] == "speculative" and plan["prefetched"] == WEAPON_ROWS
+    assert llm.calls == []
+    assert engine.llm_admission.stats()["cancelled"] == 1
+    assert engine.speculation_report()["llm_abandoned"] == 1
+
+
+def test_losing_template_waits_for_llm(engine):
+    plan = engine._plan_by_llm(QUESTION)
+    assert plan["source"] == "llm" and plan["cypher"].startswith("MATCH (c:character)")
+    assert len(engine.client.calls) == 1
+    assert engine.speculation_report()["misses"] == 1
@@ -0,0 +1,28 @@
+from modules.team_table import TeamTable
+
+
+def test_write_and_read_back(tmp_path):
+    table = TeamTable(str(tmp_path / "team.sqlite"))
+    counts = table.write([("substitute", "行秋", [{"candidate": "夜兰", "score": 0.9}]),
+                          ("team_recommend", "胡桃", [])], meta={"graph_fingerprint": "abc"})
+    assert counts == {"team_recommend": 1, "substitute": 1, "substitute_role_tag": 0}
+    assert table.get("substitute", "行秋") == [{"candidate": "夜兰", "score": 0.9}]
+    assert table.get("team_recommend", "胡桃") == []
+    assert table.get("substitute", "钟离") is None
+    assert TeamTable.open(str(tmp_path / "missing.sqlite")) is None
+
+
+def test_graph_fingerprint_stamp(tmp_path):
+    table = TeamTable(str(tmp_path / "team.sqlite"))
+    table.write([], meta={"graph_fingerprint": "abc123"})
+    assert table.is_current("abc123")
+    # 重新导入图谱后指纹变化：整表跳过
+    assert not table.is_current("def456")
+    # 当前指纹未知（连不上数据库）时照常使用
+    assert table.is_current(None)
+
+
+def test_table_without_stamp_is_stale(tmp_path):
+    table = TeamTable(str(tmp_path / "team.sqlite"))
+    table.write([("substitute", "行秋", [])])
+    assert not table.is_current("abc123")
@@ -0,0 +1,63 @@
+import pytest
+
+from modules.text_retriever import TextRetriever, build_index, detect_sources, split_passages, tokenize
+
+DOCS = [
+    {"source": "story", "character": "胡桃", "title": "角色故事1", "text": "胡桃是往生堂第七十七代堂主，喜欢写打油诗。"},
+    {"source": "story", "character": "钟离", "title": "角色故事1", "text": "钟离是往生堂的客卿，见识渊博。"},
+    {"source": "voice", "character": "胡桃", "title": "关于钟离", "text": "那个客卿啊，总是一副老古董的样子。"},
+    {"source": "strategy", "character": "胡桃", "title": "定位", "text": "胡桃是火元素主C，蒸发反应是主要输出方式。"},
+]
+
+
+@pytest.fixture(scope="module")
+def retriever(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("text_index")
+    meta = build_index(DOCS, str(folder))
+    assert meta["n_docs"] == 4
+    assert meta["source_counts"] == {"story": 2, "voice": 1, "strategy": 1}
+    return TextRetriever.open(str(folder))
+
+
+def test_tokenize_bigrams_and_words():
+    assert tokenize("胡桃C") == ["胡桃", "c"]
+    assert tokenize("火") == ["火"]
+    assert tokenize("往生堂 abc 12") == ["往生", "生堂", "abc", "12"]
+
+
+def test_detect_sources():
+    assert detect_sources("钟离的故事是什么") == ["story"]
+    assert detect_sources("胡桃有哪些语音台词") == ["voice"]
+    assert detect_sources("胡桃的详细信息") is None
+
+
+def test_split_passages_respects_max_chars():
+    text = "一二三四五。" * 10 + "长" * 25
+    passages = split_passages(text, max_chars=20)
+    assert all(len(p) <= 20 for p in passages)
+    assert "".join(passages) == text
+
+
+def test_search_ranks_matching_passage_first(retriever):
+    hits = retriever.search("往生堂客卿")
+    assert hits[0]["character"] == "钟离"
+    assert hits[0]["source"] == "角色故事"
+    assert [h["score"] for h in hits] == sorted((h["score"] for h in hits), reverse=True)
+
+
+def test_search_filters_by_character_and_source(retriever):
+    hits = retriever.search("胡桃 客卿", character="胡桃", sources=["voice"])
+    assert [h["title"] for h in hits] == ["关于钟离"]
+    # 过滤范围内没有命中任何查询词时，按文档顺序返回该范围内的段落
+    hits = retriever.search("胡桃的语音", character="胡桃", sources=["voice"])
+    assert len(hits) == 1 and hits[0]["source"] == "角色语音"
+
+
+def test_search_is_deterministic(retriever):
+    assert retriever.search("往生堂", k=3) == retriever.search("往生堂", k=3)
+    assert retriever.search("完全不相关的词") == []
+
+
+def test_open_missing_index_returns_none(tmp_path):
+    assert TextRetriever.open(str(tmp_path / "none")) is None
+    assert TextRetriever.open(None) is None
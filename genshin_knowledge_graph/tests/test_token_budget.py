@@ -0,0 +1,46 @@
+from modules.token_budget import encode_columnar, estimate_tokens, fit_rows, prune_columns
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("胡桃") == 2
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens(["胡桃"]) == estimate_tokens('["胡桃"]')
+
+
+def test_prune_columns_drops_low_value_and_lifts_constants():
+    rows = [
+        {"name": "胡桃", "country": "璃月", "img_src": "http://x", "note": None},
+        {"name": "钟离", "country": "璃月", "img_src": "http://y", "note": ""},
+    ]
+    kept, constants, dropped = prune_columns(rows)
+    assert kept == ["name"]
+    assert constants == {"country": "璃月"}
+    assert dropped == ["img_src", "note"]
+
+
+def test_encode_columnar():
+    text = encode_columnar([{"a": "x|y", "b": ["1", "2"]}, {"a": True, "b": None}], ["a", "b"], {"c": "k"})
+    assert text.split("\n") == ["# 所有行 c = k", "a|b", "x/y|1、2", "是|"]
+
+
+def test_fit_rows_within_budget_keeps_everything():
+    rows = [{"name": f"角色{i}", "weapon": "护摩之杖"} for i in range(5)]
+    text, report = fit_rows(rows, budget_tokens=1000)
+    assert report["rows_out"] == 5 and report["tokens"] <= 1000
+    assert report["saved_tokens"] > 0
+    assert "# 所有行 weapon = 护摩之杖" in text
+
+
+def test_fit_rows_truncates_then_drops_rows():
+    rows = [{"name": f"角色{i}", "description": f"第{i}段很长的描述" * 40, "x": i} for i in range(30)]
+    text, report = fit_rows(rows, budget_tokens=300)
+    assert report["tokens"] <= 300
+    assert 1 <= report["rows_out"] < 30
+    assert text.endswith("# 其余结果从略（未全部列出）")
+    # 截短的单元格带省略号
+    assert "…" in text
+
+
+def test_fit_rows_ignores_non_dict_rows():
+    text, report = fit_rows([{"a": 1}, "oops", None], budget_tokens=100)
+    assert report["rows_in"] == 1 and text == "a\n1"
@@ -0,0 +1,119 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from modules.tracing import SERVICE_NAME, Tracer, waterfall_rows
+
+
+def _by_name(spans):
+    return {s["name"]: s for s in spans}
+
+
+def test_nested_spans_get_parent_ids():
+    tracer = Tracer()
+    with tracer.span("qa.ask", question="胡桃的生日") as root:
+        with tracer.span("qa.plan") as plan:
+            with tracer.span("qa.llm", stage="plan"):
+                pass
+        with tracer.span("qa.db") as db:
+            db.set(rows=3)
+        assert tracer.current() is root
+    assert tracer.current() is None
+
+    spans = _by_name(tracer.last_trace())
+    assert set(spans) == {"qa.ask", "qa.plan", "qa.llm", "qa.db"}
+    assert spans["qa.ask"]["parent_id"] is None
+    assert spans["qa.plan"]["parent_id"] == spans["qa.db"]["parent_id"] == root.span_id
+    assert spans["qa.llm"]["parent_id"] == plan.span_id
+    assert spans["qa.db"]["attributes"] == {"rows": 3}
+    assert len({s.trace_id for s in (root, plan, db)}) == 1
+
+
+def test_error_is_recorded_and_reraised():
+    tracer = Tracer()
+    with pytest.raises(ValueError):
+        with tracer.span("qa.ask"):
+            with tracer.span("qa.db"):
+                raise ValueError("boom")
+    spans = _by_name(tracer.last_trace())
+    assert spans["qa.db"]["error"] == "ValueError: boom"
+    assert spans["qa.ask"]["error"] == "ValueError: boom"
+
+
+def test_bind_attaches_pool_spans_to_caller_trace():
+    tracer = Tracer()
+    seen = {}
+
+    def work(i):
+        with tracer.span("qa.llm", attempt=i) as sp:
+            seen[i] = (sp.trace_id, sp.parent_id, threading.get_ident())
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        with tracer.span("qa.ask") as root:
+            bound = tracer.bind(work)
+            list(pool.map(bound, [0, 1]))
+        # 不经 bind 提交的任务拿不到调用方的 span，会自成一条 trace
+        with tracer.span("qa.other") as other:
+            pool.submit(work, 2).result()
+
+    assert seen[0][:2] == seen[1][:2] == (root.trace_id, root.span_id)
+    assert seen[0][2] != threading.get_ident()
+    assert seen[2][0] != other.trace_id and seen[2][1] is None
+    assert [s["name"] for s in tracer.last_trace()] == ["qa.other"]
+
+
+def test_span_after_root_finished_is_dropped():
+    tracer = Tracer()
+
+    def late_llm():
+        with tracer.span("qa.llm"):
+            pass
+
+    with tracer.span("qa.ask"):
+        late = tracer.bind(late_llm)
+    late()
+    assert [s["name"] for s in tracer.last_trace()] == ["qa.ask"]
+
+
+def test_otlp_json_export(tmp_path):
+    path = tmp_path / "logs" / "traces.jsonl"
+    tracer = Tracer(str(path))
+    with tracer.span("qa.ask", question="胡桃", rows=2, score=0.5, cached=False, extra={"a": 1}):
+        with tracer.span("qa.db"):
+            pass
+    with tracer.span("qa.ask"):
+        pass
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    record = json.loads(lines[0])["resourceSpans"][0]
+    assert record["resource"]["attributes"][0] == {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+    spans = record["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert root["parentSpanId"] == "" and child["parentSpanId"] == root["spanId"]
+    assert root["traceId"] == child["traceId"] and len(root["traceId"]) == 32
+    assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+    assert root["status"] == {"code": "STATUS_CODE_OK"}
+    assert {a["key"]: a["value"] for a in root["attributes"]} == {
+        "question": {"stringValue": "胡桃"}, "rows": {"intValue": "2"}, "score": {"doubleValue": 0.5},
+        "cached": {"boolValue": False}, "extra": {"stringValue": '{"a": 1}'},
+    }
+
+
+def test_waterfall_rows():
+    spans = [
+        {"name": "qa.ask", "span_id": "a", "parent_id": None, "start_ns": 1_000_000, "end_ns": 9_000_000,
+         "attributes": {}, "error": None},
+        {"name": "qa.plan", "span_id": "b", "parent_id": "a", "start_ns": 2_000_000, "end_ns": 4_000_000,
+         "attributes": {"intent": "x"}, "error": None},
+        {"name": "qa.llm", "span_id": "c", "parent_id": "b", "start_ns": 2_500_000, "end_ns": None,
+         "attributes": {}, "error": "LLMDeadlineExceeded: plan"},
+    ]
+    rows = waterfall_rows(spans)
+    assert [r["span"] for r in rows] == ["qa.ask", "  qa.plan", "    qa.llm"]
+    assert [(r["start_ms"], r["end_ms"], r["duration_ms"]) for r in rows] == [
+        (0.0, 8.0, 8.0), (1.0, 3.0, 2.0), (1.5, 1.5, 0.0)]
+    assert rows[2]["error"] == "LLMDeadlineExceeded: plan"
+    assert waterfall_rows([]) == []